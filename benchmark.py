@@ -0,0 +1,1132 @@
+"""Бенчмарки бота.
+
+Запуск: python benchmark.py [набор ...] [--json results.json]
+
+Наборы: scheduler, countdown, session, storage, fsm, dispatcher, database, metrics,
+startup, rollup, stats, routing, shutdown, throttle, compaction, webhook, consistency.
+С --json результаты и метаданные (коммит, версия Python) пишутся в файл,
+чтобы сравнивать их между коммитами.
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, Update
+
+from scheduler import TimerScheduler
+
+SUITES = ("scheduler", "countdown", "session", "storage", "fsm", "dispatcher", "database", "metrics",
+          "startup", "rollup", "stats", "routing", "shutdown", "throttle", "compaction", "webhook",
+          "consistency")
+
+
+async def _measure_lag(stop: asyncio.Event, interval: float, lags: list):
+    """Насколько опаздывает цикл событий относительно ожидаемого пробуждения"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def bench_scheduler(sessions: int, seconds: float = 30.0, interval: float = 30.0):
+    """N одновременных сессий с тиком раз в interval секунд"""
+    scheduler = TimerScheduler()
+    fired = 0
+
+    async def on_tick(remaining):
+        nonlocal fired
+        fired += 1
+
+    async def on_expire():
+        pass
+
+    start = time.perf_counter()
+    for user_id in range(sessions):
+        # Разносим старты, как у реальных пользователей
+        scheduler.schedule(user_id, 3600 + random.random() * interval,
+                           on_expire=on_expire, on_tick=on_tick, interval=interval)
+    schedule_time = time.perf_counter() - start
+
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(_measure_lag(stop, 0.05, lags))
+
+    cpu_start = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu_start
+
+    stop.set()
+    await lag_task
+
+    # Проверяем отмену, паузу и продолжение
+    start = time.perf_counter()
+    for user_id in range(sessions):
+        scheduler.pause(user_id)
+        scheduler.resume(user_id)
+        scheduler.cancel(user_id)
+    control_time = time.perf_counter() - start
+
+    return {
+        "sessions": sessions,
+        "schedule_us_per_session": schedule_time / sessions * 1e6,
+        "pause_resume_cancel_us_per_session": control_time / sessions * 1e6,
+        "ticks_fired": fired,
+        "cpu_percent": cpu / seconds * 100,
+        "lag_p50_ms": _percentile(lags, 0.50) * 1000,
+        "lag_p99_ms": _percentile(lags, 0.99) * 1000,
+        "lag_max_ms": max(lags) * 1000 if lags else 0.0,
+    }
+
+
+def bench_countdown_calls(minutes_list=(15, 25, 50, 90)):
+    """Вызовы API на одну сессию: старые напоминания раз в 30 с и живой статус"""
+    from handlers import status_cadence
+
+    results = []
+    for minutes in minutes_list:
+        remaining = minutes * 60
+        edits = 0
+        while True:
+            remaining = status_cadence(remaining)
+            if remaining <= 0:
+                break
+            edits += 1
+        # +1 - сообщение о завершении в обоих вариантах
+        old_calls = minutes * 60 // 30 + 1
+        new_calls = edits + 1
+        results.append({
+            "minutes": minutes,
+            "old_calls": old_calls,
+            "new_calls": new_calls,
+            "reduction": old_calls / new_calls,
+        })
+    return results
+
+
+def _legacy_session(user_id: int) -> dict:
+    """Сессия в прежнем виде: словарь с ISO-строкой старта"""
+    now = datetime.now()
+    return {
+        "id": f"{user_id}_{now.timestamp()}",
+        "task": "Работа",
+        "duration": 1500,
+        "start_time": now.isoformat(),
+        "paused": False,
+        "paused_time": 0,
+        "chat_id": user_id
+    }
+
+
+def _legacy_remaining(session: dict) -> float:
+    start_time = datetime.fromisoformat(session["start_time"])
+    elapsed = (datetime.now() - start_time).total_seconds() - session["paused_time"]
+    return session["duration"] - elapsed
+
+
+def _allocated(factory, sessions: int) -> float:
+    """Байт памяти на одну активную сессию"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    active = {user_id: factory(user_id) for user_id in range(sessions)}
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(active)
+
+
+def bench_session(sessions: int, lookups: int = 200_000):
+    """Словарь с ISO-строкой против Session: память и вычисление остатка"""
+    from session import Session
+
+    results = []
+    for name, factory, remaining in (
+        ("dict", _legacy_session, _legacy_remaining),
+        ("slots", lambda user_id: Session(user_id, "Работа", 1500, user_id), Session.remaining),
+    ):
+        bytes_per_session = _allocated(factory, sessions)
+        session = factory(1)
+        start = time.perf_counter()
+        for _ in range(lookups):
+            remaining(session)
+        results.append({
+            "kind": name,
+            "sessions": sessions,
+            "bytes_per_session": bytes_per_session,
+            "remaining_ns": (time.perf_counter() - start) / lookups * 1e9,
+        })
+    return results
+
+
+def _fake_users(users: int, days: int = 1) -> dict:
+    """Записи пользователей в формате SimpleDatabase"""
+    first_day = datetime(2026, 10, 1).toordinal()
+    return {
+        str(user_id): {
+            "total_sessions": 10 * days,
+            "total_time": (15000 + user_id) * days,
+            "last_active": "2026-10-01T12:00:00",
+            "tasks": {"Работа": {"sessions": 10 * days, "time": (15000 + user_id) * days}},
+            "days": {datetime.fromordinal(first_day - day).date().isoformat(): [10, 15000 + user_id]
+                     for day in range(days)},
+        }
+        for user_id in range(users)
+    }
+
+
+async def bench_storage(users: int, shards: int, writes: int = 50):
+    """Задержка записи сессии без журнала (каждая запись - снимок) при N пользователях"""
+    from database import SimpleDatabase
+    from session import Session
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "data.json")
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({"users": _fake_users(users), "daily_stats": {}}, f, ensure_ascii=False)
+        # Из общего файла в сегменты: первая запись разложит всех пользователей
+        db = SimpleDatabase(filename, journal=False, shards=shards, snapshot_format="json")
+        db._save_data()
+
+        latencies = []
+        written = 0
+        for i in range(writes):
+            user_id = random.randrange(users)
+            session = Session(user_id, "Работа", 1500)
+            start = time.perf_counter()
+            files = db._dump_data()
+            db._write_snapshot(files)
+            db._apply_session({"n": i + 1, "u": str(user_id), "t": session.task, "d": 1500,
+                               "ts": datetime.now().isoformat()})
+            latencies.append(time.perf_counter() - start)
+            written += sum(len(blob) for _, blob in files)
+        await db.close()
+
+    return {
+        "users": users,
+        "shards": shards,
+        "write_p50_ms": _percentile(latencies, 0.50) * 1000,
+        "write_p99_ms": _percentile(latencies, 0.99) * 1000,
+        "kb_per_write": written / writes / 1024,
+    }
+
+
+async def bench_compaction(users: int, snapshot_format: str, sessions: int = 200, compact_every: int = 50):
+    """Задержка цикла событий, пока сессии пишутся и журнал сворачивается в снимок.
+
+    encode_ms - сериализация снимка целиком: столько цикл событий стоял бы,
+    если бы снимок собирался в нем. Теперь в цикле только заморозка
+    (freeze_ms), а сериализация идет в потоке писателя.
+    """
+    from database import SimpleDatabase
+    import snapshot
+
+    fake_users = _fake_users(users, days=7)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "data.json")
+        if snapshot_format == "binary":
+            with open(os.path.join(directory, "data.snap"), 'wb') as f:
+                f.write(snapshot.encode({"daily_stats": {}}, fake_users))
+        else:
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump({"users": fake_users, "daily_stats": {}}, f, ensure_ascii=False)
+        del fake_users
+        db = SimpleDatabase(filename, compact_every=compact_every, snapshot_format=snapshot_format)
+        rnd = random.Random(1)
+        # Часть пользователей уже заходила: их записи разобраны и меняются
+        for user_id in rnd.sample(range(users), min(users, 1000)):
+            await db.get_user_stats(user_id)
+
+        start = time.perf_counter()
+        db._dump_data()
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        db._freeze_data()
+        freeze_time = time.perf_counter() - start
+
+        stop = asyncio.Event()
+        lags = []
+        lag_task = asyncio.create_task(_measure_lag(stop, 0.005, lags))
+        start = time.perf_counter()
+        for _ in range(sessions):
+            user_id = rnd.randrange(users)
+            db.start_session(user_id, "Работа", 25)
+            await db.end_session(user_id)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await lag_task
+        await db.close()
+
+    return {
+        "users": users,
+        "format": snapshot_format,
+        "snapshots": sessions * 2 // compact_every,
+        "encode_ms": encode_time * 1000,
+        "freeze_ms": freeze_time * 1000,
+        "session_ms": elapsed / sessions * 1000,
+        "lag_p99_ms": _percentile(lags, 0.99) * 1000,
+        "lag_max_ms": max(lags) * 1000 if lags else 0.0,
+    }
+
+
+async def bench_consistency(backend: str, ops: int = 3000, users: int = 200):
+    """Сколько стоят нагрузка, сверка счетчиков с полным пересчетом и перезапуск.
+
+    Правильность сверки проверяет tests/test_consistency.py; здесь только замеры.
+    """
+    from database import SimpleDatabase
+    from sqlite_db import SQLiteDatabase
+
+    rnd = random.Random(1)
+    sessions = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        if backend == "sqlite":
+            def open_db():
+                return SQLiteDatabase(os.path.join(directory, "data.db"))
+        else:
+            def open_db():
+                # Снимок раз в 97 записей: при перезапуске есть и снимок, и хвост журнала
+                return SimpleDatabase(os.path.join(directory, "data.json"), compact_every=97,
+                                      snapshot_format=backend)
+
+        db = open_db()
+        start = time.perf_counter()
+        for _ in range(ops):
+            user_id = rnd.randrange(users)
+            session = db.get_session(user_id)
+            if session is None:
+                db.start_session(user_id, rnd.choice(("Работа", "Учеба")), 1500, chat_id=user_id)
+            elif rnd.random() < 0.3:
+                if session.paused:
+                    db.resume_session(user_id)
+                else:
+                    db.pause_session(user_id)
+            else:
+                await db.end_session(user_id)
+                sessions += 1
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        consistent = await db.check_consistency()
+        check = time.perf_counter() - start
+        await db.close()
+
+        start = time.perf_counter()
+        db = open_db()  # Проигрывание журнала (SQLite - чтение таблиц)
+        restart = time.perf_counter() - start
+        await db.close()
+
+    return {
+        "backend": backend,
+        "ops": ops,
+        "sessions": sessions,
+        "us_per_op": elapsed / ops * 1e6,
+        "check_ms": check * 1000,
+        "restart_ms": restart * 1000,
+        "consistent": consistent,
+    }
+
+
+def _fsm_worker(filename: str, worker: int, ops: int, users: int, results):
+    """Процесс бота: синтетическая нагрузка на общее FSM-хранилище"""
+    from aiogram.fsm.storage.base import StorageKey
+    from fsm_storage import SQLiteStorage
+
+    async def load():
+        storage = SQLiteStorage(filename)
+        latencies = []
+        rng = random.Random(worker)
+        for i in range(ops):
+            user_id = rng.randrange(users)
+            key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            roll = rng.random()
+            start = time.perf_counter()
+            if roll < 0.5:
+                await storage.get_state(key)
+                await storage.get_data(key)
+            elif roll < 0.8:
+                # Оба процесса пишут в данные одних и тех же пользователей
+                await storage.update_data(key, {f"w{worker}": i})
+            else:
+                await storage.set_state(key, "PomodoroStates:waiting_for_custom_task")
+            latencies.append(time.perf_counter() - start)
+        stats = storage.stats()
+        await storage.close()
+        return latencies, stats
+
+    start = time.perf_counter()
+    latencies, stats = asyncio.run(load())
+    results.put((worker, time.perf_counter() - start, latencies, stats))
+
+
+async def bench_fsm(workers: int = 2, ops: int = 5000, users: int = 200):
+    """Несколько процессов на одном SQLite FSM-хранилище: скорость и задержка операций.
+
+    Что обновления процессов не теряются, проверяет tests/test_fsm_storage.py.
+    """
+    from fsm_storage import SQLiteStorage
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "fsm.db")
+        SQLiteStorage(filename)._conn.close()  # Схема до старта процессов
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_fsm_worker, args=(filename, worker, ops, users, results))
+                     for worker in range(workers)]
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    latencies = [latency for report in reports for latency in report[2]]
+    return {
+        "workers": workers,
+        "ops_per_worker": ops,
+        "ops_per_second": workers * ops / max(report[1] for report in reports),
+        "latency_p50_ms": _percentile(latencies, 0.50) * 1000,
+        "latency_p99_ms": _percentile(latencies, 0.99) * 1000,
+        "cache_hits": sum(report[3]["hits"] for report in reports),
+        "cache_misses": sum(report[3]["misses"] for report in reports),
+    }
+
+
+# Диспетчер с настоящим роутером и заглушкой вместо Telegram API
+class StubSession(BaseSession):
+    """Сессия бота без сети: на любой запрос сразу отвечает правдоподобным результатом"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if method.__returning__ is bool:
+            return True
+        chat_id = getattr(method, "chat_id", None) or 0
+        return Message(message_id=next(self._message_ids), date=datetime.now(),
+                       chat=Chat(id=chat_id, type="private"))
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+# Сценарий пользователя: (шаг, текст сообщения или данные колбэка)
+USER_FLOW = (
+    ("start", "message", "/start"),
+    ("start_session_button", "message", "🍅 Начать сессию"),
+    ("process_task_type", "callback", "task_work"),
+    ("process_duration", "callback", "duration_25"),
+    ("time_left", "message", "⏱ Осталось времени"),
+    ("pause_session", "message", "⏸ Пауза"),
+    ("resume_session", "message", "▶️ Продолжить"),
+    ("stop_session", "message", "🛑 Завершить"),
+    ("stats_button", "message", "📊 Статистика"),
+    ("process_stats_today", "callback", "stats_today"),
+    ("process_stats_week", "callback", "stats_week"),
+    ("process_stats_rating", "callback", "stats_rating"),
+    ("tips_button", "message", "💡 Совет"),
+    ("process_tips", "callback", "tip_focus"),
+    ("process_custom_task", "callback", "custom_task"),
+    ("process_custom_task_name", "message", "Подготовка к экзамену"),
+)
+
+
+_dispatcher = None
+
+
+def _router_dispatcher() -> Dispatcher:
+    """Диспетчер с роутером бота. Роутер подключается только к одному диспетчеру,
+    поэтому он общий для всех наборов"""
+    global _dispatcher
+    if _dispatcher is None:
+        from handlers import router
+        _dispatcher = Dispatcher(storage=MemoryStorage())
+        _dispatcher.include_router(router)
+    return _dispatcher
+
+
+def make_update(bot, update_id: int, user_id: int, kind: str, payload: str):
+    """Синтетический Update от пользователя user_id, уже привязанный к боту"""
+    return Update.model_validate(_update_body(bot, update_id, user_id, kind, payload), context={"bot": bot})
+
+
+def _update_body(bot, update_id: int, user_id: int, kind: str, payload: str) -> dict:
+    """Update в том виде, в каком его присылает Telegram"""
+    user = {"id": user_id, "is_bot": False, "first_name": "Bench"}
+    chat = {"id": user_id, "type": "private"}
+    date = int(time.time())
+    if kind == "message":
+        body = {"message": {"message_id": update_id, "date": date, "chat": chat, "from": user, "text": payload}}
+    else:
+        bot_message = {"message_id": update_id, "date": date, "chat": chat,
+                       "from": {"id": bot.id, "is_bot": True, "first_name": "NoProk"}, "text": "..."}
+        body = {"callback_query": {"id": str(update_id), "from": user, "chat_instance": str(user_id),
+                                   "data": payload, "message": bot_message}}
+    return {"update_id": update_id, **body}
+
+
+async def bench_webhook(updates: int = 1000):
+    """Webhook-сервер с настоящим роутером и заглушкой Telegram: задержка ответа и пропускная способность.
+
+    Секретный токен и /health проверяет tests/test_webhook.py; здесь только замеры.
+    """
+    from aiohttp.test_utils import TestClient, TestServer
+    from webhook import create_app
+
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    session = StubSession()
+    bot = Bot(token="123456:BENCHMARK", session=session)
+    secret = "bench-secret"
+    app = create_app(_router_dispatcher(), bot, secret)
+    update_ids = itertools.count(1)
+
+    async with TestClient(TestServer(app)) as client:
+        latencies = []
+        start = time.perf_counter()
+        for user_id in range(updates):
+            body = _update_body(bot, next(update_ids), 2_000_000 + user_id, "message", "/start")
+            request_start = time.perf_counter()
+            await client.post("/webhook", json=body, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+            latencies.append(time.perf_counter() - request_start)
+        elapsed = time.perf_counter() - start
+
+        # Обработчики работают в фоне: ждем ответ на каждый /start
+        deadline = time.perf_counter() + 10
+        while session.requests < updates and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+    return {
+        "updates": updates,
+        "handled": session.requests,
+        "updates_per_second": updates / elapsed,
+        "response_p50_ms": _percentile(latencies, 0.50) * 1000,
+        "response_p99_ms": _percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def bench_dispatcher(users: int = 500, concurrency: int = 50):
+    """Сценарии пользователей через настоящий роутер.
+
+    Задержка обработчиков меряется на последовательном проходе (иначе в
+    нее войдет ожидание в очереди цикла событий), пропускная способность -
+    на проходе с concurrency сценариями одновременно.
+    """
+    from scheduler import scheduler
+
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    session = StubSession()
+    bot = Bot(token="123456:BENCHMARK", session=session)
+    dispatcher = _router_dispatcher()
+
+    update_ids = itertools.count(1)
+    user_ids = itertools.count(1_000_000)
+
+    async def user_flow(latencies=None):
+        user_id = next(user_ids)
+        for step, kind, payload in USER_FLOW:
+            update = make_update(bot, next(update_ids), user_id, kind, payload)
+            start = time.perf_counter()
+            await dispatcher.feed_update(bot, update)
+            if latencies is not None:
+                latencies[step].append(time.perf_counter() - start)
+        scheduler.cancel(user_id)
+
+    latencies = defaultdict(list)
+    for _ in range(users):
+        await user_flow(latencies)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            await user_flow()
+
+    requests_before = session.requests
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(users)))
+    elapsed = time.perf_counter() - start
+    total = users * len(USER_FLOW)
+
+    results = [{
+        "handler": "all",
+        "users": users,
+        "concurrency": concurrency,
+        "updates": total,
+        "updates_per_second": total / elapsed,
+        "api_calls_per_update": (session.requests - requests_before) / total,
+    }]
+    for step, values in latencies.items():
+        results.append({
+            "handler": step,
+            "count": len(values),
+            "p50_ms": _percentile(values, 0.50) * 1000,
+            "p95_ms": _percentile(values, 0.95) * 1000,
+            "p99_ms": _percentile(values, 0.99) * 1000,
+        })
+    return results
+
+
+async def bench_stats(users: int, viewers: int = 200, rounds: int = 5, save_every: int = 50):
+    """Экраны статистики через роутер: без кэша и с кэшем.
+
+    Каждые save_every нажатий кто-то завершает сессию, и версия статистики растет.
+    """
+    from database import db
+    from leaderboard import Leaderboard
+    from session import Session
+    from stats_cache import RenderCache
+    import handlers
+
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    bot = Bot(token="123456:BENCHMARK", session=StubSession())
+    dispatcher = _router_dispatcher()
+
+    db.data["users"] = _fake_users(users, days=7)
+    db.leaderboard = Leaderboard.from_users(db.data["users"])
+    db.totals = db._count_totals()
+    rnd = random.Random(1)
+    today = datetime.now().date()
+    for day in range(60):
+        db.data["daily_stats"][(today - timedelta(days=day)).isoformat()] = {
+            "sessions": 1000, "time": 1500000, "users": {str(rnd.randrange(users)) for _ in range(500)}}
+
+    update_ids = itertools.count(1)
+    results = []
+    for mode, cache_size in (("uncached", 0), ("cached", 4096)):
+        handlers.stats_cache = cache = RenderCache(cache_size)
+        latencies = defaultdict(list)
+        taps = 0
+        for _ in range(rounds):
+            for viewer in range(viewers):
+                for screen in ("today", "week", "all", "rating"):
+                    update = make_update(bot, next(update_ids), viewer, "callback", f"stats_{screen}")
+                    start = time.perf_counter()
+                    await dispatcher.feed_update(bot, update)
+                    latencies[screen].append(time.perf_counter() - start)
+                    taps += 1
+                    if taps % save_every == 0:
+                        user_id = rnd.randrange(users)
+                        db.active_sessions[user_id] = Session(user_id, "Работа", 1500)
+                        await db.end_session(user_id)
+        for screen, values in latencies.items():
+            results.append({
+                "mode": mode,
+                "screen": screen,
+                "users": users,
+                "p50_ms": _percentile(values, 0.50) * 1000,
+                "p99_ms": _percentile(values, 0.99) * 1000,
+                "hit_rate": cache.hits / max(cache.hits + cache.misses, 1),
+            })
+    return results
+
+
+async def bench_throttle(users: int, normal: int = 200, abusers: int = 5, seconds: float = 5.0,
+                         abuse_rate: float = 100.0):
+    """Нагрузка: обычные пользователи и несколько флудеров без анти-флуда и с ним.
+
+    Обычный пользователь открывает экран статистики в среднем раз в 2 с и
+    ждет ответа; флудер шлет abuse_rate нажатий в секунду, не дожидаясь
+    ответов, как при handle_as_tasks. Кэш экранов выключен, так что каждое
+    пропущенное нажатие - полный проход по данным. Прогоны: без флудеров,
+    с флудерами без анти-флуда и с ним - на MemoryStorage и на SQLite-хранилище
+    FSM, которое бот использует по умолчанию.
+    """
+    from database import db
+    from fsm_storage import SQLiteStorage
+    from leaderboard import Leaderboard
+    from stats_cache import RenderCache
+    from throttle import ThrottlingMiddleware
+    import handlers
+
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    bot = Bot(token="123456:BENCHMARK", session=StubSession())
+    dispatcher = _router_dispatcher()
+
+    db.data["users"] = _fake_users(users, days=7)
+    db.leaderboard = Leaderboard.from_users(db.data["users"])
+    db.totals = db._count_totals()
+    rnd = random.Random(1)
+    today = datetime.now().date()
+    for day in range(60):
+        db.data["daily_stats"][(today - timedelta(days=day)).isoformat()] = {
+            "sessions": 1000, "time": 1500000, "users": {str(rnd.randrange(users)) for _ in range(500)}}
+    handlers.stats_cache = RenderCache(0)
+    # Данные живут весь набор: без freeze полные сборки мусора обходят их по 100+ мс
+    # и забивают p99 шумом, не связанным с анти-флудом
+    gc.collect()
+    gc.freeze()
+
+    screens = ("today", "week", "all", "rating")
+    update_ids = itertools.count(1)
+    results = []
+    # Без флудеров - задержка, с которой сравниваются прогоны с флудом
+    runs = ((0, "on"), (abusers, "off"), (abusers, "on"))
+    memory_storage = dispatcher.fsm.storage
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage_name in ("memory", "sqlite"):
+            # Каждый апдейт читает состояние FSM: с SQLite это запрос в потоке хранилища
+            storage = memory_storage if storage_name == "memory" else SQLiteStorage(os.path.join(tmp, "fsm.db"))
+            dispatcher.fsm.storage = storage
+            try:
+                for run_abusers, mode in runs:
+                    results.append(await _throttle_run(dispatcher, bot, rnd, update_ids, screens, storage_name,
+                                                       users, normal, run_abusers, mode, seconds, abuse_rate))
+            finally:
+                dispatcher.fsm.storage = memory_storage
+                if storage is not memory_storage:
+                    await storage.close()
+    gc.unfreeze()
+
+    # Память: поток разовых пользователей не растит таблицу ведер сверх лимита
+    middleware = ThrottlingMiddleware(max_entries=10_000)
+    now = time.monotonic()
+    start = time.perf_counter()
+    for user_id in range(200_000):
+        middleware._take((user_id, "default"), now)
+    results.append({
+        "throttle": "spray",
+        "distinct_users": 200_000,
+        "take_us": (time.perf_counter() - start) / 200_000 * 1e6,
+        "tracked": len(middleware),
+        "tracked_after_idle": (middleware._expire(now + middleware.idle + 1), len(middleware))[1],
+    })
+    return results
+
+
+async def _throttle_run(dispatcher, bot, rnd, update_ids, screens, storage_name: str, users: int,
+                        normal: int, abusers: int, mode: str, seconds: float, abuse_rate: float) -> dict:
+    """Один прогон нагрузки bench_throttle"""
+    from throttle import ThrottlingMiddleware
+
+    middleware = ThrottlingMiddleware()
+    if mode == "on":
+        middleware.install(dispatcher)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+    latencies = []
+    flood = []
+
+    async def normal_user(user_id):
+        while True:
+            # Задержка считается от момента, когда пользователь нажал, - с ожиданием в цикле событий
+            due = loop.time() + rnd.expovariate(0.5)
+            if due >= deadline:
+                return
+            await asyncio.sleep(due - loop.time())
+            update = make_update(bot, next(update_ids), user_id, "callback", f"stats_{rnd.choice(screens)}")
+            await dispatcher.feed_update(bot, update)
+            latencies.append(loop.time() - due)
+
+    async def abuser(user_id):
+        taps = 0
+        while loop.time() < deadline:
+            update = make_update(bot, next(update_ids), user_id, "callback", f"stats_{screens[taps % 4]}")
+            flood.append(asyncio.create_task(dispatcher.feed_update(bot, update)))
+            taps += 1
+            await asyncio.sleep(1 / abuse_rate)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(normal_user(user_id) for user_id in range(normal)),
+                             *(abuser(-user_id) for user_id in range(1, abusers + 1)))
+        await asyncio.gather(*flood)
+        elapsed = time.perf_counter() - start
+    finally:
+        if mode == "on":
+            dispatcher.update.outer_middleware.unregister(middleware.guard)
+            dispatcher.message.middleware.unregister(middleware)
+            dispatcher.callback_query.middleware.unregister(middleware)
+
+    return {
+        "storage": storage_name,
+        "abusers": abusers,
+        "throttle": mode,
+        "users": users,
+        "normal_requests": len(latencies),
+        "flood_requests": len(flood),
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "overrun_s": elapsed - seconds,
+        **{key: value for key, value in middleware.stats().items() if mode == "on"},
+    }
+
+
+async def bench_routing(repeat: int = 20_000):
+    """Поиск обработчика кнопки: цепочка фильтров F.text == против реестра кнопок.
+
+    Обработчики пустые, так что меряется только маршрутизация апдейта.
+    """
+    from buttons import ButtonRegistry
+    from config import BUTTONS
+
+    async def noop(message):
+        pass
+
+    chain = Router()
+    for text in BUTTONS.values():
+        chain.message(F.text == text)(noop)
+    chain.message()(noop)  # Все остальное, как ввод своей задачи
+
+    registry = ButtonRegistry(BUTTONS)
+    for button_id in BUTTONS:
+        registry(button_id)(noop)
+    table = Router()
+
+    @table.message(registry.filter)
+    async def button_pressed(message, button, **data):
+        await registry.dispatch(message, button, data)
+
+    table.message()(noop)
+
+    bot = Bot(token="123456:BENCHMARK", session=StubSession())
+    texts = {"first_button": BUTTONS["start_session"], "last_button": BUTTONS["change_task"],
+             "free_text": "Подготовка к экзамену"}
+    results = []
+    for name, router in (("filter_chain", chain), ("registry", table)):
+        dispatcher = Dispatcher(storage=MemoryStorage())
+        dispatcher.include_router(router)
+        for case, text in texts.items():
+            updates = [make_update(bot, i, 1, "message", text) for i in range(repeat)]
+            start = time.perf_counter()
+            for update in updates:
+                await dispatcher.feed_update(bot, update)
+            results.append({
+                "router": name,
+                "message": case,
+                "us_per_update": (time.perf_counter() - start) / repeat * 1e6,
+            })
+    return results
+
+
+async def _time_op(func, repeat: int) -> float:
+    """Среднее время одной операции в микросекундах"""
+    start = time.perf_counter()
+    for i in range(repeat):
+        result = func(i)
+        if asyncio.iscoroutine(result):
+            await result
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+async def bench_database(users: int, repeat: int = 1000):
+    """Стоимость операций SimpleDatabase при N пользователях"""
+    from database import SimpleDatabase
+    from leaderboard import Leaderboard
+    from session import Session
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = SimpleDatabase(os.path.join(directory, "data.json"), compact_every=10 ** 9)
+        db.data["users"] = _fake_users(users)
+        start = time.perf_counter()
+        db.leaderboard = Leaderboard.from_users(db.data["users"])
+        db.totals = db._count_totals()
+        load_time = time.perf_counter() - start
+
+        def record_session(i):
+            user_id = i % users
+            db.active_sessions[user_id] = Session(user_id, "Работа", 1500)
+            return db.end_session(user_id)
+
+        result = {
+            "users": users,
+            "build_index_ms": load_time * 1000,
+            "record_session_commit_us": await _time_op(record_session, repeat),
+            "user_stats_us": await _time_op(lambda i: db.get_user_stats(i % users), repeat),
+            "global_stats_us": await _time_op(lambda i: db.get_global_stats(), repeat),
+            "leaderboard_top10_us": await _time_op(lambda i: db.get_leaderboard(10), repeat),
+            "user_rank_us": await _time_op(lambda i: db.get_user_rank(i % users), repeat),
+        }
+        start = time.perf_counter()
+        db.compact()
+        result["snapshot_ms"] = (time.perf_counter() - start) * 1000
+        await db.close()
+    return result
+
+
+async def bench_startup(users: int, days: int = 30):
+    """Холодный старт SimpleDatabase со снимком data.json и data.snap"""
+    from database import SimpleDatabase
+    import snapshot
+
+    fake_users = _fake_users(users, days)
+    meta = {"daily_stats": {}, "journal_seq": 0, "active_sessions": {}}
+    result = {"users": users, "days": days}
+    with tempfile.TemporaryDirectory() as directory:
+        json_filename = os.path.join(directory, "data.json")
+        with open(json_filename, 'w', encoding='utf-8') as f:
+            # Так data.json писался до двоичных снимков
+            json.dump({"users": fake_users, **meta}, f, ensure_ascii=False, indent=2)
+        snap_directory = os.path.join(directory, "snap")
+        os.mkdir(snap_directory)
+        with open(os.path.join(snap_directory, "data.snap"), 'wb') as f:
+            f.write(snapshot.encode(meta, fake_users))
+        del fake_users
+
+        for fmt, filename in (("json", json_filename), ("snap", os.path.join(snap_directory, "data.json"))):
+            if fmt == "snap":
+                result["snap_size_mb"] = os.path.getsize(os.path.join(snap_directory, "data.snap")) / 2 ** 20
+            else:
+                result["json_size_mb"] = os.path.getsize(json_filename) / 2 ** 20
+            start = time.perf_counter()
+            db = SimpleDatabase(filename)
+            result[f"{fmt}_load_ms"] = (time.perf_counter() - start) * 1000
+            # Первое обращение к пользователю: в data.snap запись разбирается здесь
+            start = time.perf_counter()
+            await db.get_user_stats(users // 2)
+            result[f"{fmt}_first_stats_us"] = (time.perf_counter() - start) * 1e6
+            await db.close()
+            del db
+    return result
+
+
+async def bench_shutdown(sessions: int, finished: int = 2000):
+    """Остановка по SIGTERM: время drain и следующий старт с журналом и после checkpoint"""
+    from database import SimpleDatabase
+    from send_queue import SendQueue
+    from shutdown import UpdateGate, drain
+
+    result = {"sessions": sessions, "journal_records": finished}
+    with tempfile.TemporaryDirectory() as directory:
+        for stage in ("journal", "checkpoint"):
+            filename = os.path.join(directory, stage, "data.json")
+            os.mkdir(os.path.dirname(filename))
+            db = SimpleDatabase(filename, compact_every=10 ** 9)
+            scheduler = TimerScheduler()
+
+            async def on_expire():
+                pass
+
+            async def on_tick(remaining):
+                pass
+
+            for user_id in range(sessions):
+                db.start_session(user_id, "Задача", 25, chat_id=user_id)
+                scheduler.schedule(user_id, 1500, on_expire=on_expire, on_tick=on_tick, interval=60)
+            # Завершенные сессии - записи журнала с прошлого снимка
+            for user_id in range(sessions, sessions + finished):
+                db.start_session(user_id, "Задача", 25, chat_id=user_id)
+                await db.end_session(user_id)
+
+            if stage == "checkpoint":
+                start = time.perf_counter()
+                report = await drain(UpdateGate(), scheduler, SendQueue(), db)
+                result["drain_ms"] = (time.perf_counter() - start) * 1000
+                result["drain_timers"] = report["timers"]
+            await db.close()
+
+            start = time.perf_counter()
+            db = SimpleDatabase(filename)
+            result[f"{stage}_start_ms"] = (time.perf_counter() - start) * 1000
+            assert len(db.active_sessions) == sessions
+            await db.close()
+    return result
+
+
+async def bench_rollup(active: int, days: int = 730, population: int = None):
+    """Общая статистика за days дней: размер снимка, свертка и запрос за год"""
+    from database import SimpleDatabase
+    from rollup import ROLLUP_BATCH
+
+    population = population or active * 10
+    rnd = random.Random(1)
+    today = datetime.now().date()
+    result = {"active_per_day": active, "days": days}
+    with tempfile.TemporaryDirectory() as directory:
+        db = SimpleDatabase(os.path.join(directory, "data.json"), compact_every=10 ** 9)
+        for day in range(days):
+            db.data["daily_stats"][(today - timedelta(days=day)).isoformat()] = {
+                "sessions": active * 2, "time": active * 3000,
+                "users": {str(rnd.randrange(population)) for _ in range(active)},
+            }
+        year = (today - timedelta(days=364), today)
+        # Точное число участников за год - для оценки ошибки HyperLogLog
+        exact_users = len(set().union(*(daily["users"] for key, daily in db.data["daily_stats"].items()
+                                         if key >= year[0].isoformat())))
+
+        for stage in ("before", "after"):
+            if stage == "after":
+                start = time.perf_counter()
+                steps = 0
+                while db.rollup_history(ROLLUP_BATCH):
+                    steps += 1
+                result["rollup_steps"] = steps
+                result["rollup_step_ms"] = (time.perf_counter() - start) * 1000 / max(steps, 1)
+            start = time.perf_counter()
+            files = db._dump_data()
+            result[f"{stage}_dump_ms"] = (time.perf_counter() - start) * 1000
+            result[f"{stage}_snapshot_kb"] = sum(len(blob) for _, blob in files) / 1024
+            start = time.perf_counter()
+            year_stats = await db.get_global_range_stats(*year)
+            result[f"{stage}_year_query_ms"] = (time.perf_counter() - start) * 1000
+            result[f"{stage}_year_users_error_pct"] = (year_stats["active_users"] - exact_users) / exact_users * 100
+        await db.close()
+    return result
+
+
+async def bench_metrics(calls: int = 200_000):
+    """Накладные расходы middleware метрик на один апдейт и стоимость выдачи /metrics"""
+    from metrics import HandlerMetricsMiddleware, Metrics, UpdateMetricsMiddleware
+
+    registry = Metrics()
+    update = make_update(Bot(token="123456:BENCHMARK", session=StubSession()), 1, 1, "message", "/start")
+
+    class Handler:
+        callback = bench_metrics
+
+    data = {"handler": Handler()}
+
+    async def noop(event, data):
+        return None
+
+    update_middleware = UpdateMetricsMiddleware(registry.updates)
+    handler_middleware = HandlerMetricsMiddleware(registry.handlers)
+
+    async def both(event, data):
+        return await update_middleware(lambda e, d: handler_middleware(noop, e, d), event, data)
+
+    timings = {}
+    for name, call in (("bare", noop), ("metrics", both)):
+        start = time.perf_counter()
+        for _ in range(calls):
+            await call(update, data)
+        timings[name] = (time.perf_counter() - start) / calls
+
+    for i in range(50):
+        registry.database.observe(f"method_{i}", 0.001 * i)
+    start = time.perf_counter()
+    body = registry.render()
+    render_time = time.perf_counter() - start
+
+    return {
+        "overhead_us_per_update": (timings["metrics"] - timings["bare"]) * 1e6,
+        "render_ms": render_time * 1000,
+        "render_bytes": len(body),
+    }
+
+
+def _print(suite: str, result: dict):
+    print(suite, " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()))
+
+
+def _metadata() -> dict:
+    """Что и где измерялось - чтобы сравнивать результаты между коммитами"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+async def run(args):
+    results = defaultdict(list)
+    if "scheduler" in args.suites:
+        for sessions in args.sessions:
+            results["scheduler"].append(await bench_scheduler(sessions))
+    if "countdown" in args.suites:
+        results["countdown"].extend(bench_countdown_calls())
+    if "storage" in args.suites:
+        for users in args.users:
+            for shards in args.shards:
+                results["storage"].append(await bench_storage(users, shards))
+    if "fsm" in args.suites:
+        for workers in (1, 2):
+            results["fsm"].append(await bench_fsm(workers))
+    if "session" in args.suites:
+        for sessions in args.sessions:
+            results["session"].extend(bench_session(sessions))
+    if "dispatcher" in args.suites:
+        results["dispatcher"].extend(await bench_dispatcher(args.flow_users, args.concurrency))
+    if "database" in args.suites:
+        for users in args.db_users:
+            results["database"].append(await bench_database(users))
+
+    if "startup" in args.suites:
+        for users in args.users:
+            results["startup"].append(await bench_startup(users))
+    if "rollup" in args.suites:
+        for active in args.active:
+            results["rollup"].append(await bench_rollup(active))
+    if "stats" in args.suites:
+        for users in args.users:
+            results["stats"].extend(await bench_stats(users))
+    if "routing" in args.suites:
+        results["routing"].extend(await bench_routing())
+    if "webhook" in args.suites:
+        results["webhook"].append(await bench_webhook())
+    if "consistency" in args.suites:
+        for backend in ("binary", "json", "sqlite"):
+            results["consistency"].append(await bench_consistency(backend))
+    if "compaction" in args.suites:
+        for users in args.users:
+            for snapshot_format in ("binary", "json"):
+                results["compaction"].append(await bench_compaction(users, snapshot_format))
+    if "throttle" in args.suites:
+        for users in args.users:
+            results["throttle"].extend(await bench_throttle(users))
+    if "shutdown" in args.suites:
+        for sessions in args.sessions:
+            results["shutdown"].append(await bench_shutdown(sessions))
+    if "metrics" in args.suites:
+        results["metrics"].append(await bench_metrics())
+
+    for suite, suite_results in results.items():
+        for result in suite_results:
+            _print(suite, result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"meta": _metadata(), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки NoProk")
+    parser.add_argument("suites", nargs="*", default=["scheduler"], choices=SUITES)
+    parser.add_argument("--sessions", nargs="+", type=int, default=[10_000, 100_000])
+    parser.add_argument("--users", nargs="+", type=int, default=[1_000, 10_000, 100_000])
+    parser.add_argument("--shards", nargs="+", type=int, default=[1, 16, 64])
+    parser.add_argument("--db-users", nargs="+", type=int, default=[10, 1_000, 100_000, 1_000_000])
+    parser.add_argument("--flow-users", type=int, default=500, help="Пользователей в сценарии dispatcher")
+    parser.add_argument("--concurrency", type=int, default=50, help="Сценариев dispatcher одновременно")
+    parser.add_argument("--active", nargs="+", type=int, default=[100, 1_000, 10_000],
+                        help="Активных пользователей в день для rollup")
+    parser.add_argument("--json", help="Записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    # Глобальная база бота не должна трогать рабочие файлы
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="noprok-bench-"), "data.json"))
+    asyncio.run(run(args))
@@ -0,0 +1,118 @@
+import logging
+import weakref
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import TCPConnector
+
+from config import BOT_HTTP_POOL_LIMIT
+from send_queue import send_queue
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Счетчики использования пула соединений с Telegram API.
+
+    Считаются в переопределенном connect() по публичному API aiohttp:
+    соединение с уже встречавшимся протоколом - повторное использование.
+    """
+
+    def __init__(self):
+        self.requests = 0  # Сколько раз соединение бралось из пула
+        self.created = 0   # Сколько новых TCP/TLS соединений открыто
+        self.in_use = 0    # Сколько соединений выдано и еще не возвращено
+        self.limit = BOT_HTTP_POOL_LIMIT
+        self._protocols = weakref.WeakSet()  # Открытые пулом соединения
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.created)
+
+    @property
+    def idle(self) -> int:
+        """Открытые соединения, которые ждут в пуле"""
+        connected = sum(1 for protocol in self._protocols if protocol.is_connected())
+        return max(0, connected - self.in_use)
+
+    def acquired(self, connection):
+        """Пул выдал соединение"""
+        self.requests += 1
+        if connection.protocol not in self._protocols:
+            self._protocols.add(connection.protocol)
+            self.created += 1
+        self.in_use += 1
+        connection.add_callback(self._released)
+
+    def _released(self):
+        self.in_use -= 1
+
+    def snapshot(self) -> dict:
+        """Текущее состояние пула в виде словаря"""
+        return {
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "idle": self.idle,
+            "requests": self.requests,
+            "created": self.created,
+            "reused": self.reused,
+            "reuse_ratio": self.reused / self.requests if self.requests else 0.0,
+        }
+
+
+class _CountingConnector(TCPConnector):
+    """TCPConnector, который считает выдачи и новые соединения"""
+
+    def __init__(self, *args, stats: PoolStats, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats = stats
+        stats.limit = self.limit
+
+    async def connect(self, req, traces, timeout):
+        connection = await super().connect(req, traces, timeout)
+        self._stats.acquired(connection)
+        return connection
+
+
+def _use_connector(session: AiohttpSession, connector_type: type, **init) -> bool:
+    """Подменить класс коннектора, из которого сессия aiogram собирает ClientSession.
+
+    Публичного способа передать свой коннектор в AiohttpSession нет: в
+    aiogram 3.x create_session() строит его из приватных _connector_type и
+    _connector_init (проверено на 3.10). Это единственное место, где они
+    трогаются; если в новой версии их не окажется, сессия работает с обычным
+    коннектором, только без счетчиков пула.
+    """
+    if not (isinstance(getattr(session, "_connector_type", None), type)
+            and isinstance(getattr(session, "_connector_init", None), dict)):
+        logger.warning("🔌 Не удалось подключить счетчики пула: AiohttpSession изменилась")
+        return False
+    session._connector_type = connector_type
+    session._connector_init.update(init)
+    return True
+
+
+class PooledSession(AiohttpSession):
+    """HTTP-сессия бота с ограниченным пулом соединений и метриками"""
+
+    def __init__(self, limit: int = BOT_HTTP_POOL_LIMIT, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self.stats = PoolStats()
+        _use_connector(self, _CountingConnector, stats=self.stats)
+
+
+def create_bot(token: str, limit: int = BOT_HTTP_POOL_LIMIT) -> Bot:
+    """Создать единственный экземпляр бота с общим пулом соединений.
+
+    Все запросы к чатам проходят через общую очередь отправки с лимитами.
+    """
+    session = PooledSession(limit=limit)
+    session.middleware(send_queue)
+    logger.info(f"🔌 Пул соединений с Telegram API: до {limit} соединений")
+    return Bot(token=token, session=session)
+
+
+def pool_stats(bot: Bot) -> dict:
+    """Метрики пула соединений бота (пусто для обычной сессии)"""
+    stats = getattr(bot.session, "stats", None)
+    return stats.snapshot() if stats else {}
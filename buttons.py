@@ -0,0 +1,58 @@
+"""Реестр кнопок reply-клавиатур.
+
+Тексты кнопок берутся из config.BUTTONS - той же таблицы, из которой
+собираются клавиатуры, а обработчики регистрируются здесь по id кнопки.
+В роутере остается один обработчик сообщений: его фильтр находит кнопку
+одним поиском в словаре по точному тексту, а не перебором фильтров
+F.text == "..." по очереди.
+"""
+import inspect
+from typing import NamedTuple
+
+from config import BUTTONS
+
+
+class Button(NamedTuple):
+    handler: object
+    params: frozenset  # Какие данные апдейта нужны обработчику (state, bot, ...)
+    throttle: str  # Класс анти-флуда (см. throttle.py)
+
+
+class ButtonRegistry:
+    """Текст кнопки -> обработчик нажатия"""
+
+    def __init__(self, texts: dict = BUTTONS):
+        self.texts = texts
+        self._buttons = {}
+
+    def __call__(self, button_id: str, throttle: str = "default"):
+        """Декоратор: обработчик кнопки button_id"""
+        text = self.texts[button_id]
+
+        def register(handler):
+            if text in self._buttons:
+                raise ValueError(f"У кнопки {button_id} уже есть обработчик")
+            self._buttons[text] = Button(handler, frozenset(inspect.signature(handler).parameters), throttle)
+            return handler
+        return register
+
+    def __len__(self) -> int:
+        return len(self._buttons)
+
+    def __contains__(self, text) -> bool:
+        return text in self._buttons
+
+    def filter(self, message):
+        """Фильтр роутера: кнопка по тексту сообщения передается обработчику как button"""
+        button = self._buttons.get(message.text)
+        return {"button": button} if button is not None else False
+
+    @staticmethod
+    async def dispatch(message, button: Button, data: dict):
+        """Вызвать обработчик кнопки, передав ему только нужные данные"""
+        kwargs = {key: value for key, value in data.items() if key in button.params}
+        return await button.handler(message, **kwargs)
+
+
+# Глобальный экземпляр
+buttons = ButtonRegistry()
@@ -12,6 +12,36 @@ if not BOT_TOKEN:
     print("⚠️ Внимание: BOT_TOKEN не найден в .env файле")
     BOT_TOKEN = "DEMO_TOKEN"
 
+# Размер пула HTTP-соединений с Telegram API (общий для всех таймеров)
+BOT_HTTP_POOL_LIMIT = int(os.getenv("BOT_HTTP_POOL_LIMIT", "20"))
+
+# Лимиты исходящих сообщений (ограничения Telegram: ~30 в секунду всего, ~1 в секунду на чат)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_QUEUE_MAX_DEPTH = int(os.getenv("SEND_QUEUE_MAX_DEPTH", "5000"))
+
+# Сколько выгрузок статистики может собираться одновременно
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+# Сколько готовых экранов статистики держать в кэше
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "4096"))
+
+# Остановка по SIGTERM: за сколько секунд доделать работу, и где оставить
+# файл теплого старта для следующего процесса (он моложе WARM_START_MAX_AGE)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+WARM_START_PATH = os.getenv("WARM_START_PATH", "warm_start.json")
+WARM_START_MAX_AGE = float(os.getenv("WARM_START_MAX_AGE", "600"))
+
+# Анти-флуд: (нажатий в секунду, запас подряд) на пользователя по классам обработчиков
+THROTTLE_RULES = {
+    "default": (float(os.getenv("THROTTLE_RATE", "2")), int(os.getenv("THROTTLE_BURST", "8"))),
+    "session": (float(os.getenv("THROTTLE_SESSION_RATE", "1")), int(os.getenv("THROTTLE_SESSION_BURST", "6"))),
+    "stats": (float(os.getenv("THROTTLE_STATS_RATE", "0.5")), int(os.getenv("THROTTLE_STATS_BURST", "5"))),
+}
+# Сколько ведер (пользователь и класс) держать в памяти
+THROTTLE_MAX_ENTRIES = int(os.getenv("THROTTLE_MAX_ENTRIES", "50000"))
+
 # Константы Pomodoro
 WORK_TIME = 25 * 60  # 25 минут в секундах
 BREAK_TIME = 5 * 60   # 5 минут в секундах
@@ -22,23 +52,38 @@ if DEMO_MODE:
     WORK_TIME = 30  # 30 секунд для теста
     BREAK_TIME = 10  # 10 секунд для теста
 
+# Кнопки reply-клавиатур: id -> текст. Клавиатуры собираются из этой
+# таблицы, и по ней же buttons.py находит обработчик нажатия
+BUTTONS = {
+    "start_session": "🍅 Начать сессию",
+    "stats": "📊 Статистика",
+    "tips": "💡 Совет",
+    "help": "❓ Помощь",
+    "about": "ℹ️ О проекте",
+    "pause": "⏸ Пауза",
+    "resume": "▶️ Продолжить",
+    "stop": "🛑 Завершить",
+    "time_left": "⏱ Осталось времени",
+    "change_task": "📝 Сменить задачу",
+}
+
+# Раскладки клавиатур: ряды id кнопок
+MAIN_KEYBOARD = (("start_session",), ("stats", "tips"), ("help", "about"))
+SESSION_KEYBOARD = (("pause", "resume", "stop"), ("time_left", "change_task"))
+
 # Клавиатуры
+def build_reply_keyboard(layout):
+    """Reply-клавиатура по раскладке из id кнопок"""
+    keyboard = [[KeyboardButton(text=BUTTONS[button]) for button in row] for row in layout]
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+
 def get_main_keyboard():
     """Основная клавиатура с главными кнопками"""
-    keyboard = [
-        [KeyboardButton(text="🍅 Начать сессию")],
-        [KeyboardButton(text="📊 Статистика"), KeyboardButton(text="💡 Совет")],
-        [KeyboardButton(text="❓ Помощь"), KeyboardButton(text="ℹ️ О проекте")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return build_reply_keyboard(MAIN_KEYBOARD)
 
 def get_session_keyboard():
     """Клавиатура во время сессии"""
-    keyboard = [
-        [KeyboardButton(text="⏸ Пауза"), KeyboardButton(text="🛑 Завершить")],
-        [KeyboardButton(text="⏱ Осталось времени"), KeyboardButton(text="📝 Сменить задачу")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return build_reply_keyboard(SESSION_KEYBOARD)
 
 def get_task_duration_keyboard():
     """Инлайн-клавиатура для выбора длительности сессии"""
@@ -92,6 +137,16 @@ def get_stats_keyboard():
     builder.adjust(2, 2, 1)
     return builder.as_markup()
 
+def get_export_keyboard():
+    """Инлайн-клавиатура для выбора формата выгрузки"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.button(text="📄 CSV (Excel, Таблицы)", callback_data="export_csv")
+    builder.button(text="🧾 NDJSON (для скриптов)", callback_data="export_ndjson")
+    
+    builder.adjust(1)
+    return builder.as_markup()
+
 def get_tips_keyboard():
     """Инлайн-клавиатура для советов"""
     builder = InlineKeyboardBuilder()
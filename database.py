@@ -1,107 +1,708 @@
+import asyncio
+import glob
 import json
+import logging
+import zlib
 import os
 from datetime import datetime, date, timedelta
 from collections import defaultdict
+from collections.abc import Mapping
 
-class SimpleDatabase:
-    def __init__(self, filename="data.json"):
+from snapshot import UserTable, encode as encode_snapshot, load as load_snapshot, user_summaries
+from leaderboard import Leaderboard
+from rollup import HyperLogLog, fold_day, load_tier, range_stats
+from session import Session
+from writer import GroupCommitWriter
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    """Множества пользователей сохраняем в JSON как списки, UserTable - как словарь"""
+    if isinstance(value, set):
+        return sorted(value)
+    if isinstance(value, HyperLogLog):
+        return value.to_json()
+    if isinstance(value, Mapping):
+        return dict(value.items())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _encode_json(data, chunk_size: int = 1 << 20) -> bytes:
+    """data.json по частям: кодирование одной огромной строки держало бы GIL
+    сотни миллисекунд, а между частями цикл событий успевает поработать"""
+    encoder = json.JSONEncoder(ensure_ascii=False, indent=2, default=_json_default)
+    parts = []
+    chunk = []
+    size = 0
+    for piece in encoder.iterencode(data):
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            parts.append("".join(chunk).encode('utf-8'))
+            chunk.clear()
+            size = 0
+    parts.append("".join(chunk).encode('utf-8'))
+    return b"".join(parts)
+
+
+class BaseDatabase:
+    """Общий интерфейс хранилища.
+
+    Активные сессии живут в памяти, а завершенные сессии и статистику
+    хранит конкретный бэкенд: SimpleDatabase (JSON + журнал) или
+    SQLiteDatabase (sqlite_db.py). Методы статистики асинхронные,
+    чтобы бэкенд мог ходить на диск вне цикла событий.
+    """
+    
+    def __init__(self):
+        self.active_sessions = {}  # В памяти для быстрого доступа
+        # Версии статистики для кэша экранов: растут при каждом сохранении сессии
+        self.version = 0
+        self._user_versions = {}  # user_id -> version после его последней сессии
+    
+    # Методы для сессий
+    def start_session(self, user_id: int, task_name: str, duration: int, chat_id: int = None,
+                      message_id: int = None):
+        """Начать новую сессию. message_id - живое сообщение со статусом сессии"""
+        session = Session(user_id, task_name, duration, chat_id)
+        session.message_id = message_id
+        self.active_sessions[user_id] = session
+        
+        # Сессия переживает перезапуск бота; ждать записи на диск здесь не нужно
+        self._save_active_session(user_id, session)
+        
+        return session.id
+    
+    def get_session(self, user_id: int):
+        """Получить активную сессию пользователя"""
+        return self.active_sessions.get(user_id)
+    
+    def set_message_id(self, user_id: int, message_id: int) -> bool:
+        """Запомнить новое живое сообщение сессии (старое удалено)"""
+        session = self.active_sessions.get(user_id)
+        if not session:
+            return False
+        session.message_id = message_id
+        self._save_active_session(user_id, session)
+        return True
+    
+    def pause_session(self, user_id: int) -> bool:
+        """Поставить сессию на паузу"""
+        session = self.active_sessions.get(user_id)
+        if not session or not session.pause():
+            return False
+        self._save_active_session(user_id, session)
+        return True
+    
+    def resume_session(self, user_id: int) -> bool:
+        """Продолжить сессию после паузы"""
+        session = self.active_sessions.get(user_id)
+        if not session or not session.resume():
+            return False
+        self._save_active_session(user_id, session)
+        return True
+    
+    async def end_session(self, user_id: int):
+        """Завершить сессию и сохранить статистику.
+
+        Возвращает фактическую длительность после того, как запись
+        зафиксирована на диске.
+        """
+        session = self.active_sessions.pop(user_id, None)
+        if not session:
+            return None
+        
+        # Фактическое время не больше заданного - сессия могла
+        # завершиться с опозданием, например после перезапуска бота
+        actual_duration = int(min(session.elapsed(), session.duration))
+        
+        # Сохраняем статистику
+        await self._save_session_stats(user_id, session, actual_duration)
+        self.version += 1
+        self._user_versions[user_id] = self.version
+        
+        return actual_duration
+    
+    def user_version(self, user_id: int) -> int:
+        """Версия личной статистики пользователя"""
+        return self._user_versions.get(user_id, 0)
+    
+    def _save_active_session(self, user_id: int, session: Session):
+        """Сохранить состояние активной сессии в долговременное хранилище"""
+        raise NotImplementedError
+    
+    def _save_session_stats(self, user_id: int, session: Session, actual_duration: int):
+        """Сохранить статистику сессии. Возвращает awaitable фиксации"""
+        raise NotImplementedError
+    
+    async def get_user_stats(self, user_id: int, period: str = "today"):
+        """Получить статистику пользователя за период"""
+        raise NotImplementedError
+    
+    async def get_user_range_stats(self, user_id: int, start: date, end: date):
+        """Сессии и время пользователя за период [start, end] включительно"""
+        raise NotImplementedError
+    
+    async def get_global_stats(self):
+        """Получить глобальную статистику"""
+        raise NotImplementedError
+    
+    async def get_global_range_stats(self, start: date, end: date):
+        """Сессии, время и активные пользователи за период [start, end]"""
+        raise NotImplementedError
+    
+    def rollup_history(self, limit: int) -> int:
+        """Свернуть до limit старых дней статистики. Возвращает, сколько свернуто"""
+        return 0
+    
+    async def get_leaderboard(self, limit: int = 10):
+        """Получить таблицу лидеров"""
+        raise NotImplementedError
+    
+    async def get_user_rank(self, user_id: int):
+        """Место пользователя в рейтинге (с 1) или None"""
+        raise NotImplementedError
+    
+    # Выгрузка истории. Итераторы создаются в цикле событий, а
+    # перебираются в потоке экспорта и не держат всю историю в памяти
+    def iter_user_sessions(self, user_id: int):
+        """Завершенные сессии пользователя: (finished_at, task, duration)"""
+        raise NotImplementedError
+    
+    def iter_user_days(self, user_id: int):
+        """Итоги пользователя по дням: (day, sessions, time)"""
+        raise NotImplementedError
+    
+    async def check_consistency(self) -> bool:
+        """Сверить накапливаемые счетчики общей статистики с полным пересчетом"""
+        raise NotImplementedError
+    
+    async def checkpoint(self):
+        """Перед остановкой: зафиксировать все изменения и состояние активных сессий так,
+        чтобы следующий процесс поднялся быстро, без проигрывания журнала"""
+        raise NotImplementedError
+    
+    async def close(self):
+        """Дождаться записи всех изменений и освободить ресурсы"""
+
+
+class SimpleDatabase(BaseDatabase):
+    def __init__(self, filename="data.json", journal=True, compact_every=1000, shards=1,
+                 snapshot_format=None, daily_retention=90, weekly_retention=52, history_partitions=64):
+        super().__init__()
         self.filename = filename
+        # Пользователи делятся по хешу id на shards файлов, а data.json хранит
+        # только общие и дневные счетчики. При shards=1 все лежит в data.json
+        self.shards = shards
+        # Формат снимка: binary (data.snap, см. snapshot.py) или json (data.json).
+        # Сегменты пишутся только в JSON
+        snapshot_format = snapshot_format or ("binary" if shards == 1 else "json")
+        if snapshot_format not in ("json", "binary"):
+            raise ValueError(f"Неизвестный формат снимка: {snapshot_format}")
+        if snapshot_format == "binary" and shards > 1:
+            raise ValueError("Двоичный снимок не поддерживает сегменты пользователей")
+        self.snapshot_format = snapshot_format
+        self.snapshot_filename = os.path.splitext(filename)[0] + ".snap"
+        self._dirty_shards = set()
+        self._shard_seq = {}  # Номер сегмента старой раскладки -> journal_seq его снимка
+        self.journal = journal  # Режим журнала: дописываем сессии вместо перезаписи файла
+        self.journal_filename = os.path.splitext(filename)[0] + ".journal"
+        # История завершенных сессий: только дописывается и не сворачивается.
+        # Делится по хешу id пользователя на history_partitions файлов, чтобы
+        # выгрузка одного пользователя читала свою часть, а не всю историю
+        self.history_filename = os.path.splitext(filename)[0] + ".history"
+        self.history_partitions = history_partitions
+        self.compact_every = compact_every  # Через сколько записей сворачивать журнал в снимок
+        # Сколько дней общая статистика хранится по дням и сколько недель - по неделям (rollup.py)
+        self.daily_retention = daily_retention
+        self.weekly_retention = weekly_retention
         self.data = self._load_data()
-        self.active_sessions = {}  # В памяти для быстрого доступа
+        self.active_sessions = {int(user_id): Session.from_record(int(user_id), record)
+                                for user_id, record in self.data.pop("active_sessions", {}).items()}
+        # Рейтинг и счетчики строим по итогам пользователей: записи снимка не разбираются
+        self.leaderboard = Leaderboard.from_totals(
+            (user_key, total_time)
+            for user_key, _, total_time in user_summaries(self.data.get("users", {})))
+        self.totals = self._count_totals()  # Счетчики всех сессий и времени
+        # Состав сегментов, чтобы снимок сегмента не перебирал всех пользователей
+        self._shard_members = defaultdict(list)
+        if self.shards > 1:
+            for user_key in self.data.get("users", {}):
+                self._shard_members[self._shard_of(user_key, self.shards)].append(user_key)
+        self._journal_file = None
+        self._journal_records = 0
+        self._history_files = {}  # Часть истории -> открытый файл
+        # Записи пользователей и дней, созданные или скопированные после последней
+        # заморозки снимка: их можно менять на месте (см. _freeze_data)
+        self._owned_users = set()
+        self._owned_days = set()
+        self._writer = GroupCommitWriter(self._commit)
+        if self.journal:
+            self._replay_journal()
+        self._shard_seq.clear()
+        self._prepare_history()
     
     def _load_data(self):
         """Загрузить данные из файла"""
-        if os.path.exists(self.filename):
+        data = {"users": {}, "daily_stats": {}}
+        if os.path.exists(self.snapshot_filename):
+            # Двоичный снимок свежее data.json: его удаляют после записи .snap
+            data = load_snapshot(self.snapshot_filename)
+        elif os.path.exists(self.filename):
             try:
                 with open(self.filename, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    data = json.load(f)
             except:
-                return {"users": {}, "daily_stats": {}}
-        return {"users": {}, "daily_stats": {}}
+                pass
+        
+        # Пользователи из файлов сегментов
+        saved_shards = data.pop("shards", 1)
+        if saved_shards > 1:
+            data["users"] = {}
+            for shard in range(saved_shards):
+                shard_data = self._load_shard(self._shard_filename(shard, saved_shards))
+                data["users"].update(shard_data.get("users", {}))
+                self._shard_seq[shard] = shard_data.get("journal_seq", 0)
+        self._saved_shards = saved_shards
+        if saved_shards != self.shards:
+            # Раскладка поменялась - при следующем снимке перепишем всех
+            self._dirty_shards.update(range(self.shards))
+        
+        # В JSON множества хранятся списками, а HyperLogLog - строками base64
+        for daily in data.get("daily_stats", {}).values():
+            daily["users"] = set(daily.get("users", []))
+        load_tier(data.setdefault("weekly_stats", {}))
+        load_tier(data.setdefault("monthly_stats", {}))
+        return data
+    
+    @staticmethod
+    def _load_shard(filename: str) -> dict:
+        if not os.path.exists(filename):
+            return {}
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _shard_filename(self, shard: int, shards: int = None) -> str:
+        base, ext = os.path.splitext(self.filename)
+        return f"{base}.users-{shard:03d}-of-{shards or self.shards:03d}{ext}"
+    
+    def _history_partition_filename(self, partition: int, partitions: int = None) -> str:
+        return f"{self.history_filename}-{partition:03d}-of-{partitions or self.history_partitions:03d}"
+    
+    @staticmethod
+    def _shard_of(user_key: str, shards: int) -> int:
+        """Сегмент пользователя: стабильный между запусками хеш id"""
+        return zlib.crc32(user_key.encode('utf-8')) % shards
+    
+    def _freeze_data(self) -> dict:
+        """Зафиксировать состояние для снимка. Выполняется в цикле событий.
+
+        Копируются только словари верхнего уровня: записи пользователей и
+        дней общие со снимком, а цикл событий перед первым изменением после
+        заморозки заменяет запись копией (_own_user, _own_day). Поэтому
+        поток писателя сериализует снимок, пока бот продолжает работать.
+        """
+        frozen = dict(self.data)
+        users = self.data.get("users", {})
+        frozen["users"] = users.freeze() if isinstance(users, UserTable) else dict(users)
+        frozen["daily_stats"] = dict(self.data.get("daily_stats", {}))
+        # Ступени свертки маленькие и меняются на месте - копируем целиком
+        for tier in ("weekly_stats", "monthly_stats"):
+            frozen[tier] = {key: {**bucket, "users": HyperLogLog(bucket["users"].registers)}
+                            for key, bucket in self.data.get(tier, {}).items()}
+        frozen["active_sessions"] = {user_id: session.to_record()
+                                     for user_id, session in self.active_sessions.items()}
+        if self.shards > 1:
+            frozen["_shard_members"] = {shard: list(self._shard_members[shard])
+                                        for shard in self._dirty_shards}
+        self._dirty_shards.clear()
+        self._owned_users = set()
+        self._owned_days = set()
+        return frozen
+    
+    def _encode_data(self, snapshot: dict) -> list:
+        """Сериализовать снимок: измененные сегменты пользователей и общий файл.
+
+        Выполняется в потоке писателя над замороженным состоянием (_freeze_data).
+        Возвращает [(имя файла, содержимое), ...]; общий файл - последним,
+        так что его journal_seq не обгоняет сегменты.
+        """
+        snapshot = dict(snapshot)
+        shard_members = snapshot.pop("_shard_members", {})
+        files = []
+        if self.snapshot_format == "binary":
+            users = snapshot.pop("users", {})
+            return [(self.snapshot_filename, encode_snapshot(snapshot, users, _json_default))]
+        if self.shards > 1:
+            users = snapshot.pop("users", {})
+            snapshot["shards"] = self.shards
+            for shard, members in sorted(shard_members.items()):
+                blob = {
+                    "journal_seq": snapshot.get("journal_seq", 0),
+                    "users": {user_key: users[user_key] for user_key in members}
+                }
+                files.append((self._shard_filename(shard),
+                              json.dumps(blob, ensure_ascii=False, separators=(",", ":")).encode('utf-8')))
+        
+        files.append((self.filename, _encode_json(snapshot)))
+        return files
+    
+    def _dump_data(self) -> list:
+        """Заморозить и сериализовать снимок сразу"""
+        return self._encode_data(self._freeze_data())
+    
+    def _write_snapshot(self, files: list):
+        """Записать файлы снимка на диск, каждый атомарно через временный файл"""
+        for filename, blob in files:
+            tmp_filename = filename + ".tmp"
+            with open(tmp_filename, 'wb') as f:
+                f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, filename)
+        
+        if self._saved_shards != self.shards:
+            # Новая раскладка записана целиком - старые сегменты больше не нужны
+            if self._saved_shards > 1:
+                for shard in range(self._saved_shards):
+                    filename = self._shard_filename(shard, self._saved_shards)
+                    if os.path.exists(filename):
+                        os.remove(filename)
+            self._saved_shards = self.shards
+        
+        # Снимок другого формата устарел. data.json удаляем только после
+        # записи .snap, а .snap - после записи data.json
+        stale = self.filename if self.snapshot_format == "binary" else self.snapshot_filename
+        if os.path.exists(stale):
+            os.remove(stale)
     
     def _save_data(self):
         """Сохранить данные в файл"""
-        with open(self.filename, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        self._write_snapshot(self._dump_data())
     
-    # Методы для сессий
-    def start_session(self, user_id: int, task_name: str, duration: int):
-        """Начать новую сессию"""
-        session_id = f"{user_id}_{datetime.now().timestamp()}"
-        
-        self.active_sessions[user_id] = {
-            "id": session_id,
-            "task": task_name,
-            "duration": duration,
-            "start_time": datetime.now().isoformat(),
-            "paused": False,
-            "paused_time": 0
-        }
+    # Журнал сессий
+    def _replay_journal(self):
+        """Восстановить агрегаты, проиграв журнал поверх снимка"""
+        if not os.path.exists(self.journal_filename):
+            return
+        
+        applied_seq = self.data.get("journal_seq", 0)
+        good_offset = 0
+        with open(self.journal_filename, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Недописанная при падении запись
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_offset += len(line)
+                self._journal_records += 1
+                # Записи, уже попавшие в снимок, пропускаем
+                if record["n"] > applied_seq:
+                    self._apply_record(record)
         
-        return session_id
+        # Отрезаем хвост с оборванной записью
+        if good_offset < os.path.getsize(self.journal_filename):
+            with open(self.journal_filename, 'r+b') as f:
+                f.truncate(good_offset)
     
-    def get_session(self, user_id: int):
-        """Получить активную сессию пользователя"""
-        return self.active_sessions.get(user_id)
+    def _persist(self, record: dict, history: bool = False) -> asyncio.Future:
+        """Отдать запись писателю; future завершится после фиксации на диске"""
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode('utf-8')
+        if history:
+            self._writer.submit(("history", (self._shard_of(record["u"], self.history_partitions), line)))
+        
+        if not self.journal:
+            return self._writer.submit(("snapshot", self._freeze_data()))
+        
+        future = self._writer.submit(("append", line))
+        
+        self._journal_records += 1
+        if self._journal_records >= self.compact_every:
+            # Состояние замораживаем здесь, а сериализует и пишет снимок поток писателя
+            self._journal_records = 0
+            future = self._writer.submit(("snapshot", self._freeze_data()))
+        return future
     
-    def end_session(self, user_id: int):
-        """Завершить сессию и сохранить статистику"""
-        session = self.active_sessions.pop(user_id, None)
-        if not session:
-            return None
+    def _commit(self, ops: list):
+        """Зафиксировать пачку изменений. Выполняется в потоке писателя"""
+        lines = []
+        history = defaultdict(list)  # Часть истории -> строки
+        snapshot = None
+        for kind, payload in ops:
+            if kind == "snapshot":
+                # Снимок уже включает все предыдущие записи пачки
+                lines.clear()
+                snapshot = payload
+            elif kind == "history":
+                partition, line = payload
+                history[partition].append(line)
+            else:
+                lines.append(payload)
         
-        # Рассчитываем фактическое время
-        start_time = datetime.fromisoformat(session["start_time"])
-        actual_duration = (datetime.now() - start_time).seconds - session["paused_time"]
+        for partition, history_lines in history.items():
+            history_file = self._history_files.get(partition)
+            if history_file is None:
+                history_file = self._history_files[partition] = open(
+                    self._history_partition_filename(partition), 'ab')
+            history_file.write(b"".join(history_lines))
+            history_file.flush()
+            os.fsync(history_file.fileno())
         
-        # Сохраняем статистику
-        self._save_session_stats(user_id, session, actual_duration)
+        if snapshot is not None:
+            self._write_snapshot(self._encode_data(snapshot))
+            if self.journal:
+                # Снимок содержит journal_seq, так что падение здесь не приведет к двойному учету
+                self._close_journal()
+                self._journal_file = open(self.journal_filename, 'wb')
         
-        return actual_duration
+        if lines:
+            if self._journal_file is None:
+                self._journal_file = open(self.journal_filename, 'ab')
+            self._journal_file.write(b"".join(lines))
+            self._journal_file.flush()
+            os.fsync(self._journal_file.fileno())
     
-    def _save_session_stats(self, user_id: int, session: dict, actual_duration: int):
-        """Сохранить статистику сессии"""
-        user_key = str(user_id)
-        today = date.today().isoformat()
+    def compact(self):
+        """Свернуть журнал в снимок (data.snap или data.json) и начать журнал заново"""
+        self._commit([("snapshot", self._freeze_data())])
+        self._journal_records = 0
+    
+    def _close_journal(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+    
+    def _prepare_history(self):
+        """Разложить историю по частям текущей раскладки и починить концы файлов"""
+        legacy = [self.history_filename] if os.path.exists(self.history_filename) else []
+        legacy += sorted(
+            filename for filename in glob.glob(glob.escape(self.history_filename) + "-*-of-*")
+            if not filename.endswith((f"-of-{self.history_partitions:03d}", ".tmp"))
+        )
+        if legacy:
+            self._split_history(legacy)
+        for partition in range(self.history_partitions):
+            self._repair_history(self._history_partition_filename(partition))
+    
+    def _split_history(self, legacy: list):
+        """Переложить историю из общего файла или другой раскладки в части по пользователям.
+
+        Части собираются во временных файлах и целиком заменяют части текущей
+        раскладки. Пока старые файлы не удалены, перекладка считается
+        незаконченной и при следующем запуске повторяется - сессии не задваиваются.
+        """
+        logger.info(f"📜 История раскладывается на {self.history_partitions} частей из {len(legacy)} файлов")
+        filenames = [self._history_partition_filename(partition) for partition in range(self.history_partitions)]
+        files = [open(filename + ".tmp", 'wb') for filename in filenames]
+        try:
+            for old_filename in legacy:
+                with open(old_filename, 'rb') as f:
+                    for line in f:
+                        if line.endswith(b"\n"):  # Оборванная при падении запись отбрасывается
+                            files[self._shard_of(json.loads(line)["u"], self.history_partitions)].write(line)
+            for file in files:
+                file.flush()
+                os.fsync(file.fileno())
+        finally:
+            for file in files:
+                file.close()
+        for filename in filenames:
+            os.replace(filename + ".tmp", filename)
+        for old_filename in legacy:
+            os.remove(old_filename)
+    
+    @staticmethod
+    def _repair_history(filename: str):
+        """Отрезать оборванную при падении запись в конце части истории"""
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - 4096)
+                f.seek(start)
+                block = f.read(position - start)
+                newline = block.rfind(b"\n")
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position < end:
+                f.truncate(position)
+    
+    def _iter_history(self, user_id: int = None):
+        """Записи истории по порядку, при user_id - только этого пользователя.
+
+        Пользователь целиком лежит в одной части, и читается только она.
+        Без user_id части идут одна за другой: порядок общий только внутри части.
+        """
+        if user_id is not None:
+            partitions = [self._shard_of(str(user_id), self.history_partitions)]
+        else:
+            partitions = range(self.history_partitions)
+        # Записи пишутся без пробелов, так что чужие строки отсеиваются без разбора JSON
+        marker = f'"u":"{user_id}"'.encode('utf-8') if user_id is not None else b""
+        for partition in partitions:
+            filename = self._history_partition_filename(partition)
+            if not os.path.exists(filename):
+                continue
+            with open(filename, 'rb') as f:
+                for line in f:
+                    if marker in line and line.endswith(b"\n"):
+                        yield json.loads(line)
+    
+    def iter_user_sessions(self, user_id: int):
+        """Завершенные сессии пользователя: (finished_at, task, duration)"""
+        for record in self._iter_history(user_id):
+            yield record["ts"], record["t"], record["d"]
+    
+    def iter_user_days(self, user_id: int):
+        """Итоги пользователя по дням: (day, sessions, time)"""
+        # Копия индекса дней: писатель продолжает менять его в цикле событий
+        days = self.data["users"].get(str(user_id), {}).get("days", {})
+        return iter([(day, sessions, time) for day, (sessions, time) in sorted(days.items())])
+    
+    async def checkpoint(self):
+        """Свернуть журнал в снимок. Активные сессии попадают в снимок вместе с
+        живыми сообщениями, а следующий запуск читает только снимок"""
+        await self._writer.flush()
+        self._journal_records = 0
+        await self._writer.submit(("snapshot", self._freeze_data()))
+    
+    async def close(self):
+        """Дождаться записи всех изменений и закрыть журнал"""
+        await self._writer.close()
+        self._close_journal()
+        for history_file in self._history_files.values():
+            history_file.close()
+        self._history_files.clear()
+    
+    def _save_active_session(self, user_id: int, session: Session):
+        """Записать в журнал состояние активной сессии (старт, пауза, продолжение)"""
+        record = {
+            "n": self.data.get("journal_seq", 0) + 1,
+            "k": "s",
+            "u": str(user_id),
+            **session.to_record()
+        }
+        self.data["journal_seq"] = record["n"]
+        return self._persist(record)
+    
+    def _save_session_stats(self, user_id: int, session: Session, actual_duration: int):
+        """Сохранить статистику сессии. Возвращает future фиксации"""
+        record = {
+            "n": self.data.get("journal_seq", 0) + 1,
+            "u": str(user_id),
+            "t": session.task,
+            "d": actual_duration,
+            "ts": datetime.now().isoformat()
+        }
+        self._apply_session(record)
+        return self._persist(record, history=True)
+    
+    def _apply_record(self, record: dict):
+        """Проиграть запись журнала: старт сессии или завершенная сессия"""
+        if record.get("k") == "s":
+            user_id = int(record["u"])
+            self.active_sessions[user_id] = Session.from_record(user_id, record)
+            self.data["journal_seq"] = record["n"]
+        else:
+            # Сегмент пользователя мог попасть на диск позже общего файла
+            shard_seq = self._shard_seq.get(self._shard_of(record["u"], self._saved_shards), 0)
+            self._apply_session(record, update_user=record["n"] > shard_seq)
+    
+    def _apply_session(self, record: dict, update_user: bool = True):
+        """Учесть завершенную сессию в агрегатах в памяти"""
+        user_key = record["u"]
+        self.active_sessions.pop(int(user_key), None)
+        actual_duration = record["d"]
+        today = record["ts"][:10]
         
-        # Инициализируем структуру данных
-        if "users" not in self.data:
-            self.data["users"] = {}
-        if user_key not in self.data["users"]:
-            self.data["users"][user_key] = {
-                "total_sessions": 0,
-                "total_time": 0,
-                "last_active": None,
-                "tasks": {}
-            }
+        if update_user:
+            self._apply_user_session(record)
+        
+        # Ежедневная статистика
+        daily = self._own_day(today)
+        daily["sessions"] += 1
+        daily["time"] += actual_duration
+        daily["users"].add(user_key)
+        
+        self.data["journal_seq"] = record["n"]
+    
+    def _apply_user_session(self, record: dict):
+        """Учесть сессию в записи пользователя - она живет в его сегменте"""
+        user_key = record["u"]
+        actual_duration = record["d"]
+        today = record["ts"][:10]
+        shard = self._shard_of(user_key, self.shards) if self.shards > 1 else 0
+        self._dirty_shards.add(shard)
+        
+        user_data = self._own_user(user_key, shard)
         
         # Обновляем статистику пользователя
-        user_data = self.data["users"][user_key]
         user_data["total_sessions"] += 1
         user_data["total_time"] += actual_duration
-        user_data["last_active"] = datetime.now().isoformat()
+        user_data["last_active"] = record["ts"]
+        self.leaderboard.update(user_key, user_data["total_time"])
+        self.totals["sessions"] += 1
+        self.totals["time"] += actual_duration
+        
+        # Индекс по дням для конкретного пользователя: день -> [сессии, время]
+        user_day = user_data["days"].setdefault(today, [0, 0])
+        user_day[0] += 1
+        user_day[1] += actual_duration
         
         # Статистика по задачам
-        task_name = session["task"]
+        task_name = record["t"]
         if task_name not in user_data["tasks"]:
             user_data["tasks"][task_name] = {"sessions": 0, "time": 0}
         user_data["tasks"][task_name]["sessions"] += 1
         user_data["tasks"][task_name]["time"] += actual_duration
-        
-        # Ежедневная статистика
-        if "daily_stats" not in self.data:
-            self.data["daily_stats"] = {}
-        if today not in self.data["daily_stats"]:
-            self.data["daily_stats"][today] = {"sessions": 0, "time": 0, "users": set()}
-        
-        self.data["daily_stats"][today]["sessions"] += 1
-        self.data["daily_stats"][today]["time"] += actual_duration
-        self.data["daily_stats"][today]["users"].add(user_key)
-        
-        self._save_data()
+    
+    def _own_user(self, user_key: str, shard: int) -> dict:
+        """Запись пользователя, которую можно менять: замороженный снимок мог
+        взять текущую запись, поэтому первый раз после заморозки она копируется"""
+        users = self.data.setdefault("users", {})
+        if user_key in self._owned_users:
+            return users[user_key]
+        self._owned_users.add(user_key)
+        if user_key not in users:
+            self._shard_members[shard].append(user_key)
+            user_data = users[user_key] = {
+                "total_sessions": 0,
+                "total_time": 0,
+                "last_active": None,
+                "tasks": {},
+                "days": {}
+            }
+            return user_data
+        old = users[user_key]
+        user_data = users[user_key] = {
+            **old,
+            "tasks": {task: dict(counts) for task, counts in old.get("tasks", {}).items()},
+            "days": {day: list(counts) for day, counts in old.get("days", {}).items()},
+        }
+        return user_data
+    
+    def _own_day(self, day: str) -> dict:
+        """Итоги дня, которые можно менять; копируются первый раз после заморозки снимка"""
+        daily_stats = self.data.setdefault("daily_stats", {})
+        if day in self._owned_days:
+            return daily_stats[day]
+        self._owned_days.add(day)
+        old = daily_stats.get(day)
+        if old is None:
+            daily = daily_stats[day] = {"sessions": 0, "time": 0, "users": set()}
+        else:
+            daily = daily_stats[day] = {**old, "users": set(old["users"])}
+        return daily
     
     # Методы для статистики
-    def get_user_stats(self, user_id: int, period: str = "today"):
+    async def get_user_stats(self, user_id: int, period: str = "today"):
         """Получить статистику пользователя за период"""
         user_key = str(user_id)
         user_data = self.data["users"].get(user_key, {})
@@ -117,15 +718,10 @@ class SimpleDatabase:
             "last_active": user_data.get("last_active", "Никогда")
         }
         
-        # Статистика за сегодня
-        today = date.today().isoformat()
-        if today in self.data.get("daily_stats", {}):
-            daily = self.data["daily_stats"][today]
-            if user_key in daily["users"]:
-                # Здесь нужно более сложное вычисление для конкретного пользователя
-                # Для простоты считаем пропорционально
-                stats["today_sessions"] = len([u for u in daily["users"] if u == user_key])
-                stats["today_time"] = daily["time"] / len(daily["users"]) if daily["users"] else 0
+        # Статистика за сегодня и за последние 7 дней - по индексу дней пользователя
+        today = date.today()
+        stats["today_sessions"], stats["today_time"] = self._sum_days(user_data, today, today)
+        stats["week_sessions"], stats["week_time"] = self._sum_days(user_data, today - timedelta(days=6), today)
         
         # Любимая задача
         if user_data.get("tasks"):
@@ -134,31 +730,111 @@ class SimpleDatabase:
         
         return stats
     
-    def get_global_stats(self):
-        """Получить глобальную статистику"""
-        today = date.today().isoformat()
+    async def get_user_range_stats(self, user_id: int, start: date, end: date):
+        """Сессии и время пользователя за период [start, end] включительно"""
+        user_data = self.data["users"].get(str(user_id), {})
+        sessions, time = self._sum_days(user_data, start, end)
+        return {"sessions": sessions, "time": time}
+    
+    @staticmethod
+    def _sum_days(user_data: dict, start: date, end: date):
+        """Сложить дни из индекса пользователя. O(дней в периоде)"""
+        days = user_data.get("days", {})
+        sessions = time = 0
+        day = start
+        while day <= end:
+            counts = days.get(day.isoformat())
+            if counts:
+                sessions += counts[0]
+                time += counts[1]
+            day += timedelta(days=1)
+        return sessions, time
+    
+    async def get_global_stats(self):
+        """Получить глобальную статистику. O(1) по счетчикам"""
+        today = self.data.get("daily_stats", {}).get(date.today().isoformat(), {})
         
         return {
             "total_users": len(self.data.get("users", {})),
-            "total_sessions": sum(u["total_sessions"] for u in self.data.get("users", {}).values()),
-            "total_time_hours": sum(u["total_time"] for u in self.data.get("users", {}).values()) / 3600,
-            "active_today": len(self.data.get("daily_stats", {}).get(today, {}).get("users", [])),
-            "today_sessions": self.data.get("daily_stats", {}).get(today, {}).get("sessions", 0)
+            "total_sessions": self.totals["sessions"],
+            "total_time_hours": self.totals["time"] / 3600,
+            "active_today": len(today.get("users", ())),
+            "today_sessions": today.get("sessions", 0)
         }
     
-    def get_leaderboard(self, limit: int = 10):
-        """Получить таблицу лидеров"""
-        users = []
-        for user_id, data in self.data.get("users", {}).items():
-            users.append({
-                "user_id": user_id,
-                "total_time": data.get("total_time", 0),
-                "total_sessions": data.get("total_sessions", 0)
-            })
+    async def get_global_range_stats(self, start: date, end: date):
+        """Сессии, время и активные пользователи за период: дни, недели и месяцы"""
+        return range_stats(self.data.get("daily_stats", {}), self.data["weekly_stats"],
+                           self.data["monthly_stats"], start, end)
+    
+    def rollup_history(self, limit: int) -> int:
+        """Свернуть до limit самых старых дней за окном детализации в недели и месяцы.
+
+        Шаг короткий и выполняется в цикле событий; свертка попадет на диск
+        со следующим снимком, а до тех пор дни лежат в старом снимке.
+        """
+        today = date.today()
+        cutoff = (today - timedelta(days=self.daily_retention)).isoformat()
+        daily_stats = self.data.get("daily_stats", {})
+        expired = sorted(day for day in daily_stats if day < cutoff)[:limit]
+        for day in expired:
+            fold_day(self.data["weekly_stats"], self.data["monthly_stats"],
+                     date.fromisoformat(day), daily_stats.pop(day))
         
-        # Сортируем по общему времени
-        users.sort(key=lambda x: x["total_time"], reverse=True)
-        return users[:limit]
+        # Месяц уже содержит итоги своих недель, так что старые недели просто удаляем
+        week_cutoff = (today - timedelta(weeks=self.weekly_retention)).isoformat()
+        weekly = self.data["weekly_stats"]
+        for week in [week for week in weekly if week < week_cutoff]:
+            del weekly[week]
+        return len(expired)
+    
+    def _count_totals(self):
+        """Пересчитать счетчики полным проходом по пользователям"""
+        sessions = time = 0
+        for _, total_sessions, total_time in user_summaries(self.data.get("users", {})):
+            sessions += total_sessions
+            time += total_time
+        return {"sessions": sessions, "time": time}
+    
+    async def check_consistency(self) -> bool:
+        """Сверить счетчики с полным пересчетом"""
+        expected = self._count_totals()
+        if expected != self.totals:
+            logger.warning(f"⚠️ Счетчики разошлись с данными: {self.totals} != {expected}")
+            return False
+        return True
+    
+    async def get_leaderboard(self, limit: int = 10):
+        """Получить таблицу лидеров. O(limit)"""
+        users = self.data.get("users", {})
+        return [
+            {
+                "user_id": user_id,
+                "total_time": total_time,
+                "total_sessions": users[user_id].get("total_sessions", 0)
+            }
+            for user_id, total_time in self.leaderboard.top(limit)
+        ]
+    
+    async def get_user_rank(self, user_id: int):
+        """Место пользователя в рейтинге или None. O(log n)"""
+        return self.leaderboard.rank(str(user_id))
+
+
+def create_database(backend: str = None, filename: str = None):
+    """Создать хранилище по имени бэкенда: json (по умолчанию) или sqlite"""
+    backend = backend or os.getenv("DB_BACKEND", "json")
+    if backend == "sqlite":
+        from sqlite_db import SQLiteDatabase
+        return SQLiteDatabase(filename or os.getenv("DB_PATH", "data.db"))
+    if backend == "json":
+        return SimpleDatabase(filename or os.getenv("DB_PATH", "data.json"),
+                              shards=int(os.getenv("DB_SHARDS", "1")),
+                              snapshot_format=os.getenv("DB_SNAPSHOT_FORMAT"),
+                              daily_retention=int(os.getenv("DB_DAILY_RETENTION_DAYS", "90")),
+                              weekly_retention=int(os.getenv("DB_WEEKLY_RETENTION_WEEKS", "52")),
+                              history_partitions=int(os.getenv("DB_HISTORY_PARTITIONS", "64")))
+    raise ValueError(f"Неизвестный бэкенд базы данных: {backend}")
 
 # Глобальный экземпляр
-db = SimpleDatabase()
\ No newline at end of file
+db = create_database()
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Выгрузка истории пользователя в CSV и NDJSON.
+
+Данные идут конвейером генераторов: итераторы базы -> строки ->
+байтовые куски -> временный файл. Одновременно в памяти лежит один
+кусок; сам файл держится в памяти, пока он меньше SPOOL_MAX_SIZE,
+а дальше уходит на диск. Отправляется он тоже кусками.
+"""
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE, InputFile
+
+from config import EXPORT_MAX_CONCURRENT
+
+FORMATS = ("csv", "ndjson")
+COLUMNS = ("type", "date", "task", "sessions", "seconds")
+ROWS_PER_CHUNK = 500
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Сборка выгрузки - долгий проход по истории, одновременно их немного
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+def export_rows(sessions, days):
+    """Строки выгрузки: сначала все сессии, затем итоги по дням"""
+    for finished_at, task, duration in sessions:
+        yield "session", finished_at, task, 1, duration
+    for day, count, time in days:
+        yield "day", day, None, count, time
+
+
+def encode_csv(rows):
+    """CSV кусками по ROWS_PER_CHUNK строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM, чтобы Excel узнал UTF-8
+    writer.writerow(COLUMNS)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def encode_ndjson(rows):
+    """NDJSON (объект на строку) кусками по ROWS_PER_CHUNK строк"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, separators=(",", ":")))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield ("\n".join(lines) + "\n").encode('utf-8')
+            lines.clear()
+    if lines:
+        yield ("\n".join(lines) + "\n").encode('utf-8')
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson}
+
+
+def write_export(chunks, max_size: int = SPOOL_MAX_SIZE):
+    """Слить куски во временный файл. Выполняется в потоке"""
+    file = SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        file.write(chunk)
+    file.seek(0)
+    return file
+
+
+class SpooledInputFile(InputFile):
+    """Готовая выгрузка для send_document, читается кусками"""
+
+    def __init__(self, file, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        # После flood control запрос повторяется, и файл читается заново
+        self.file.seek(0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+async def build_export(db, user_id: int, fmt: str) -> SpooledInputFile:
+    """Собрать выгрузку пользователя в формате fmt"""
+    rows = export_rows(db.iter_user_sessions(user_id), db.iter_user_days(user_id))
+    file = await asyncio.to_thread(write_export, ENCODERS[fmt](rows))
+    return SpooledInputFile(file, f"noprok_stats_{datetime.now():%Y-%m-%d}.{fmt}")
@@ -0,0 +1,172 @@
+"""FSM-хранилище на SQLite для нескольких процессов бота на одном хосте.
+
+Состояние и данные диалога лежат в одной таблице в режиме WAL, так что
+переживают перезапуск и видны всем процессам. Горячие ключи кэшируются
+в LRU внутри процесса. Кэш сбрасывается целиком, когда PRAGMA
+data_version показывает, что в базу писал другой процесс.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}'
+)
+"""
+SELECT_KEY = "SELECT state, data FROM fsm WHERE key = ?"
+UPSERT_KEY = """
+INSERT INTO fsm (key, state, data) VALUES (?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data
+"""
+DELETE_KEY = "DELETE FROM fsm WHERE key = ?"
+DATA_VERSION = "PRAGMA data_version"
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite с LRU-кэшем горячих ключей"""
+
+    def __init__(self, filename: str = "fsm.db", cache_size: int = 1024,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.filename = filename
+        self.cache_size = cache_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        # Autocommit: транзакции открываем сами, где нужно чтение-изменение-запись
+        self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(SCHEMA)
+        # Все обращения к соединению и кэшу - из одного потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+
+        self._cache = OrderedDict()  # key -> (state, data)
+        self._data_version = None
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # Работа с базой, выполняется в потоке хранилища
+    def _check_version(self):
+        """Сбросить кэш, если после прошлой проверки писал другой процесс"""
+        version = self._conn.execute(DATA_VERSION).fetchone()[0]
+        if version != self._data_version:
+            if self._data_version is not None and self._cache:
+                self._cache.clear()
+                self.invalidations += 1
+            self._data_version = version
+
+    def _load(self, key: str):
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        row = self._conn.execute(SELECT_KEY, (key,)).fetchone()
+        entry = (row[0], json.loads(row[1])) if row else (None, {})
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _store(self, key: str, state, data: dict):
+        if state is None and not data:
+            self._conn.execute(DELETE_KEY, (key,))
+        else:
+            self._conn.execute(UPSERT_KEY, (key, state, json.dumps(data, ensure_ascii=False)))
+        self._remember(key, (state, data))
+
+    def _get(self, key: str):
+        self._check_version()
+        return self._load(key)
+
+    def _modify(self, key: str, state=..., data: dict = None, merge: bool = False):
+        """Прочитать и записать ключ одной транзакцией: другие процессы ждут ее конца"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._check_version()
+            old_state, old_data = self._load(key)
+            new_state = old_state if state is ... else state
+            if data is None:
+                new_data = old_data
+            elif merge:
+                new_data = {**old_data, **data}
+            else:
+                new_data = dict(data)
+            self._store(key, new_state, new_data)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            self._cache.pop(key, None)
+            raise
+        return new_data
+
+    # Интерфейс BaseStorage
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        await self._run(self._modify, self.key_builder.build(key), state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._run(self._get, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._modify, self.key_builder.build(key), ..., data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._run(self._get, self.key_builder.build(key))
+        return dict(data)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        new_data = await self._run(self._modify, self.key_builder.build(key), ..., data, True)
+        return dict(new_data)
+
+    def stats(self) -> dict:
+        return {
+            "cached_keys": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+    async def close(self) -> None:
+        # Диспетчер закрывает хранилище при остановке polling, main - еще раз в конце
+        if self._conn is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+        self._conn = None
+
+
+def create_fsm_storage(backend: str = None, filename: str = None) -> BaseStorage:
+    """FSM-хранилище по имени: sqlite (по умолчанию) или memory"""
+    backend = backend or os.getenv("FSM_STORAGE", "sqlite")
+    if backend == "sqlite":
+        return SQLiteStorage(filename or os.getenv("FSM_PATH", "fsm.db"))
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное FSM-хранилище: {backend}")
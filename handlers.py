@@ -1,13 +1,20 @@
-import asyncio
-import random
-from aiogram import Router, types, F
+from functools import partial
+from aiogram import Bot, Router, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
 
+from buttons import buttons
 from config import *
 from database import db
+from export import FORMATS as EXPORT_FORMATS, build_export, export_slots
+from scheduler import scheduler
+from send_queue import PRIORITY_COMPLETION, PRIORITY_TICK, SendDropped, send_priority
+from session import Session
+from stats_cache import stats_cache
+from tips import catalog
 
 router = Router()
 
@@ -38,8 +45,13 @@ async def cmd_start(message: types.Message):
         reply_markup=get_main_keyboard()
     )
 
+# Кнопки reply-клавиатур: один обработчик, кнопка ищется по тексту в реестре
+@router.message(buttons.filter)
+async def button_pressed(message: types.Message, button, **data):
+    await buttons.dispatch(message, button, data)
+
 # Обработка кнопки "🍅 Начать сессию"
-@router.message(F.text == "🍅 Начать сессию")
+@buttons("start_session", throttle="session")
 async def start_session_button(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     
@@ -60,7 +72,7 @@ async def start_session_button(message: types.Message, state: FSMContext):
     )
 
 # Обработка кнопки "📊 Статистика"
-@router.message(F.text == "📊 Статистика")
+@buttons("stats", throttle="stats")
 async def stats_button(message: types.Message):
     await message.answer(
         "📈 *Выбери тип статистики:*",
@@ -69,7 +81,7 @@ async def stats_button(message: types.Message):
     )
 
 # Обработка кнопки "💡 Совет"
-@router.message(F.text == "💡 Совет")
+@buttons("tips")
 async def tips_button(message: types.Message):
     await message.answer(
         "💡 *Выбери категорию совета:*",
@@ -78,7 +90,7 @@ async def tips_button(message: types.Message):
     )
 
 # Обработка кнопки "❓ Помощь"
-@router.message(F.text == "❓ Помощь")
+@buttons("help")
 async def help_button(message: types.Message):
     help_text = """*📚 Помощь по использованию бота*
 
@@ -89,6 +101,7 @@ async def help_button(message: types.Message):
 
 *Во время сессии:*
 ⏸ **Пауза** - приостановить таймер
+▶️ **Продолжить** - снять сессию с паузы
 🛑 **Завершить** - досрочно закончить сессию
 ⏱ **Осталось времени** - узнать, сколько времени осталось
 📝 **Сменить задачу** - изменить задачу во время сессии
@@ -106,7 +119,7 @@ async def help_button(message: types.Message):
     await message.answer(help_text, parse_mode="Markdown")
 
 # Обработка кнопки "ℹ️ О проекте"
-@router.message(F.text == "ℹ️ О проекте")
+@buttons("about")
 async def about_button(message: types.Message):
     about_text = """*🤖 О проекте NoProk*
 
@@ -133,7 +146,7 @@ async def about_button(message: types.Message):
     await message.answer(about_text, parse_mode="Markdown")
 
 # Обработка инлайн-кнопок выбора типа задачи
-@router.callback_query(F.data.startswith("task_"))
+@router.callback_query(F.data.startswith("task_"), flags={"throttle": "session"})
 async def process_task_type(callback: types.CallbackQuery, state: FSMContext):
     task_type = callback.data.split("_")[1]
     
@@ -162,7 +175,7 @@ async def process_task_type(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработка кнопки "✏️ Своя задача"
-@router.callback_query(F.data == "custom_task")
+@router.callback_query(F.data == "custom_task", flags={"throttle": "session"})
 async def process_custom_task(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "✏️ *Введи название своей задачи:*\n\n"
@@ -174,7 +187,7 @@ async def process_custom_task(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработка ввода своей задачи
-@router.message(PomodoroStates.waiting_for_custom_task)
+@router.message(PomodoroStates.waiting_for_custom_task, flags={"throttle": "session"})
 async def process_custom_task_name(message: types.Message, state: FSMContext):
     task_name = message.text
     
@@ -194,8 +207,8 @@ async def process_custom_task_name(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработка выбора длительности сессии
-@router.callback_query(F.data.startswith("duration_"))
-async def process_duration(callback: types.CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.startswith("duration_"), flags={"throttle": "session"})
+async def process_duration(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
     duration = int(callback.data.split("_")[1])
     
     # Получаем сохраненную задачу
@@ -204,7 +217,9 @@ async def process_duration(callback: types.CallbackQuery, state: FSMContext):
     
     # Запускаем сессию
     user_id = callback.from_user.id
-    session_id = db.start_session(user_id, task_name, duration * 60)
+    # Это сообщение и будет живым статусом сессии: его id сохраняется вместе с сессией
+    session_id = db.start_session(user_id, task_name, duration * 60, callback.message.chat.id,
+                                  message_id=callback.message.message_id)
     
     # Отправляем сообщение о начале сессии
     await callback.message.edit_text(
@@ -218,7 +233,7 @@ async def process_duration(callback: types.CallbackQuery, state: FSMContext):
     )
     
     # Запускаем таймер
-    asyncio.create_task(run_timer(user_id, callback.message.chat.id, duration, task_name))
+    start_timer(bot, user_id, callback.message.chat.id, duration, task_name)
     
     await callback.answer(f"Сессия началась! {duration} минут фокуса.")
 
@@ -229,44 +244,129 @@ async def process_cancel(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer()
 
-# Функция таймера
-async def run_timer(user_id: int, chat_id: int, duration: int, task_name: str):
-    from aiogram import Bot
-    from config import BOT_TOKEN
-    
-    bot = Bot(token=BOT_TOKEN)
-    total_seconds = duration * 60
-    
+# Таймеры сессий
+def status_cadence(remaining: float) -> float:
+    """При каком остатке времени обновить статус сессии в следующий раз.
+
+    Раз в 15 минут по круглым отметкам, пока времени много, затем за
+    5 минут и за минуту до конца. Так даже 15-минутная сессия обходится
+    в 10 раз меньшим числом вызовов API, чем напоминания раз в 30 секунд.
+    """
+    if remaining > 15 * 60:
+        return ((remaining - 1) // 900) * 900
+    if remaining > 5 * 60:
+        return 5 * 60
+    return 60 if remaining > 60 else 0
+
+
+def render_status(session: Session, remaining: float) -> str:
+    """Текст живого сообщения о сессии"""
+    minutes_left = max(1, round(remaining / 60))
+    done = 1 - remaining / session.duration if session.duration else 1
+    filled = min(10, int(done * 10))
+
+    return (
+        f"🍅 *Сессия идет*\n\n"
+        f"*Задача:* {session.task}\n"
+        f"*Время:* {session.duration // 60} минут\n"
+        f"*Старт:* {session.start_time.strftime('%H:%M')}\n\n"
+        f"⏱ *Осталось:* ~{minutes_left} мин\n"
+        f"{'▓' * filled}{'░' * (10 - filled)}\n\n"
+        f"💪 Сосредоточься на задаче!"
+    )
+
+def start_timer(bot: Bot, user_id: int, chat_id: int, duration: int, task_name: str):
+    """Поставить таймер сессии в общий планировщик.
+
+    Уведомления идут через общий экземпляр бота из диспетчера,
+    так что все таймеры делят один пул HTTP-соединений.
+    """
+    scheduler.schedule(
+        user_id,
+        duration * 60,
+        on_expire=partial(finish_timer, bot, user_id, chat_id, task_name),
+        on_tick=partial(timer_tick, bot, user_id, chat_id, task_name),
+        interval=status_cadence
+    )
+
+
+def restore_timers(bot: Bot) -> int:
+    """Перевзвести таймеры сессий, переживших перезапуск бота.
+
+    Оставшееся время считается от момента старта по настенным часам;
+    просроченные сессии завершаются сразу, сессии на паузе остаются
+    на паузе. Все таймеры ставятся одним проходом.
+    """
+    timers = []
+    for user_id, session in db.active_sessions.items():
+        # В личных чатах chat_id совпадает с user_id
+        chat_id = session.chat_id or user_id
+        task_name = session.task
+        timers.append((
+            user_id,
+            max(0, session.remaining()),
+            partial(finish_timer, bot, user_id, chat_id, task_name),
+            partial(timer_tick, bot, user_id, chat_id, task_name),
+            status_cadence
+        ))
+    scheduler.schedule_many(timers)
+    for user_id, session in db.active_sessions.items():
+        if session.paused:
+            scheduler.pause(user_id)
+    return len(timers)
+
+
+def stop_timer(user_id: int):
+    """Снять таймер сессии"""
+    scheduler.cancel(user_id)
+
+
+async def timer_tick(bot: Bot, user_id: int, chat_id: int, task_name: str, remaining: float):
+    """Обновить живое сообщение о сессии вместо отправки нового"""
+    send_priority.set(PRIORITY_TICK)
+    session = db.get_session(user_id)
+    if not session:
+        stop_timer(user_id)
+        return
+
+    text = render_status(session, remaining)
+    if text == session.status_text:
+        return
+
+    try:
+        if session.message_id:
+            try:
+                await bot.edit_message_text(
+                    text=text,
+                    chat_id=chat_id,
+                    message_id=session.message_id,
+                    parse_mode="Markdown"
+                )
+            except TelegramBadRequest as e:
+                if "not modified" not in str(e):
+                    # Сообщение удалено или его больше нельзя редактировать
+                    session.message_id = None
+        if not session.message_id:
+            message = await bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+            # Новое живое сообщение сохраняем: после перезапуска редактируем его, а не шлем еще одно
+            db.set_message_id(user_id, message.message_id)
+        session.status_text = text
+    except SendDropped:
+        pass  # Очередь перегружена - следующее обновление все равно придет
+    except Exception as e:
+        print(f"Ошибка напоминания: {e}")
+
+
+async def finish_timer(bot: Bot, user_id: int, chat_id: int, task_name: str):
+    """Время сессии вышло: сохраняем статистику и сообщаем пользователю"""
+    send_priority.set(PRIORITY_COMPLETION)
     try:
-        while total_seconds > 0:
-            # Проверяем, активна ли еще сессия
-            if not db.get_session(user_id):
-                break
-            
-            # Обновляем каждые 30 секунд
-            if total_seconds % 30 == 0:
-                minutes = total_seconds // 60
-                seconds = total_seconds % 60
-                
-                try:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=f"⏱ *Осталось времени:* {minutes:02d}:{seconds:02d}\n"
-                             f"Задача: {task_name}",
-                        parse_mode="Markdown"
-                    )
-                except:
-                    pass
-            
-            await asyncio.sleep(1)
-            total_seconds -= 1
-        
         # Завершаем сессию
-        actual_duration = db.end_session(user_id)
-        
+        actual_duration = await db.end_session(user_id)
+
         if actual_duration:
             minutes = actual_duration // 60
-            
+
             await bot.send_message(
                 chat_id=chat_id,
                 text=f"✅ *Сессия завершена!*\n\n"
@@ -278,19 +378,14 @@ async def run_timer(user_id: int, chat_id: int, duration: int, task_name: str):
                 parse_mode="Markdown",
                 reply_markup=get_main_keyboard()
             )
-            
+
     except Exception as e:
         print(f"Ошибка таймера: {e}")
-    finally:
-        await bot.close()
 
 # Обработка статистики
-@router.callback_query(F.data.startswith("stats_"))
-async def process_stats(callback: types.CallbackQuery):
-    stat_type = callback.data.split("_")[1]
-    user_id = callback.from_user.id
-    
-    stats = db.get_user_stats(user_id)
+async def render_user_stats(user_id: int, stat_type: str) -> str:
+    """Личный экран статистики: today или week"""
+    stats = await db.get_user_stats(user_id)
     
     if stat_type == "today":
         text = f"📊 *Статистика за сегодня*\n\n"
@@ -304,97 +399,150 @@ async def process_stats(callback: types.CallbackQuery):
             text += f"\n💪 Осталось до цели: {4 - stats['today_sessions']} сессий"
         else:
             text += "\n🎯 Начни первую сессию прямо сейчас!"
-    
-    elif stat_type == "week":
+    else:
         text = f"📊 *Статистика за неделю*\n\n"
-        text += f"🍅 Всего сессий: {stats['total_sessions']}\n"
-        text += f"⏱ Общее время: {stats['total_time'] // 3600} ч {stats['total_time'] % 3600 // 60} мин\n"
+        text += f"🍅 Сессий за 7 дней: {stats['week_sessions']}\n"
+        text += f"⏱ Время за 7 дней: {stats['week_time'] // 3600} ч {stats['week_time'] % 3600 // 60} мин\n"
+        text += f"📚 Всего сессий: {stats['total_sessions']}\n"
         text += f"🎯 Любимая задача: {stats['favorite_task'] or 'Нет данных'}\n"
         text += f"🕐 Последняя активность: {stats['last_active'][:16] if stats['last_active'] != 'Никогда' else 'Никогда'}"
+    return text
+
+async def render_global_stats() -> str:
+    """Общий экран статистики, одинаковый для всех"""
+    global_stats = await db.get_global_stats()
+    text = f"🏆 *Общая статистика*\n\n"
+    text += f"👥 Всего пользователей: {global_stats['total_users']}\n"
+    text += f"🍅 Всего сессий: {global_stats['total_sessions']}\n"
+    text += f"⏱ Всего часов фокуса: {global_stats['total_time_hours']:.1f}\n"
+    text += f"🔥 Активных сегодня: {global_stats['active_today']}\n"
+    # Строка за год не зависит от версии статистики и считается раз в день
+    today = datetime.now().date()
+    text += await stats_cache.get_or_render((None, "year", today), partial(render_year_stats, today))
+    return text
+
+async def render_year_stats(today) -> str:
+    """Итоги за 365 полных дней до сегодняшнего.
+
+    Собираются из дней, недель и месяцев - это объединение множеств
+    пользователей за десятки дней, поэтому сегодняшний день в строку
+    не входит: прошлые дни не меняются, и строка пересчитывается только
+    при смене дня, а не после каждой завершенной сессии.
+    """
+    year_stats = await db.get_global_range_stats(today - timedelta(days=365), today - timedelta(days=1))
+    text = f"📅 За год (по вчера): {year_stats['sessions']} сессий, {year_stats['time'] // 3600} ч, "
+    text += f"участников: {year_stats['active_users']}"
+    return text
+
+async def render_top() -> tuple:
+    """Строки топ-10, общие для всех: (user_id, строка для себя, строка для остальных)"""
+    leaderboard = await db.get_leaderboard(10)
+    rows = []
+    for i, user in enumerate(leaderboard, 1):
+        hours = user['total_time'] // 3600
+        minutes = (user['total_time'] % 3600) // 60
+        rows.append((
+            user['user_id'],
+            f"*{i}. Ты* - {hours}ч {minutes}мин ({user['total_sessions']} сессий)\n",
+            f"{i}. Участник {user['user_id'][:4]}... - {hours}ч {minutes}мин\n"
+        ))
+    return tuple(rows)
+
+async def render_own_rank(user_id: int, top_size: int) -> str:
+    """Место пользователя под топом, если он в него не попал"""
+    # Если пользователь не попал в топ, показываем его место отдельно
+    rank = await db.get_user_rank(user_id)
+    if not rank or rank <= top_size:
+        return ""
+    stats = await db.get_user_stats(user_id)
+    hours = stats['total_time'] // 3600
+    minutes = (stats['total_time'] % 3600) // 60
+    return f"...\n*{rank}. Ты* - {hours}ч {minutes}мин ({stats['total_sessions']} сессий)\n"
+
+@router.callback_query(F.data.startswith("stats_"), flags={"throttle": "stats"})
+async def process_stats(callback: types.CallbackQuery):
+    stat_type = callback.data.split("_")[1]
+    user_id = callback.from_user.id
+    # Ключи кэша: день и версия статистики, которую видит экран
+    day = datetime.now().date()
+    reply_markup = None
+    
+    if stat_type in ("today", "week"):
+        text = await stats_cache.get_or_render(
+            (user_id, stat_type, day, db.user_version(user_id)),
+            partial(render_user_stats, user_id, stat_type)
+        )
     
     elif stat_type == "all":
-        global_stats = db.get_global_stats()
-        text = f"🏆 *Общая статистика*\n\n"
-        text += f"👥 Всего пользователей: {global_stats['total_users']}\n"
-        text += f"🍅 Всего сессий: {global_stats['total_sessions']}\n"
-        text += f"⏱ Всего часов фокуса: {global_stats['total_time_hours']:.1f}\n"
-        text += f"🔥 Активных сегодня: {global_stats['active_today']}"
+        text = await stats_cache.get_or_render((None, "all", day, db.version), render_global_stats)
     
     elif stat_type == "rating":
-        leaderboard = db.get_leaderboard(10)
+        # Топ-10 кэшируется один раз для всех, место в рейтинге - для каждого:
+        # оно меняется при любой сессии, поэтому тоже по общей версии
+        version = db.version
+        top = await stats_cache.get_or_render((None, "rating", day, version), render_top)
         text = "👑 *Топ-10 по продуктивности*\n\n"
+        user_key = str(user_id)
+        for top_user_id, own_line, other_line in top:
+            text += own_line if top_user_id == user_key else other_line
+        text += await stats_cache.get_or_render(
+            (user_id, "rating", day, version),
+            partial(render_own_rank, user_id, len(top))
+        )
         
-        for i, user in enumerate(leaderboard, 1):
-            hours = user['total_time'] // 3600
-            minutes = (user['total_time'] % 3600) // 60
-            
-            if str(user_id) == user['user_id']:
-                text += f"*{i}. Ты* - {hours}ч {minutes}мин ({user['total_sessions']} сессий)\n"
-            else:
-                text += f"{i}. Участник {user['user_id'][:4]}... - {hours}ч {minutes}мин\n"
-        
-        if not leaderboard:
+        if not top:
             text += "Пока нет данных. Будь первым!"
     
     else:
         text = "📤 *Экспорт статистики*\n\n"
-        text += "Эта функция в разработке. Скоро ты сможешь экспортировать статистику в CSV или PDF!"
+        text += "Выгрузка содержит все твои сессии и итоги по дням.\n"
+        text += "Выбери формат:"
+        reply_markup = get_export_keyboard()
     
-    await callback.message.edit_text(text, parse_mode="Markdown")
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=reply_markup)
     await callback.answer()
 
+@router.callback_query(F.data.startswith("export_"), flags={"throttle": "stats"})
+async def process_export(callback: types.CallbackQuery, bot: Bot):
+    fmt = callback.data.split("_")[1]
+    user_id = callback.from_user.id
+    
+    if fmt not in EXPORT_FORMATS:
+        await callback.answer()
+        return
+    
+    stats = await db.get_user_stats(user_id)
+    if not stats["total_sessions"]:
+        await callback.answer("Пока нечего выгружать - заверши хотя бы одну сессию.", show_alert=True)
+        return
+    
+    await callback.answer("Готовлю файл...")
+    try:
+        async with export_slots:
+            document = await build_export(db, user_id, fmt)
+            try:
+                await bot.send_document(
+                    chat_id=callback.message.chat.id,
+                    document=document,
+                    caption="📤 Твоя статистика: все сессии и итоги по дням"
+                )
+            finally:
+                document.close()
+    except Exception as e:
+        print(f"Ошибка экспорта: {e}")
+        await callback.message.answer("❌ Не удалось подготовить выгрузку. Попробуй позже.")
+
 # Обработка советов
 @router.callback_query(F.data.startswith("tip_"))
 async def process_tips(callback: types.CallbackQuery):
     tip_type = callback.data.split("_")[1]
-    
-    tips_by_category = {
-        "focus": [
-            "🎯 *Техника 'Помидора':* Работай 25 минут, отдыхай 5. После 4 циклов — длинный перерыв.",
-            "🎯 *Правило 2 минут:* Если задача занимает меньше 2 минут — сделай ее сразу.",
-            "🎯 *Метод 'Съешь лягушку':* Начни день с самой неприятной задачи.",
-            "🎯 *Техника 'Временных блоков':* Планируй день по 30-минутным блокам."
-        ],
-        "time": [
-            "⏰ *Матрица Эйзенхауэра:* Раздели задачи на: срочные/важные, несрочные/важные и т.д.",
-            "⏰ *Правило 52/17:* Работай 52 минуты, отдыхай 17. Исследования показывают максимальную эффективность.",
-            "⏰ *Метод '90 минут':* Человек может максимально концентрироваться 90 минут, затем нужен перерыв.",
-            "⏰ *Техника 'Альп':* Планируй задачи на день с учетом приоритетов и времени."
-        ],
-        "mental": [
-            "🧘 *Медитация осознанности:* 10 минут в день улучшают концентрацию на 20%.",
-            "🧘 *Техника '5-4-3-2-1':* Для борьбы с тревогой: найди 5 вещей, которые видишь, 4 — которые чувствуешь и т.д.",
-            "🧘 *Дневник благодарности:* Каждый день записывай 3 вещи, за которые благодарен.",
-            "🧘 *Дыхание 4-7-8:* Вдох на 4, задержка на 7, выдох на 8. Успокаивает нервную систему."
-        ],
-        "health": [
-            "🍎 *Правило 20-20-20:* Каждые 20 минут смотри на объект в 20 футах (6 метрах) в течение 20 секунд.",
-            "🍎 *Вода и продуктивность:* Обезвоживание на 2% снижает концентрацию на 10%. Пей воду!",
-            "🍎 *Сон и память:* Каждый час недосыпа снижает IQ на 1 пункт. Спи 7-9 часов.",
-            "🍎 *Физическая активность:* 30 минут упражнений в день улучшают когнитивные функции на 15%."
-        ],
-        "tools": [
-            "🔧 *Используй блокаторы сайтов:* Freedom, Cold Turkey для блокировки отвлекающих сайтов.",
-            "🔧 *Приложения для фокуса:* Forest, Focus To-Do, Be Focused помогут с таймерами.",
-            "🔧 *Шум для концентрации:* Белый шум, звуки дождя или coffitivity.com улучшают фокус.",
-            "🔧 *Метод 'Помодоро':* Используй наш бота для регулярных сессий фокуса!"
-        ]
-    }
-    
-    if tip_type == "random":
-        all_tips = []
-        for category_tips in tips_by_category.values():
-            all_tips.extend(category_tips)
-        tip = random.choice(all_tips)
-    else:
-        tips = tips_by_category.get(tip_type, ["💡 Хороший совет — начать прямо сейчас!"])
-        tip = random.choice(tips)
+    tip = catalog.next_tip(callback.from_user.id, tip_type)
     
     await callback.message.edit_text(tip, parse_mode="Markdown")
     await callback.answer()
 
 # Обработка команд управления сессией
-@router.message(F.text == "⏸ Пауза")
+@buttons("pause", throttle="session")
 async def pause_session(message: types.Message):
     user_id = message.from_user.id
     session = db.get_session(user_id)
@@ -403,14 +551,34 @@ async def pause_session(message: types.Message):
         await message.answer("У тебя нет активной сессии.")
         return
     
-    if session.get("paused"):
+    if session.paused:
         await message.answer("Сессия уже на паузе.")
     else:
-        session["paused"] = True
-        session["paused_at"] = datetime.now().isoformat()
-        await message.answer("⏸ Сессия поставлена на паузу. Используй кнопки для продолжения.")
+        db.pause_session(user_id)
+        scheduler.pause(user_id)
+        await message.answer("⏸ Сессия поставлена на паузу. Нажми «▶️ Продолжить», когда будешь готов.")
+
+@buttons("resume", throttle="session")
+async def resume_session(message: types.Message):
+    user_id = message.from_user.id
+    session = db.get_session(user_id)
+    
+    if not session:
+        await message.answer("У тебя нет активной сессии.")
+        return
+    
+    if not session.paused:
+        await message.answer("Сессия и так идет.")
+    else:
+        db.resume_session(user_id)
+        scheduler.resume(user_id)
+        remaining = max(0, int(session.remaining()))
+        await message.answer(
+            f"▶️ Сессия продолжается! *Осталось:* {remaining // 60:02d}:{remaining % 60:02d}",
+            parse_mode="Markdown"
+        )
 
-@router.message(F.text == "🛑 Завершить")
+@buttons("stop", throttle="session")
 async def stop_session(message: types.Message):
     user_id = message.from_user.id
     
@@ -418,7 +586,8 @@ async def stop_session(message: types.Message):
         await message.answer("У тебя нет активной сессии.")
         return
     
-    actual_duration = db.end_session(user_id)
+    stop_timer(user_id)
+    actual_duration = await db.end_session(user_id)
     minutes = actual_duration // 60 if actual_duration else 0
     
     await message.answer(
@@ -429,7 +598,7 @@ async def stop_session(message: types.Message):
         reply_markup=get_main_keyboard()
     )
 
-@router.message(F.text == "⏱ Осталось времени")
+@buttons("time_left")
 async def time_left(message: types.Message):
     user_id = message.from_user.id
     session = db.get_session(user_id)
@@ -438,9 +607,7 @@ async def time_left(message: types.Message):
         await message.answer("У тебя нет активной сессии.")
         return
     
-    start_time = datetime.fromisoformat(session["start_time"])
-    elapsed = (datetime.now() - start_time).seconds - session.get("paused_time", 0)
-    remaining = session["duration"] - elapsed
+    remaining = int(session.remaining())
     
     if remaining > 0:
         minutes = remaining // 60
@@ -449,7 +616,7 @@ async def time_left(message: types.Message):
     else:
         await message.answer("⏰ Время сессии истекло! Заверши сессию.")
 
-@router.message(F.text == "📝 Сменить задачу")
+@buttons("change_task", throttle="session")
 async def change_task(message: types.Message):
     await message.answer(
         "📝 *Введи новое название задачи:*",
@@ -462,6 +629,6 @@ async def change_task(message: types.Message):
 async def cmd_help(message: types.Message):
     await help_button(message)
 
-@router.message(Command("stats"))
+@router.message(Command("stats"), flags={"throttle": "stats"})
 async def cmd_stats(message: types.Message):
     await stats_button(message)
\ No newline at end of file
@@ -0,0 +1,52 @@
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """Рейтинг пользователей по общему времени фокуса.
+
+    Держит отсортированный список ключей (-время, user_id), который
+    обновляется точечно при каждой сессии. Топ-K - срез за O(K),
+    место пользователя - бинарный поиск за O(log n).
+    """
+
+    def __init__(self):
+        self._keys = []  # Отсортированы по убыванию времени
+        self._times = {}  # user_id -> текущее время в рейтинге
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id: str, total_time: int):
+        """Записать новое общее время пользователя"""
+        old_time = self._times.get(user_id)
+        if old_time == total_time:
+            return
+        if old_time is not None:
+            index = bisect_left(self._keys, (-old_time, user_id))
+            del self._keys[index]
+        self._times[user_id] = total_time
+        insort(self._keys, (-total_time, user_id))
+
+    def top(self, limit: int = 10):
+        """Первые limit пользователей: [(user_id, total_time), ...]"""
+        return [(user_id, -neg_time) for neg_time, user_id in self._keys[:limit]]
+
+    def rank(self, user_id: str):
+        """Место пользователя в рейтинге (с 1) или None"""
+        total_time = self._times.get(user_id)
+        if total_time is None:
+            return None
+        return bisect_left(self._keys, (-total_time, user_id)) + 1
+
+    @classmethod
+    def from_users(cls, users: dict):
+        """Построить рейтинг по словарю пользователей из базы"""
+        return cls.from_totals((user_id, data.get("total_time", 0)) for user_id, data in users.items())
+
+    @classmethod
+    def from_totals(cls, totals):
+        """Построить рейтинг по парам (user_id, общее время)"""
+        leaderboard = cls()
+        leaderboard._times = dict(totals)
+        leaderboard._keys = sorted((-total_time, user_id) for user_id, total_time in leaderboard._times.items())
+        return leaderboard
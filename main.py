@@ -1,9 +1,21 @@
 import os
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import CommandStart
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram import Dispatcher
+from aiohttp import web
+
+from bot_session import create_bot, pool_stats
+from database import db
+from fsm_storage import create_fsm_storage
+from handlers import restore_timers, router
+from metrics import setup_metrics, start_metrics_server
+from rollup import run_rollup
+from scheduler import scheduler
+from send_queue import send_queue
+from shutdown import (UpdateGate, apply_warm_start, drain, install_signal_handlers, keep_fsm_storage_open,
+                      read_warm_start, write_warm_start)
+from throttle import throttle
+from webhook import create_app
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,80 +32,69 @@ if not BOT_TOKEN:
     logger.error("Добавь BOT_TOKEN в настройки Railway")
     exit(1)
 
-# Инициализация бота
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # Публичный адрес, например https://noprok.up.railway.app
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEB_HOST = os.environ.get("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.environ.get("PORT", "8080"))
+# Метрики Prometheus слушают только локальный адрес; METRICS_PORT=0 отключает их
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
 
-# Клавиатура
-def get_main_keyboard():
-    keyboard = [
-        [KeyboardButton(text="🍅 Начать сессию")],
-        [KeyboardButton(text="📊 Статистика"), KeyboardButton(text="💡 Совет")],
-        [KeyboardButton(text="❓ Помощь"), KeyboardButton(text="ℹ️ О проекте")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    logger.error("❌ Для BOT_MODE=webhook нужен WEBHOOK_URL")
+    exit(1)
 
-# Обработчики
-@dp.message(CommandStart())
-async def cmd_start(message: types.Message):
-    logger.info(f"Получен /start от {message.from_user.id}")
-    
-    welcome_text = """🎯 *PROкрай - бот для борьбы с прокрастинацией*
+# Без секрета кто угодно может прислать на webhook поддельные обновления
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    logger.error("❌ Для BOT_MODE=webhook нужен WEBHOOK_SECRET")
+    exit(1)
 
-🤖 *Развернут на Railway 24/7*
-📊 *Автоматическое обновление из GitHub*
-🚀 *Высокая доступность*
+# Инициализация бота: один экземпляр и один пул соединений на весь процесс
+bot = create_bot(BOT_TOKEN)
+# Состояния диалогов хранятся в SQLite: переживают перезапуск и общие для процессов
+dp = Dispatcher(storage=create_fsm_storage())
+dp.include_router(router)
+# Хранилище FSM закрывается в finally main, после drain, а не при остановке polling
+keep_fsm_storage_open(dp)
+# Первым outer middleware, до встроенных: после остановки новые апдейты
+# не доходят ни до хранилища FSM, ни до обработчиков
+gate = UpdateGate()
+gate.install(dp)
+# Анти-флуд раньше метрик обработчиков, а повторы и явный флуд - еще до чтения
+# состояния FSM: отброшенные нажатия не доходят ни до хранилища, ни до обработчиков
+throttle.install(dp)
+setup_metrics(dp, bot=bot)
 
-*Используй кнопки ниже:*"""
+async def run_webhook(drop_pending_updates: bool):
+    app = create_app(dp, bot, WEBHOOK_SECRET, WEBHOOK_PATH)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEB_HOST, port=WEB_PORT)
+    await site.start()
+    logger.info(f"🌐 Webhook-сервер слушает {WEB_HOST}:{WEB_PORT}{WEBHOOK_PATH}")
     
-    await message.answer(
-        welcome_text,
-        parse_mode="Markdown",
-        reply_markup=get_main_keyboard()
-    )
-
-@dp.message(lambda message: message.text == "🍅 Начать сессию")
-async def start_session(message: types.Message):
-    await message.answer(
-        "✅ *Сессия начата!*\n25 минут фокусированной работы.",
-        parse_mode="Markdown"
-    )
-
-@dp.message(lambda message: message.text == "📊 Статистика")
-async def show_stats(message: types.Message):
-    await message.answer(
-        "📊 *Статистика системы:*\n"
-        "🟢 Бот работает на Railway\n"
-        "⏱ Время работы: 24/7\n"
-        "🚀 Авторазвертывание: Да",
-        parse_mode="Markdown"
-    )
-
-@dp.message(lambda message: message.text == "💡 Совет")
-async def send_tip(message: types.Message):
-    await message.answer(
-        "💡 *Совет от Railway:*\n"
-        "Используй облачные платформы для 24/7 работы ботов!",
-        parse_mode="Markdown"
-    )
-
-@dp.message(lambda message: message.text == "❓ Помощь")
-async def show_help(message: types.Message):
-    await message.answer(
-        "❓ *Помощь:*\nБот развернут на Railway.app\n"
-        "Обновления автоматически из GitHub",
-        parse_mode="Markdown"
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=drop_pending_updates
     )
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
-@dp.message(lambda message: message.text == "ℹ️ О проекте")
-async def about_project(message: types.Message):
-    await message.answer(
-        "ℹ️ *О проекте:*\n"
-        "🤖 Бот развернут на Railway\n"
-        "🎓 Школьный проект 10 класс\n"
-        "🚀 Технологии: Python, Aiogram, Railway",
-        parse_mode="Markdown"
-    )
+async def run_polling(drop_pending_updates: bool):
+    # Сбрасываем вебхуки; после теплого старта накопленные апдейты оставляем
+    await bot.delete_webhook(drop_pending_updates=drop_pending_updates)
+    
+    # Запускаем polling; обновления обрабатываются параллельно задачами.
+    # Сигналы и сессию бота обрабатывает main: сначала остановка, потом закрытие
+    await dp.start_polling(bot, handle_as_tasks=True, handle_signals=False, close_bot_session=False)
 
 # Запуск бота
 async def main():
@@ -103,11 +104,64 @@ async def main():
     logger.info(f"🚀 Запущено на Railway")
     logger.info(f"⏱ Время: {__import__('datetime').datetime.now()}")
     
-    # Сбрасываем вебхуки
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Файл теплого старта оставляет предыдущий процесс при плавной остановке
+    warm_start = read_warm_start()
+    if warm_start:
+        apply_warm_start(warm_start, db)
+        logger.info(f"♨️ Теплый старт: {warm_start['timers']} таймеров, "
+                    f"остановка заняла {warm_start['seconds']:.1f} с")
     
-    # Запускаем polling
-    await dp.start_polling(bot)
+    # Возвращаем таймеры сессий, которые шли до перезапуска
+    restored = restore_timers(bot)
+    if restored:
+        logger.info(f"⏱ Восстановлено таймеров: {restored}")
+    
+    # Старые дни общей статистики сворачиваются в недели и месяцы в фоне
+    rollup_task = asyncio.create_task(run_rollup(db))
+    
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    
+    stop = asyncio.Event()
+    install_signal_handlers(stop)
+    if BOT_MODE == "webhook":
+        runner_task = asyncio.create_task(run_webhook(drop_pending_updates=not warm_start))
+    else:
+        runner_task = asyncio.create_task(run_polling(drop_pending_updates=not warm_start))
+    stop_task = asyncio.create_task(stop.wait())
+    
+    try:
+        await asyncio.wait({runner_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        if runner_task.done():
+            runner_task.result()  # Упавший polling или сервер - без плавной остановки
+        else:
+            logger.info("🛑 Получен сигнал остановки")
+            # Перестаем брать апдейты; уже начатые доделает drain.
+            # Ворота закрываются раньше polling: апдейты, полученные в последнем
+            # getUpdates, не обрабатываются, а достаются следующему процессу
+            gate.closed = True
+            if BOT_MODE == "webhook":
+                runner_task.cancel()
+            else:
+                await dp.stop_polling()
+            await asyncio.gather(runner_task, return_exceptions=True)
+            
+            rollup_task.cancel()
+            report = await drain(gate, scheduler, send_queue, db)
+            write_warm_start(report)
+            if BOT_MODE != "webhook" and report["next_offset"] is not None:
+                # Подтверждаем Telegram обработанные апдейты, остальные получит следующий процесс
+                await bot.get_updates(offset=report["next_offset"], limit=1, timeout=0)
+    finally:
+        stop_task.cancel()
+        rollup_task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await dp.storage.close()
+        await db.close()
+        logger.info(f"🔌 Пул соединений: {pool_stats(bot)}")
+        await bot.session.close()
 
 if __name__ == "__main__":
     print("=" * 50)
@@ -0,0 +1,236 @@
+"""Метрики бота в формате Prometheus.
+
+Гистограммы задержек по типам апдейтов, обработчикам и методам базы,
+плюс датчики текущего состояния (сессии, таймеры, очередь отправки).
+На горячем пути - только perf_counter, bisect по 12 границам и
+прибавление к счетчикам; текст для Prometheus собирается при запросе.
+"""
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_BUCKET_LABELS = tuple(repr(bound) for bound in BUCKETS) + ("+Inf",)
+
+# Методы хранилища, время которых меряем
+DATABASE_METHODS = (
+    "start_session", "pause_session", "resume_session", "end_session",
+    "get_user_stats", "get_user_range_stats", "get_global_stats", "get_global_range_stats",
+    "get_leaderboard", "get_user_rank",
+)
+
+
+class Histogram:
+    """Распределение значений одной серии"""
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Последняя корзина - больше всех границ
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class HistogramFamily:
+    """Гистограммы с одной меткой: значение метки -> Histogram"""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.series = {}
+
+    def observe(self, label_value: str, value: float):
+        histogram = self.series.get(label_value)
+        if histogram is None:
+            histogram = self.series[label_value] = Histogram()
+        histogram.observe(value)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, histogram in sorted(self.series.items()):
+            labels = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(_BUCKET_LABELS, histogram.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{self.name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._families = []
+        self._gauges = {}  # имя -> (тип, описание, функция без аргументов)
+        self.updates = self.histogram("noprok_update_seconds", "Время обработки апдейта по типу", "type")
+        self.handlers = self.histogram("noprok_handler_seconds", "Время работы обработчика", "handler")
+        self.database = self.histogram("noprok_db_seconds", "Время операции хранилища", "method")
+
+    def histogram(self, name: str, help_text: str, label: str) -> HistogramFamily:
+        family = HistogramFamily(name, help_text, label)
+        self._families.append(family)
+        return family
+
+    def gauge(self, name: str, help_text: str, callback, kind: str = "gauge"):
+        """Датчик (или счетчик при kind="counter"), значение считается в момент запроса"""
+        self._gauges[name] = (kind, help_text, callback)
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        for name, (kind, help_text, callback) in self._gauges.items():
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning(f"Датчик {name} недоступен: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware диспетчера: время обработки апдейта по его типу"""
+
+    def __init__(self, family: HistogramFamily):
+        self.family = family
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.family.observe(event.event_type, time.perf_counter() - start)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Middleware обработчиков: время работы по имени обработчика"""
+
+    def __init__(self, family: HistogramFamily):
+        self.family = family
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            # Кнопки reply-клавиатур идут через один обработчик - меряем по обработчику кнопки
+            button = data.get("button")
+            callback = button.handler if button is not None else data["handler"].callback
+            self.family.observe(callback.__name__, time.perf_counter() - start)
+
+
+def instrument(obj, names, family: HistogramFamily):
+    """Подменить методы объекта обертками, которые меряют их время"""
+    for name in names:
+        method = getattr(obj, name, None)
+        if method is None:
+            continue
+
+        if asyncio.iscoroutinefunction(method):
+            async def wrapper(*args, _method=method, _name=name, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await _method(*args, **kwargs)
+                finally:
+                    family.observe(_name, time.perf_counter() - start)
+        else:
+            def wrapper(*args, _method=method, _name=name, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return _method(*args, **kwargs)
+                finally:
+                    family.observe(_name, time.perf_counter() - start)
+
+        setattr(obj, name, functools.wraps(method)(wrapper))
+
+
+def setup_metrics(dispatcher, registry: "Metrics" = None, bot=None) -> "Metrics":
+    """Подключить метрики к диспетчеру, базе, планировщику, очереди отправки, кэшу статистики,
+    анти-флуду и пулу соединений бота"""
+    from database import db
+    from scheduler import scheduler
+    from send_queue import send_queue
+    from stats_cache import stats_cache
+    from throttle import throttle
+
+    registry = registry or metrics
+    dispatcher.update.outer_middleware(UpdateMetricsMiddleware(registry.updates))
+    # Middleware на уровне диспетчера действуют и на обработчики вложенных роутеров
+    dispatcher.message.middleware(HandlerMetricsMiddleware(registry.handlers))
+    dispatcher.callback_query.middleware(HandlerMetricsMiddleware(registry.handlers))
+    instrument(db, DATABASE_METHODS, registry.database)
+
+    registry.gauge("noprok_active_sessions", "Активные сессии", lambda: len(db.active_sessions))
+    registry.gauge("noprok_pending_timers", "Таймеры в планировщике", lambda: len(scheduler))
+    registry.gauge("noprok_send_queue_depth", "Запросы в очереди отправки", lambda: send_queue.depth)
+    registry.gauge("noprok_send_queue_sent_total", "Отправлено через очередь",
+                   lambda: send_queue.sent, kind="counter")
+    registry.gauge("noprok_send_queue_dropped_total", "Отброшено напоминаний",
+                   lambda: send_queue.dropped, kind="counter")
+    registry.gauge("noprok_stats_cache_entries", "Экраны статистики в кэше", lambda: len(stats_cache))
+    registry.gauge("noprok_stats_cache_hits_total", "Экраны статистики из кэша",
+                   lambda: stats_cache.hits, kind="counter")
+    registry.gauge("noprok_stats_cache_misses_total", "Экраны статистики, собранные заново",
+                   lambda: stats_cache.misses, kind="counter")
+    registry.gauge("noprok_throttle_tracked", "Ведра анти-флуда в памяти", lambda: len(throttle))
+    registry.gauge("noprok_throttled_total", "Нажатия, отброшенные анти-флудом",
+                   lambda: throttle.throttled, kind="counter")
+    registry.gauge("noprok_coalesced_total", "Повторные нажатия, слитые с уже идущими",
+                   lambda: throttle.coalesced, kind="counter")
+    if bot is not None:
+        from bot_session import pool_stats
+
+        registry.gauge("noprok_http_pool_acquired", "Соединения с Telegram API в работе",
+                       lambda: pool_stats(bot)["in_use"])
+        registry.gauge("noprok_http_pool_idle", "Открытые соединения, ждущие в пуле",
+                       lambda: pool_stats(bot)["idle"])
+        registry.gauge("noprok_http_pool_requests_total", "Выдачи соединений из пула",
+                       lambda: pool_stats(bot)["requests"], kind="counter")
+        registry.gauge("noprok_http_pool_created_total", "Открытые новые соединения",
+                       lambda: pool_stats(bot)["created"], kind="counter")
+        registry.gauge("noprok_http_pool_reused_total", "Повторно использованные соединения",
+                       lambda: pool_stats(bot)["reused"], kind="counter")
+    return registry
+
+
+async def start_metrics_server(host: str, port: int, registry: "Metrics" = None) -> web.AppRunner:
+    """Отдавать метрики на http://host:port/metrics"""
+    registry = registry or metrics
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode('utf-8'),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
+
+
+# Глобальный экземпляр
+metrics = Metrics()
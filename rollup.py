@@ -0,0 +1,171 @@
+"""Свертка старой дневной статистики в недельные и месячные итоги.
+
+Полная детализация по дням (с множеством пользователей за день) живет
+daily_retention дней. Более старые дни складываются в две ступени:
+
+    weekly_stats   "2026-09-28" -> итоги части недели внутри одного месяца
+                   (ключ - первый день части); живут weekly_retention недель
+    monthly_stats  "2026-09" -> итоги месяца; хранятся всегда
+
+Недели режутся по границам месяцев, так что каждая неделя целиком лежит
+в своем месяце. Уникальные пользователи ступеней считаются HyperLogLog
+фиксированного размера (1 КБ, ошибка около 3%), а не множествами id.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import math
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INTERVAL = 3600  # Секунд между проходами свертки
+ROLLUP_BATCH = 4  # Дней за шаг; между шагами цикл событий свободен
+
+
+class HyperLogLog:
+    """Оценка числа уникальных значений в 2**P байтах"""
+    __slots__ = ("registers",)
+
+    P = 10
+    M = 1 << P
+    _ALPHA = 0.7213 / (1 + 1.079 / M)
+    _POWERS = tuple(2.0 ** -rank for rank in range(64 - P + 2))
+    _HIGH_BITS = int.from_bytes(b"\x80" * M, 'little')
+
+    def __init__(self, registers: bytes = None):
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.M)
+
+    def add(self, value: str):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+        index = hashed & (self.M - 1)
+        rank = 64 - self.P - (hashed >> self.P).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog"):
+        # Регистры меньше 128, поэтому максимум считается сразу по всем байтам как
+        # по одному большому числу: в (a | 0x80) - b старший бит байта остается, где a >= b
+        a = int.from_bytes(self.registers, 'little')
+        b = int.from_bytes(other.registers, 'little')
+        mask = ((((a | self._HIGH_BITS) - b) & self._HIGH_BITS) >> 7) * 0xFF
+        self.registers = bytearray(((a & mask) | (b & ~mask)).to_bytes(self.M, 'little'))
+
+    def __len__(self) -> int:
+        estimate = self._ALPHA * self.M * self.M / sum(map(self._POWERS.__getitem__, self.registers))
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.M and zeros:
+            # Мало значений: точнее линейный подсчет по пустым регистрам
+            estimate = self.M * math.log(self.M / zeros)
+        return round(estimate)
+
+    def to_json(self) -> str:
+        return base64.b64encode(self.registers).decode('ascii')
+
+    @classmethod
+    def from_json(cls, blob: str) -> "HyperLogLog":
+        return cls(base64.b64decode(blob))
+
+
+def month_key(day: date) -> str:
+    return day.strftime("%Y-%m")
+
+
+def week_key(day: date) -> str:
+    """Первый день части недели: понедельник или 1-е число, если оно позже"""
+    return max(day - timedelta(days=day.weekday()), day.replace(day=1)).isoformat()
+
+
+def _empty_tier() -> dict:
+    return {"sessions": 0, "time": 0, "users": HyperLogLog()}
+
+
+def fold_day(weekly: dict, monthly: dict, day: date, daily: dict):
+    """Добавить итоги дня в его неделю и месяц"""
+    # Пользователей дня хешируем один раз и сливаем в обе ступени
+    sketch = HyperLogLog()
+    sketch.update(daily["users"])
+    for tier, key in ((weekly, week_key(day)), (monthly, month_key(day))):
+        bucket = tier.get(key)
+        if bucket is None:
+            bucket = tier[key] = _empty_tier()
+        bucket["sessions"] += daily["sessions"]
+        bucket["time"] += daily["time"]
+        bucket["users"].merge(sketch)
+
+
+def load_tier(tier: dict) -> dict:
+    """Восстановить HyperLogLog ступени после чтения из JSON"""
+    for bucket in tier.values():
+        bucket["users"] = HyperLogLog.from_json(bucket["users"])
+    return tier
+
+
+def rolled_buckets(weekly: dict, monthly: dict):
+    """Свернутые периоды без пересечений: (первый день, итоги).
+
+    Берутся недели; то, что осталось от месяца после удаления части его
+    недель, датируется первым числом. Пользователей остатка вычесть
+    нельзя, поэтому у него HyperLogLog всего месяца.
+    """
+    weeks_by_month = {}
+    for key, bucket in weekly.items():
+        weeks_by_month.setdefault(key[:7], []).append((key, bucket))
+    for key, month in monthly.items():
+        weeks = weeks_by_month.get(key, [])
+        for week, bucket in weeks:
+            yield date.fromisoformat(week), bucket
+        sessions = month["sessions"] - sum(bucket["sessions"] for _, bucket in weeks)
+        if sessions:
+            time = month["time"] - sum(bucket["time"] for _, bucket in weeks)
+            yield date.fromisoformat(key + "-01"), {"sessions": sessions, "time": time, "users": month["users"]}
+
+
+def range_stats(daily_stats: dict, weekly: dict, monthly: dict, start: date, end: date) -> dict:
+    """Сессии, время и уникальные пользователи за [start, end] по всем ступеням.
+
+    Дни в окне детализации считаются точно, свернутые - с точностью до
+    недели или месяца: период учитывается, если его первый день попал в диапазон.
+    """
+    sessions = time = 0
+    users = set()
+    sketch = None
+    day = start
+    while day <= end:
+        daily = daily_stats.get(day.isoformat())
+        if daily:
+            sessions += daily["sessions"]
+            time += daily["time"]
+            users |= daily["users"]
+        day += timedelta(days=1)
+
+    for bucket_start, bucket in rolled_buckets(weekly, monthly):
+        if start <= bucket_start <= end:
+            sessions += bucket["sessions"]
+            time += bucket["time"]
+            if sketch is None:
+                sketch = HyperLogLog()
+            sketch.merge(bucket["users"])
+
+    if sketch is not None:
+        sketch.update(users)
+        active_users = len(sketch)
+    else:
+        active_users = len(users)
+    return {"sessions": sessions, "time": time, "active_users": active_users}
+
+
+async def run_rollup(db, interval: float = ROLLUP_INTERVAL, batch: int = ROLLUP_BATCH):
+    """Фоновая свертка: шагами по batch дней, раз в interval секунд"""
+    while True:
+        try:
+            while db.rollup_history(batch):
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"Ошибка свертки статистики: {e}")
+        await asyncio.sleep(interval)
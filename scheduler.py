@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import logging
+import math
+from itertools import count
+
+logger = logging.getLogger(__name__)
+
+
+def _fixed_cadence(interval: float):
+    """Тики на каждой отметке, кратной interval секундам до конца"""
+    def cadence(remaining: float) -> float:
+        return (math.ceil(remaining / interval - 1e-9) - 1) * interval
+    return cadence
+
+
+class _TimerEntry:
+    """Один таймер сессии внутри планировщика"""
+    __slots__ = ("key", "deadline", "cadence", "tick_at", "on_tick", "on_expire",
+                 "generation", "remaining")
+
+    def __init__(self, key, deadline, interval, on_tick, on_expire):
+        self.key = key
+        self.deadline = deadline
+        if on_tick is None or not interval:
+            self.cadence = None
+        elif callable(interval):
+            self.cadence = interval
+        else:
+            self.cadence = _fixed_cadence(interval)
+        self.tick_at = None  # Сколько секунд будет оставаться в момент следующего тика
+        self.on_tick = on_tick
+        self.on_expire = on_expire
+        self.generation = 0
+        self.remaining = None  # Заполняется на время паузы
+
+
+class TimerScheduler:
+    """Общий планировщик для всех таймеров сессий.
+
+    Хранит дедлайны в одной куче и держит ровно один `loop.call_at`
+    на ближайшее событие, поэтому цикл просыпается только когда что-то
+    действительно наступило. Отмена и пауза ленивые: запись в куче
+    помечается устаревшей через счетчик поколений и пропускается.
+    """
+
+    def __init__(self):
+        self._heap = []  # (время, порядковый номер, поколение, запись)
+        self._entries = {}
+        self._seq = count()
+        self._handle = None
+        self._handle_when = None
+        self._tasks = set()
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    # Публичное API
+    def schedule(self, key, duration: float, on_expire, on_tick=None, interval: float = 0):
+        """Запланировать таймер на duration секунд.
+
+        on_tick(remaining) вызывается каждые interval секунд, on_expire() -
+        по истечении времени. Оба - корутинные функции. Вместо числа
+        interval может быть функцией: по оставшемуся времени она возвращает,
+        при каком остатке сработает следующий тик (0 - тиков больше нет).
+        Существующий таймер с тем же ключом заменяется.
+        """
+        self.cancel(key)
+        loop = asyncio.get_running_loop()
+        entry = _TimerEntry(key, loop.time() + duration, interval, on_tick, on_expire)
+        self._entries[key] = entry
+        self._arm_entry(entry, duration)
+
+    def schedule_many(self, timers):
+        """Запланировать пачку таймеров одним проходом.
+
+        timers - итерируемое из (key, duration, on_expire, on_tick, interval).
+        Куча перестраивается один раз за O(n) вместо n вставок по O(log n).
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        for key, duration, on_expire, on_tick, interval in timers:
+            self.cancel(key)
+            entry = _TimerEntry(key, now + duration, interval, on_tick, on_expire)
+            self._entries[key] = entry
+            self._set_next_tick(entry, duration)
+            self._heap.append((self._next_event(entry), next(self._seq), entry.generation, entry))
+        heapq.heapify(self._heap)
+        self._rearm()
+
+    def cancel(self, key) -> bool:
+        """Отменить таймер. O(1): запись в куче просто устаревает"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry.generation += 1
+        return True
+
+    def pause(self, key) -> bool:
+        """Поставить таймер на паузу, запомнив оставшееся время"""
+        entry = self._entries.get(key)
+        if entry is None or entry.remaining is not None:
+            return False
+        loop = asyncio.get_running_loop()
+        entry.remaining = max(0.0, entry.deadline - loop.time())
+        entry.generation += 1
+        return True
+
+    def resume(self, key) -> bool:
+        """Продолжить таймер после паузы. O(log n)"""
+        entry = self._entries.get(key)
+        if entry is None or entry.remaining is None:
+            return False
+        loop = asyncio.get_running_loop()
+        remaining, entry.remaining = entry.remaining, None
+        entry.deadline = loop.time() + remaining
+        self._arm_entry(entry, remaining)
+        return True
+
+    def remaining(self, key):
+        """Оставшееся время таймера в секундах или None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.remaining is not None:
+            return entry.remaining
+        return max(0.0, entry.deadline - asyncio.get_running_loop().time())
+
+    def stop(self) -> dict:
+        """Перестать срабатывать перед остановкой бота.
+
+        Возвращает остаток времени таймеров: key -> (секунд, на паузе).
+        Просроченные за время остановки таймеры доведет до конца
+        следующий процесс при восстановлении.
+        """
+        self._stopped = True
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = self._handle_when = None
+        return {key: (self.remaining(key), entry.remaining is not None)
+                for key, entry in self._entries.items()}
+
+    async def wait_tasks(self, timeout: float) -> int:
+        """Дождаться уже запущенных тиков и завершений. Возвращает, сколько не успело"""
+        if not self._tasks:
+            return 0
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        return len(pending)
+
+    # Внутренняя механика
+    def _arm_entry(self, entry, remaining: float):
+        """Рассчитать следующий тик и взвести запись"""
+        self._set_next_tick(entry, remaining)
+        self._push(entry)
+        self._rearm()
+
+    @staticmethod
+    def _set_next_tick(entry, remaining: float):
+        """Тики выровнены по дедлайну: срабатывают при заданном остатке времени"""
+        tick_at = entry.cadence(remaining) if entry.cadence else 0
+        entry.tick_at = tick_at if 0 < tick_at < remaining else None
+
+    @staticmethod
+    def _next_event(entry) -> float:
+        if entry.tick_at is not None:
+            return entry.deadline - entry.tick_at
+        return entry.deadline
+
+    def _push(self, entry):
+        """Положить в кучу следующее событие: тик или дедлайн"""
+        heapq.heappush(self._heap, (self._next_event(entry), next(self._seq), entry.generation, entry))
+
+    def _rearm(self):
+        """Держим единственный call_at на вершину кучи"""
+        if self._stopped:
+            return
+        # Выкидываем устаревшие записи с вершины
+        while self._heap and self._heap[0][2] != self._heap[0][3].generation:
+            heapq.heappop(self._heap)
+
+        if not self._heap:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = self._handle_when = None
+            return
+
+        when = self._heap[0][0]
+        if self._handle is not None and self._handle_when <= when:
+            return
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = asyncio.get_running_loop().call_at(when, self._on_due)
+        self._handle_when = when
+
+    def _on_due(self):
+        self._handle = self._handle_when = None
+        now = asyncio.get_running_loop().time()
+
+        while self._heap and self._heap[0][0] <= now:
+            _, _, generation, entry = heapq.heappop(self._heap)
+            if generation != entry.generation:
+                continue
+
+            if entry.tick_at is not None:
+                remaining = entry.tick_at
+                self._set_next_tick(entry, remaining)
+                self._push(entry)
+                self._spawn(entry.on_tick(remaining))
+            else:
+                self._entries.pop(entry.key, None)
+                entry.generation += 1
+                self._spawn(entry.on_expire())
+
+        self._rearm()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Ошибка таймера: {task.exception()}")
+
+
+# Глобальный экземпляр
+scheduler = TimerScheduler()
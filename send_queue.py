@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+import logging
+from contextvars import ContextVar
+from itertools import count
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import SEND_CHAT_BURST, SEND_CHAT_RATE, SEND_GLOBAL_RATE, SEND_QUEUE_MAX_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше число, тем раньше уходит сообщение
+PRIORITY_INTERACTIVE = 0  # Ответы на действия пользователя
+PRIORITY_COMPLETION = 1   # Уведомления о завершении сессии
+PRIORITY_TICK = 2         # Напоминания об оставшемся времени
+
+# Приоритет задается для текущей задачи: send_priority.set(PRIORITY_TICK)
+send_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+
+class SendDropped(Exception):
+    """Сообщение низкого приоритета отброшено из-за перегрузки очереди"""
+
+
+class SendQueue(BaseRequestMiddleware):
+    """Общая очередь исходящих запросов к Telegram API.
+
+    Подключается как middleware сессии бота, поэтому через нее проходят
+    все запросы с chat_id - и ответы обработчиков, и сообщения таймеров.
+    Лимит на чат - GCRA (виртуальное время следующей отправки), общий
+    лимит - корзина токенов, которую ожидающие получают в порядке
+    приоритета. На TelegramRetryAfter чат ставится на паузу и запрос
+    повторяется. Напоминания при перегрузке отбрасываются.
+    """
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: int = SEND_CHAT_BURST, max_depth: int = SEND_QUEUE_MAX_DEPTH,
+                 tick_max_wait: float = 10.0, max_retries: int = 5):
+        self.global_rate = global_rate
+        self.chat_interval = 1 / chat_rate
+        self.chat_burst = chat_burst
+        self.max_depth = max_depth
+        self.tick_max_wait = tick_max_wait  # Напоминание, ждущее дольше, уже неактуально
+        self.max_retries = max_retries
+
+        self._chat_tat = {}  # chat_id -> теоретическое время следующей отправки (GCRA)
+        self._heap = []  # (приоритет, порядковый номер, future) - ждут общий токен
+        self._seq = count()
+        self._tokens = global_rate
+        self._updated = None
+        self._pump_handle = None
+        self._chat_waiting = 0
+        self.closing = False  # Бот останавливается: напоминания больше не отправляем
+
+        # Метрики
+        self.sent = 0
+        self.dropped = 0
+        self.retried = 0
+
+    @property
+    def depth(self) -> int:
+        """Сколько запросов сейчас ждут отправки"""
+        return len(self._heap) + self._chat_waiting
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "tracked_chats": len(self._chat_tat),
+        }
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery и т.п. не ограничиваем
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                logger.warning(f"Flood control в чате {chat_id}: пауза {e.retry_after} с")
+                self._pause_chat(chat_id, e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    async def drain(self, timeout: float) -> int:
+        """Перестать брать напоминания и дождаться отправки очереди.
+
+        Возвращает, сколько запросов так и осталось ждать к сроку.
+        """
+        self.closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.depth and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.depth
+
+    # Лимит на чат
+    def _reserve_chat(self, chat_id, now: float, priority: int) -> float:
+        """Зарезервировать слот в чате и вернуть, сколько ждать"""
+        tat = max(self._chat_tat.get(chat_id, now), now)
+        wait = max(0.0, tat - now - (self.chat_burst - 1) * self.chat_interval)
+
+        if priority >= PRIORITY_TICK and (self.closing or wait > self.tick_max_wait
+                                          or self.depth >= self.max_depth):
+            self.dropped += 1
+            raise SendDropped(chat_id)
+
+        self._chat_tat[chat_id] = tat + self.chat_interval
+        if len(self._chat_tat) > 4 * self.max_depth:
+            self._forget_idle_chats(now)
+        return wait
+
+    def _pause_chat(self, chat_id, seconds: float):
+        now = asyncio.get_running_loop().time()
+        self._chat_tat[chat_id] = max(self._chat_tat.get(chat_id, now), now) + seconds
+
+    def _forget_idle_chats(self, now: float):
+        """Чаты, чей лимит уже восстановился, хранить незачем"""
+        self._chat_tat = {chat_id: tat for chat_id, tat in self._chat_tat.items() if tat > now}
+
+    # Общий лимит
+    async def _acquire(self, chat_id, priority: int):
+        loop = asyncio.get_running_loop()
+        wait = self._reserve_chat(chat_id, loop.time(), priority)
+        if wait > 0:
+            self._chat_waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._chat_waiting -= 1
+
+        future = loop.create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self._pump()
+        await future
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.global_rate, self._tokens + (now - self._updated) * self.global_rate)
+        self._updated = now
+
+    def _pump(self):
+        """Раздать общие токены ожидающим в порядке приоритета"""
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        loop = asyncio.get_running_loop()
+        self._refill(loop.time())
+
+        while self._heap and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._heap)
+            if future.done():  # Отправитель отменил ожидание
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+
+        if self._heap:
+            delay = (1 - self._tokens) / self.global_rate
+            self._pump_handle = loop.call_later(delay, self._pump)
+
+
+# Глобальный экземпляр
+send_queue = SendQueue()
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime
+
+
+class Session:
+    """Активная Pomodoro-сессия.
+
+    Время считается по монотонным часам (не прыгает при переводе
+    системных часов), а момент старта хранится и по настенным часам -
+    только он переживает перезапуск бота. Пауза копит paused_time,
+    так что прошедшее и оставшееся время считаются без разбора строк.
+    """
+    __slots__ = ("user_id", "task", "duration", "chat_id", "started_at", "started_mono",
+                 "paused_time", "paused_mono", "message_id", "status_text")
+
+    def __init__(self, user_id: int, task: str, duration: int, chat_id: int = None,
+                 started_at: float = None, paused_time: float = 0.0, paused_at: float = None):
+        now_mono = time.monotonic()
+        now_wall = time.time()
+
+        self.user_id = user_id
+        self.task = task
+        self.duration = duration
+        self.chat_id = chat_id
+        self.started_at = now_wall if started_at is None else started_at
+        # Переносим старт с настенных часов на монотонные
+        self.started_mono = now_mono - (now_wall - self.started_at)
+        self.paused_time = paused_time
+        self.paused_mono = None if paused_at is None else now_mono - (now_wall - paused_at)
+        self.message_id = None  # Живое сообщение со статусом сессии
+        self.status_text = None
+
+    @property
+    def id(self) -> str:
+        return f"{self.user_id}_{self.started_at}"
+
+    @property
+    def paused(self) -> bool:
+        return self.paused_mono is not None
+
+    @property
+    def start_time(self) -> datetime:
+        return datetime.fromtimestamp(self.started_at)
+
+    def elapsed(self, now: float = None) -> float:
+        """Сколько секунд сессия шла, без учета пауз"""
+        if now is None:
+            now = time.monotonic()
+        if self.paused_mono is not None:
+            now = self.paused_mono
+        return now - self.started_mono - self.paused_time
+
+    def remaining(self, now: float = None) -> float:
+        """Сколько секунд осталось до конца сессии"""
+        return self.duration - self.elapsed(now)
+
+    def pause(self) -> bool:
+        if self.paused_mono is not None:
+            return False
+        self.paused_mono = time.monotonic()
+        return True
+
+    def resume(self) -> bool:
+        if self.paused_mono is None:
+            return False
+        self.paused_time += time.monotonic() - self.paused_mono
+        self.paused_mono = None
+        return True
+
+    # Компактное представление для журнала и снимков
+    def to_record(self) -> dict:
+        record = {"t": self.task, "d": self.duration, "st": self.started_at, "c": self.chat_id}
+        if self.paused_time:
+            record["pt"] = self.paused_time
+        if self.paused_mono is not None:
+            record["pa"] = time.time() - (time.monotonic() - self.paused_mono)
+        if self.message_id:
+            record["m"] = self.message_id
+        return record
+
+    @classmethod
+    def from_record(cls, user_id: int, record: dict):
+        if "task" in record:  # Старый снимок: словарь сессии целиком
+            record = {"t": record["task"], "d": record["duration"], "st": record["start_time"],
+                      "c": record.get("chat_id"), "pt": record.get("paused_time", 0.0),
+                      "m": record.get("message_id")}
+        started_at = record["st"]
+        if isinstance(started_at, str):  # Старый формат: ISO-строка
+            started_at = datetime.fromisoformat(started_at).timestamp()
+        session = cls(user_id, record["t"], record["d"], record.get("c"), started_at,
+                      record.get("pt", 0.0), record.get("pa"))
+        session.message_id = record.get("m")
+        return session
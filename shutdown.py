@@ -0,0 +1,211 @@
+"""Плавная остановка бота по SIGTERM (редеплой на Railway) и SIGINT.
+
+Порядок остановки:
+1. Перестаем брать апдейты: закрываем UpdateGate и останавливаем polling
+   или webhook-сервер. Хранилище FSM при этом открыто: его закрывает
+   только main, когда обработчики уже дождались (см. keep_fsm_storage_open).
+2. Останавливаем планировщик. Остатки таймеров не сохраняются: следующий
+   процесс считает их от времени старта сессий по настенным часам
+   (restore_timers), так что время передеплоя тоже учтено.
+3. Напоминания больше не шлем; дожидаемся обработчиков, уже запущенных
+   тиков и завершений сессий и очереди отправки - все в пределах срока.
+4. База фиксирует все изменения и сворачивает журнал (db.checkpoint).
+5. Пишем файл теплого старта: живые сообщения сессий и первый
+   необработанный апдейт. Следующий процесс читает его один раз
+   и не выбрасывает апдейты, накопившиеся за время передеплоя.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+
+from config import SHUTDOWN_TIMEOUT, WARM_START_MAX_AGE, WARM_START_PATH
+
+logger = logging.getLogger(__name__)
+
+WARM_START_VERSION = 1
+# Без этих полей файлом теплого старта пользоваться нельзя
+WARM_START_KEYS = {"written_at", "timers", "seconds", "sessions", "next_offset"}
+
+
+class UpdateGate(BaseMiddleware):
+    """Outer middleware диспетчера: считает апдейты в обработке и не пускает новые после закрытия.
+
+    Ставится через install() самым первым, до встроенных middleware aiogram:
+    отброшенный апдейт не читает состояние FSM и не падает на нем.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.in_flight = 0
+        self.last_update_id = None  # Последний принятый в обработку апдейт
+        self.first_dropped_id = None  # Первый апдейт, пришедший после закрытия
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        if self.closed:
+            if self.first_dropped_id is None or event.update_id < self.first_dropped_id:
+                self.first_dropped_id = event.update_id
+            return UNHANDLED
+
+        self.in_flight += 1
+        self._idle.clear()
+        if self.last_update_id is None or event.update_id > self.last_update_id:
+            self.last_update_id = event.update_id
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    def install(self, dispatcher):
+        """Поставить перед всеми outer middleware апдейтов, в т.ч. встроенными"""
+        observer = dispatcher.update.outer_middleware
+        registered = list(observer)
+        for middleware in registered:
+            observer.unregister(middleware)
+        observer.register(self)
+        for middleware in registered:
+            observer.register(middleware)
+
+    @property
+    def next_offset(self):
+        """С какого апдейта должен продолжить следующий процесс"""
+        if self.first_dropped_id is not None:
+            return self.first_dropped_id
+        return self.last_update_id + 1 if self.last_update_id is not None else None
+
+    async def wait_idle(self, timeout: float) -> int:
+        """Дождаться обработчиков. Возвращает, сколько апдейтов не успело"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.in_flight
+
+
+def keep_fsm_storage_open(dispatcher):
+    """Не закрывать хранилище FSM при остановке polling или webhook-сервера.
+
+    Dispatcher регистрирует fsm.close в shutdown, а stop_polling вызывает
+    его сразу - пока обработчики, которые ждет drain, еще пишут состояние.
+    Хранилище закрывает main после drain.
+    """
+    dispatcher.shutdown.handlers = [
+        handler for handler in dispatcher.shutdown.handlers
+        if handler.callback != dispatcher.fsm.close
+    ]
+
+
+def install_signal_handlers(stop: asyncio.Event):
+    """SIGTERM и SIGINT запускают остановку вместо мгновенного выхода"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows: остается KeyboardInterrupt
+            pass
+
+
+async def drain(gate: UpdateGate, scheduler, send_queue, db, timeout: float = SHUTDOWN_TIMEOUT) -> dict:
+    """Доделать начатую работу и зафиксировать состояние. Возвращает отчет для файла теплого старта"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    gate.closed = True
+    timers = scheduler.stop()
+    send_queue.closing = True
+
+    def left() -> float:
+        return max(0.0, deadline - loop.time())
+
+    unfinished_updates, unfinished_timers = await asyncio.gather(
+        gate.wait_idle(left()), scheduler.wait_tasks(left()))
+    unsent = await send_queue.drain(left())
+    # База - последней: завершения сессий выше еще пишут в нее
+    await db.checkpoint()
+
+    report = {
+        "timers": len(timers),
+        "unfinished_updates": unfinished_updates,
+        "unfinished_timers": unfinished_timers,
+        "unsent": unsent,
+        "seconds": timeout - left(),
+    }
+    logger.info(f"🛑 Остановка: {report}")
+
+    sessions = {}
+    for user_id in timers:
+        session = db.get_session(user_id)
+        sessions[str(user_id)] = {
+            "message_id": session.message_id if session else None,
+            "status_text": session.status_text if session else None,
+        }
+    report["sessions"] = sessions
+    report["next_offset"] = gate.next_offset
+    return report
+
+
+def write_warm_start(report: dict, filename: str = WARM_START_PATH):
+    """Записать файл теплого старта атомарно"""
+    state = {"version": WARM_START_VERSION, "written_at": time.time(), **report}
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def read_warm_start(filename: str = WARM_START_PATH, max_age: float = WARM_START_MAX_AGE):
+    """Прочитать и удалить файл теплого старта. None - холодный старт"""
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except ValueError:
+        state = None
+    finally:
+        # Файл одноразовый: после падения этого процесса он уже неверен
+        os.remove(filename)
+
+    # Обрезанный или правленный руками файл - холодный старт, а не падение
+    if not _valid_warm_start(state):
+        logger.warning("Файл теплого старта поврежден - холодный старт")
+        return None
+    if time.time() - state["written_at"] > max_age:
+        logger.info("Файл теплого старта устарел - холодный старт")
+        return None
+    return state
+
+
+def _valid_warm_start(state) -> bool:
+    """Версия наша, все поля на месте и нужного типа"""
+    if not isinstance(state, dict) or state.get("version") != WARM_START_VERSION:
+        return False
+    if not WARM_START_KEYS <= state.keys():
+        return False
+    numbers = (state["written_at"], state["timers"], state["seconds"])
+    return all(isinstance(value, (int, float)) for value in numbers) and isinstance(state["sessions"], dict)
+
+
+def apply_warm_start(state: dict, db) -> int:
+    """Вернуть сессиям живые сообщения из файла теплого старта"""
+    restored = 0
+    for user_key, saved in state["sessions"].items():
+        if not user_key.lstrip("-").isdigit() or not isinstance(saved, dict):
+            continue
+        session = db.get_session(int(user_key))
+        if session is None:
+            continue
+        session.message_id = session.message_id or saved.get("message_id")
+        session.status_text = saved.get("status_text")
+        restored += 1
+    return restored
@@ -0,0 +1,325 @@
+"""Компактный двоичный снимок базы (data.snap).
+
+Формат, версия 1 (все числа little-endian):
+
+    заголовок   "NPKS", u16 версия, u16 флаги
+    meta        u64 длина + JSON: все, кроме пользователей (дневная
+                статистика, активные сессии, journal_seq)
+    tasks       u64 длина + u32 число + (u16 длина + UTF-8) на задачу
+    index       u64 длина + записи по 32 байта: i64 user_id, i64 total_time,
+                u32 total_sessions, u64 смещение, u32 длина записи.
+                Отсортированы как рейтинг: по убыванию времени, затем по id
+    records     u64 длина + записи пользователей подряд
+
+Запись пользователя:
+
+    u16 длина + last_active (ISO-строка, пустая - None)
+    u32 число задач + (u32 номер задачи, u32 сессии, u64 время) на задачу
+    u32 число дней + (u32 порядковый номер дня, u32 сессии, u64 время) на день
+    u32 длина + JSON прочих полей (пусто, если их нет)
+
+Названия задач хранятся один раз в таблице tasks, а записи ссылаются на
+них номерами. Таблица только дописывается, поэтому нетронутые записи при
+следующем снимке копируются байтами, без разбора.
+
+Файл открывается через mmap: при старте читаются только meta и индекс,
+а запись пользователя разбирается при первом обращении к ней.
+
+Конвертер: python snapshot.py convert data.json data.snap
+Просмотр:  python snapshot.py dump data.snap
+"""
+import argparse
+import copy
+import json
+import mmap
+import struct
+from collections.abc import MutableMapping
+from datetime import date
+
+MAGIC = b"NPKS"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHH")
+_SECTION = struct.Struct("<Q")
+_COUNT = struct.Struct("<I")
+_STRING = struct.Struct("<H")
+_INDEX_ENTRY = struct.Struct("<qqIQI")
+_COUNTER = struct.Struct("<IIQ")
+
+_USER_FIELDS = ("total_sessions", "total_time", "last_active", "tasks", "days")
+
+
+class SnapshotError(Exception):
+    """Файл не является снимком поддерживаемой версии"""
+
+
+def is_snapshot(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# Запись пользователя
+def _encode_user(user_data: dict, task_ids: dict, tasks: list) -> bytes:
+    parts = []
+    last_active = (user_data.get("last_active") or "").encode('utf-8')
+    parts.append(_STRING.pack(len(last_active)) + last_active)
+
+    user_tasks = user_data.get("tasks", {})
+    parts.append(_COUNT.pack(len(user_tasks)))
+    for task, counts in user_tasks.items():
+        task_id = task_ids.get(task)
+        if task_id is None:
+            task_id = task_ids[task] = len(tasks)
+            tasks.append(task)
+        parts.append(_COUNTER.pack(task_id, counts["sessions"], counts["time"]))
+
+    days = user_data.get("days", {})
+    parts.append(_COUNT.pack(len(days)))
+    for day, (sessions, time) in days.items():
+        parts.append(_COUNTER.pack(date.fromisoformat(day).toordinal(), sessions, time))
+
+    extra = {key: value for key, value in user_data.items() if key not in _USER_FIELDS}
+    extra = json.dumps(extra, ensure_ascii=False, separators=(",", ":")).encode('utf-8') if extra else b""
+    parts.append(_COUNT.pack(len(extra)) + extra)
+    return b"".join(parts)
+
+
+def _decode_user(buffer, offset: int, total_sessions: int, total_time: int, tasks: list) -> dict:
+    (length,) = _STRING.unpack_from(buffer, offset)
+    offset += _STRING.size
+    last_active = bytes(buffer[offset:offset + length]).decode('utf-8') or None
+    offset += length
+
+    (count,) = _COUNT.unpack_from(buffer, offset)
+    offset += _COUNT.size
+    user_tasks = {}
+    for task_id, sessions, time in _COUNTER.iter_unpack(buffer[offset:offset + count * _COUNTER.size]):
+        user_tasks[tasks[task_id]] = {"sessions": sessions, "time": time}
+    offset += count * _COUNTER.size
+
+    (count,) = _COUNT.unpack_from(buffer, offset)
+    offset += _COUNT.size
+    days = {}
+    for ordinal, sessions, time in _COUNTER.iter_unpack(buffer[offset:offset + count * _COUNTER.size]):
+        days[date.fromordinal(ordinal).isoformat()] = [sessions, time]
+    offset += count * _COUNTER.size
+
+    user_data = {
+        "total_sessions": total_sessions,
+        "total_time": total_time,
+        "last_active": last_active,
+        "tasks": user_tasks,
+        "days": days,
+    }
+    (length,) = _COUNT.unpack_from(buffer, offset)
+    if length:
+        offset += _COUNT.size
+        user_data.update(json.loads(bytes(buffer[offset:offset + length])))
+    return user_data
+
+
+class UserTable(MutableMapping):
+    """Пользователи из снимка: словарь, который разбирает записи по требованию.
+
+    Разобранные записи кэшируются и дальше меняются на месте, как в
+    обычном словаре. Для рейтинга и общих счетчиков хватает индекса.
+    """
+
+    def __init__(self, buffer, index_offset: int, count: int, records_offset: int, tasks: list):
+        self._buffer = buffer
+        self._index_offset = index_offset
+        self._records_offset = records_offset
+        self.tasks = tasks  # Таблица задач файла; новые задачи дописываются в конец
+        self._positions = {}  # user_key -> номер записи в индексе
+        for position, entry in enumerate(_INDEX_ENTRY.iter_unpack(
+                buffer[index_offset:index_offset + count * _INDEX_ENTRY.size])):
+            self._positions[str(entry[0])] = position
+        self._decoded = {}
+        self._deleted = set()
+        self._added = 0  # Пользователи, которых нет в файле
+
+    def _entry(self, position: int):
+        return _INDEX_ENTRY.unpack_from(self._buffer, self._index_offset + position * _INDEX_ENTRY.size)
+
+    def __getitem__(self, user_key: str) -> dict:
+        user_data = self._decoded.get(user_key)
+        if user_data is not None:
+            return user_data
+        position = self._positions.get(user_key)
+        if position is None or user_key in self._deleted:
+            raise KeyError(user_key)
+        _, total_time, total_sessions, offset, _ = self._entry(position)
+        user_data = _decode_user(self._buffer, self._records_offset + offset, total_sessions, total_time, self.tasks)
+        self._decoded[user_key] = user_data
+        return user_data
+
+    def __setitem__(self, user_key: str, user_data: dict):
+        if user_key not in self:
+            if user_key in self._positions:
+                self._deleted.discard(user_key)
+            else:
+                self._added += 1
+        self._decoded[user_key] = user_data
+
+    def __delitem__(self, user_key: str):
+        if user_key not in self:
+            raise KeyError(user_key)
+        self._decoded.pop(user_key, None)
+        if user_key in self._positions:
+            self._deleted.add(user_key)
+        else:
+            self._added -= 1
+
+    def __contains__(self, user_key) -> bool:
+        if user_key in self._decoded:
+            return True
+        return user_key in self._positions and user_key not in self._deleted
+
+    def __iter__(self):
+        yield from self._decoded
+        for user_key in self._positions:
+            if user_key not in self._decoded and user_key not in self._deleted:
+                yield user_key
+
+    def __len__(self) -> int:
+        return len(self._positions) - len(self._deleted) + self._added
+
+    def freeze(self) -> "UserTable":
+        """Копия для снимка в потоке писателя: записи файла неизменны и общие,
+        словарь разобранных записей копируется (сами записи база копирует при изменении)"""
+        frozen = copy.copy(self)
+        frozen._decoded = dict(self._decoded)
+        frozen._deleted = set(self._deleted)
+        frozen.tasks = list(self.tasks)
+        return frozen
+
+    @property
+    def decoded(self) -> int:
+        """Сколько записей уже разобрано"""
+        return len(self._decoded)
+
+    def summaries(self):
+        """(user_key, total_sessions, total_time) для всех пользователей без разбора записей"""
+        for user_key, user_data in self._decoded.items():
+            yield user_key, user_data["total_sessions"], user_data["total_time"]
+        for user_key, position in self._positions.items():
+            if user_key not in self._decoded and user_key not in self._deleted:
+                _, total_time, total_sessions, _, _ = self._entry(position)
+                yield user_key, total_sessions, total_time
+
+    def raw(self, user_key: str) -> bytes:
+        """Байты неразобранной записи - для копирования в новый снимок"""
+        _, _, _, offset, length = self._entry(self._positions[user_key])
+        start = self._records_offset + offset
+        return bytes(self._buffer[start:start + length])
+
+
+def user_summaries(users):
+    """(user_key, total_sessions, total_time) по словарю пользователей или UserTable"""
+    if isinstance(users, UserTable):
+        return users.summaries()
+    return ((user_key, user_data["total_sessions"], user_data["total_time"])
+            for user_key, user_data in users.items())
+
+
+# Снимок целиком
+def encode(meta: dict, users, json_default=None) -> bytes:
+    """Собрать снимок. Нетронутые записи UserTable копируются без разбора"""
+    tasks = list(users.tasks) if isinstance(users, UserTable) else []
+    task_ids = {task: task_id for task_id, task in enumerate(tasks)}
+
+    entries = []  # (-total_time, user_key, total_sessions, запись)
+    for user_key, total_sessions, total_time in user_summaries(users):
+        if isinstance(users, UserTable) and user_key not in users._decoded:
+            record = users.raw(user_key)
+        else:
+            record = _encode_user(users[user_key], task_ids, tasks)
+        entries.append((-total_time, user_key, total_sessions, record))
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+
+    index = bytearray()
+    records = []
+    offset = 0
+    for neg_time, user_key, total_sessions, record in entries:
+        index += _INDEX_ENTRY.pack(int(user_key), -neg_time, total_sessions, offset, len(record))
+        records.append(record)
+        offset += len(record)
+
+    task_table = [_COUNT.pack(len(tasks))]
+    for task in tasks:
+        encoded = task.encode('utf-8')
+        task_table.append(_STRING.pack(len(encoded)) + encoded)
+    task_table = b"".join(task_table)
+
+    meta = json.dumps(meta, ensure_ascii=False, separators=(",", ":"), default=json_default).encode('utf-8')
+    return b"".join((
+        _HEADER.pack(MAGIC, VERSION, 0),
+        _SECTION.pack(len(meta)), meta,
+        _SECTION.pack(len(task_table)), task_table,
+        _SECTION.pack(len(index)), bytes(index),
+        _SECTION.pack(offset), *records,
+    ))
+
+
+def load(filename: str) -> dict:
+    """Открыть снимок: meta разбирается сразу, пользователи - по требованию"""
+    with open(filename, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, _ = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotError(f"{filename}: не снимок NoProk")
+    if version != VERSION:
+        raise SnapshotError(f"{filename}: неподдерживаемая версия снимка {version}")
+
+    sections = []
+    offset = _HEADER.size
+    for _ in range(4):
+        (length,) = _SECTION.unpack_from(buffer, offset)
+        offset += _SECTION.size
+        sections.append((offset, length))
+        offset += length
+    (meta_offset, meta_length), (tasks_offset, _), (index_offset, index_length), (records_offset, _) = sections
+
+    data = json.loads(bytes(buffer[meta_offset:meta_offset + meta_length]))
+
+    (count,) = _COUNT.unpack_from(buffer, tasks_offset)
+    position = tasks_offset + _COUNT.size
+    tasks = []
+    for _ in range(count):
+        (length,) = _STRING.unpack_from(buffer, position)
+        position += _STRING.size
+        tasks.append(bytes(buffer[position:position + length]).decode('utf-8'))
+        position += length
+
+    data["users"] = UserTable(buffer, index_offset, index_length // _INDEX_ENTRY.size, records_offset, tasks)
+    return data
+
+
+def convert(json_filename: str, snapshot_filename: str) -> int:
+    """Переписать data.json старого формата в data.snap"""
+    with open(json_filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    users = data.pop("users", {})
+    with open(snapshot_filename, 'wb') as f:
+        f.write(encode(data, users))
+    return len(users)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Двоичные снимки NoProk")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Переписать data.json в data.snap")
+    convert_parser.add_argument("source", nargs="?", default="data.json")
+    convert_parser.add_argument("target", nargs="?", default="data.snap")
+    dump_parser = subparsers.add_parser("dump", help="Вывести снимок как JSON")
+    dump_parser.add_argument("source", nargs="?", default="data.snap")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        count = convert(args.source, args.target)
+        print(f"✅ Пользователей перенесено: {count}")
+    elif args.command == "dump":
+        data = load(args.source)
+        data["users"] = dict(data["users"].items())
+        print(json.dumps(data, ensure_ascii=False, indent=2))
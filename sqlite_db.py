@@ -0,0 +1,444 @@
+"""Хранилище статистики на SQLite.
+
+Тот же публичный интерфейс, что и у SimpleDatabase, но данные лежат
+в таблицах с индексами, а не в одном словаре в памяти.
+
+Перенос старых данных: python sqlite_db.py migrate data.json data.db
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+
+from database import BaseDatabase, SimpleDatabase
+from session import Session
+from writer import GroupCommitWriter
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    total_sessions INTEGER NOT NULL DEFAULT 0,
+    total_time INTEGER NOT NULL DEFAULT 0,
+    last_active TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_total_time ON users (total_time DESC, user_id);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    finished_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_day ON sessions (user_id, day);
+
+CREATE TABLE IF NOT EXISTS user_tasks (
+    user_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    time INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, task)
+);
+
+CREATE TABLE IF NOT EXISTS daily_stats (
+    day TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    time INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS daily_users (
+    day TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    time INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_users_user ON daily_users (user_id, day);
+
+CREATE TABLE IF NOT EXISTS active_sessions (
+    user_id INTEGER PRIMARY KEY,
+    task TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    start_time REAL NOT NULL,
+    chat_id INTEGER,
+    paused_time REAL NOT NULL DEFAULT 0,
+    paused_at REAL,
+    message_id INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS global_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    users INTEGER NOT NULL,
+    sessions INTEGER NOT NULL,
+    time INTEGER NOT NULL
+);
+"""
+
+# Счетчики пересчитываются один раз, если строки еще нет (новая база или миграция)
+INIT_TOTALS = """
+INSERT OR IGNORE INTO global_stats (id, users, sessions, time)
+SELECT 1, COUNT(*), COALESCE(SUM(total_sessions), 0), COALESCE(SUM(total_time), 0) FROM users
+"""
+REBUILD_TOTALS = INIT_TOTALS.replace("OR IGNORE", "OR REPLACE")
+# Тот же полный пересчет без записи - для сверки со счетчиками
+COUNT_TOTALS = "SELECT COUNT(*), COALESCE(SUM(total_sessions), 0), COALESCE(SUM(total_time), 0) FROM users"
+
+# Запросы - константы: sqlite3 кэширует подготовленные выражения по тексту
+SAVE_ACTIVE = """
+INSERT OR REPLACE INTO active_sessions (user_id, task, duration, start_time, chat_id, paused_time, paused_at, message_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+DELETE_ACTIVE = "DELETE FROM active_sessions WHERE user_id = ?"
+SELECT_ACTIVE = """
+SELECT user_id, task, duration, start_time, chat_id, paused_time, paused_at, message_id FROM active_sessions
+"""
+# Старая таблица хранила старт ISO-строкой и не знала о паузах
+UPGRADE_ACTIVE = """
+ALTER TABLE active_sessions RENAME TO active_sessions_old;
+CREATE TABLE active_sessions (
+    user_id INTEGER PRIMARY KEY,
+    task TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    start_time REAL NOT NULL,
+    chat_id INTEGER,
+    paused_time REAL NOT NULL DEFAULT 0,
+    paused_at REAL,
+    message_id INTEGER
+);
+INSERT INTO active_sessions (user_id, task, duration, start_time, chat_id)
+SELECT user_id, task, duration, start_time, chat_id FROM active_sessions_old;
+DROP TABLE active_sessions_old;
+"""
+USER_EXISTS = "SELECT 1 FROM users WHERE user_id = ?"
+UPDATE_TOTALS = "UPDATE global_stats SET users = users + ?, sessions = sessions + 1, time = time + ? WHERE id = 1"
+INSERT_SESSION = "INSERT INTO sessions (user_id, task, duration, day, finished_at) VALUES (?, ?, ?, ?, ?)"
+UPSERT_USER = """
+INSERT INTO users (user_id, total_sessions, total_time, last_active) VALUES (?, 1, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    total_sessions = total_sessions + 1,
+    total_time = total_time + excluded.total_time,
+    last_active = excluded.last_active
+"""
+UPSERT_TASK = """
+INSERT INTO user_tasks (user_id, task, sessions, time) VALUES (?, ?, 1, ?)
+ON CONFLICT (user_id, task) DO UPDATE SET
+    sessions = sessions + 1,
+    time = time + excluded.time
+"""
+UPSERT_DAY = """
+INSERT INTO daily_stats (day, sessions, time) VALUES (?, 1, ?)
+ON CONFLICT (day) DO UPDATE SET
+    sessions = sessions + 1,
+    time = time + excluded.time
+"""
+UPSERT_DAY_USER = """
+INSERT INTO daily_users (day, user_id, sessions, time) VALUES (?, ?, 1, ?)
+ON CONFLICT (day, user_id) DO UPDATE SET
+    sessions = sessions + 1,
+    time = time + excluded.time
+"""
+
+SELECT_USER = "SELECT total_sessions, total_time, last_active FROM users WHERE user_id = ?"
+SELECT_USER_RANGE = """
+SELECT COALESCE(SUM(sessions), 0), COALESCE(SUM(time), 0) FROM daily_users
+WHERE user_id = ? AND day BETWEEN ? AND ?
+"""
+SELECT_FAVORITE_TASK = "SELECT task FROM user_tasks WHERE user_id = ? ORDER BY time DESC LIMIT 1"
+SELECT_TOTALS = "SELECT users, sessions, time FROM global_stats WHERE id = 1"
+SELECT_DAY = "SELECT sessions FROM daily_stats WHERE day = ?"
+SELECT_DAY_USERS = "SELECT COUNT(*) FROM daily_users WHERE day = ?"
+SELECT_GLOBAL_RANGE = """
+SELECT COALESCE(SUM(sessions), 0), COALESCE(SUM(time), 0) FROM daily_stats WHERE day BETWEEN ? AND ?
+"""
+SELECT_RANGE_USERS = "SELECT COUNT(DISTINCT user_id) FROM daily_users WHERE day BETWEEN ? AND ?"
+SELECT_LEADERBOARD = """
+SELECT user_id, total_time, total_sessions FROM users ORDER BY total_time DESC, user_id LIMIT ?
+"""
+SELECT_USER_SESSIONS = """
+SELECT finished_at, task, duration FROM sessions WHERE user_id = ? ORDER BY day, finished_at
+"""
+SELECT_USER_DAYS = "SELECT day, sessions, time FROM daily_users WHERE user_id = ? ORDER BY day"
+SELECT_RANK = """
+SELECT COUNT(*) + 1 FROM users AS other, users AS me
+WHERE me.user_id = ? AND (other.total_time > me.total_time
+    OR (other.total_time = me.total_time AND other.user_id < me.user_id))
+"""
+
+
+def _connect(filename: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(filename, check_same_thread=False, cached_statements=64)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class SQLiteDatabase(BaseDatabase):
+    def __init__(self, filename="data.db"):
+        super().__init__()
+        self.filename = filename
+
+        # Схема и писатель: все изменения идут одной транзакцией на пачку
+        self._write_conn = _connect(filename)
+        self._write_conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._write_conn.execute("PRAGMA table_info(active_sessions)")}
+        if "paused_time" not in columns:
+            self._write_conn.executescript(UPGRADE_ACTIVE)
+        with self._write_conn:
+            self._write_conn.execute(INIT_TOTALS)
+        self._load_active_sessions()
+        self._writer = GroupCommitWriter(self._commit)
+
+        # Чтения - в отдельном потоке со своим соединением (WAL не блокирует их записью)
+        self._read_conn = _connect(filename)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-read")
+
+    async def _read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, self._read_conn, *args)
+
+    def _load_active_sessions(self):
+        """Поднять незавершенные сессии, пережившие перезапуск"""
+        for user_id, task, duration, start_time, chat_id, paused_time, paused_at, message_id \
+                in self._write_conn.execute(SELECT_ACTIVE):
+            record = {"t": task, "d": duration, "st": start_time, "c": chat_id,
+                      "pt": paused_time, "pa": paused_at, "m": message_id}
+            self.active_sessions[user_id] = Session.from_record(user_id, record)
+
+    # Запись
+    def _save_active_session(self, user_id: int, session: Session):
+        """Сохранить состояние активной сессии (старт, пауза, продолжение)"""
+        record = session.to_record()
+        return self._writer.submit(("start", user_id, session.task, session.duration, session.started_at,
+                                    session.chat_id, session.paused_time, record.get("pa"), session.message_id))
+
+    def _save_session_stats(self, user_id: int, session: Session, actual_duration: int):
+        """Сохранить статистику сессии. Возвращает future фиксации"""
+        now = datetime.now().isoformat()
+        return self._writer.submit(("finish", user_id, session.task, actual_duration, now[:10], now))
+
+    def _commit(self, ops: list):
+        """Записать пачку изменений одной транзакцией. Выполняется в потоке писателя"""
+        with self._write_conn:
+            for kind, *op in ops:
+                if kind == "start":
+                    self._write_conn.execute(SAVE_ACTIVE, op)
+                    continue
+
+                user_id, task, duration, day, finished_at = op
+                user_key = str(user_id)
+                self._write_conn.execute(DELETE_ACTIVE, (user_id,))
+                new_user = self._write_conn.execute(USER_EXISTS, (user_key,)).fetchone() is None
+                self._write_conn.execute(UPDATE_TOTALS, (int(new_user), duration))
+                self._write_conn.execute(INSERT_SESSION, (user_key, task, duration, day, finished_at))
+                self._write_conn.execute(UPSERT_USER, (user_key, duration, finished_at))
+                self._write_conn.execute(UPSERT_TASK, (user_key, task, duration))
+                self._write_conn.execute(UPSERT_DAY, (day, duration))
+                self._write_conn.execute(UPSERT_DAY_USER, (day, user_key, duration))
+
+    # Методы для статистики
+    async def get_user_stats(self, user_id: int, period: str = "today"):
+        """Получить статистику пользователя за период"""
+        today = date.today()
+        return await self._read(self._user_stats, str(user_id), today.isoformat(),
+                                (today - timedelta(days=6)).isoformat())
+
+    @staticmethod
+    def _user_stats(conn, user_key: str, today: str, week_start: str):
+        row = conn.execute(SELECT_USER, (user_key,)).fetchone()
+        total_sessions, total_time, last_active = row or (0, 0, "Никогда")
+        today_sessions, today_time = conn.execute(SELECT_USER_RANGE, (user_key, today, today)).fetchone()
+        week_sessions, week_time = conn.execute(SELECT_USER_RANGE, (user_key, week_start, today)).fetchone()
+        favorite = conn.execute(SELECT_FAVORITE_TASK, (user_key,)).fetchone()
+
+        return {
+            "total_sessions": total_sessions,
+            "total_time": total_time,
+            "today_sessions": today_sessions,
+            "today_time": today_time,
+            "week_sessions": week_sessions,
+            "week_time": week_time,
+            "favorite_task": favorite[0] if favorite else None,
+            "last_active": last_active
+        }
+
+    async def get_user_range_stats(self, user_id: int, start: date, end: date):
+        """Сессии и время пользователя за период [start, end] включительно"""
+        return await self._read(self._range_stats, str(user_id), start.isoformat(), end.isoformat())
+
+    @staticmethod
+    def _range_stats(conn, user_key: str, start: str, end: str):
+        sessions, time = conn.execute(SELECT_USER_RANGE, (user_key, start, end)).fetchone()
+        return {"sessions": sessions, "time": time}
+
+    async def get_global_stats(self):
+        """Получить глобальную статистику"""
+        return await self._read(self._global_stats, date.today().isoformat())
+
+    @staticmethod
+    def _global_stats(conn, today: str):
+        total_users, total_sessions, total_time = conn.execute(SELECT_TOTALS).fetchone()
+        today_row = conn.execute(SELECT_DAY, (today,)).fetchone()
+
+        return {
+            "total_users": total_users,
+            "total_sessions": total_sessions,
+            "total_time_hours": total_time / 3600,
+            "active_today": conn.execute(SELECT_DAY_USERS, (today,)).fetchone()[0],
+            "today_sessions": today_row[0] if today_row else 0
+        }
+
+    async def get_global_range_stats(self, start: date, end: date):
+        """Сессии, время и активные пользователи за период [start, end]"""
+        return await self._read(self._global_range_stats, start.isoformat(), end.isoformat())
+
+    @staticmethod
+    def _global_range_stats(conn, start: str, end: str):
+        sessions, time = conn.execute(SELECT_GLOBAL_RANGE, (start, end)).fetchone()
+        active_users = conn.execute(SELECT_RANGE_USERS, (start, end)).fetchone()[0]
+        return {"sessions": sessions, "time": time, "active_users": active_users}
+
+    async def get_leaderboard(self, limit: int = 10):
+        """Получить таблицу лидеров"""
+        return await self._read(self._leaderboard, limit)
+
+    @staticmethod
+    def _leaderboard(conn, limit: int):
+        return [
+            {"user_id": user_id, "total_time": total_time, "total_sessions": total_sessions}
+            for user_id, total_time, total_sessions in conn.execute(SELECT_LEADERBOARD, (limit,))
+        ]
+
+    async def get_user_rank(self, user_id: int):
+        """Место пользователя в рейтинге (с 1) или None"""
+        return await self._read(self._rank, str(user_id))
+
+    @staticmethod
+    def _rank(conn, user_key: str):
+        if conn.execute(SELECT_USER, (user_key,)).fetchone() is None:
+            return None
+        return conn.execute(SELECT_RANK, (user_key,)).fetchone()[0]
+
+    # Выгрузка: свое соединение на каждый итератор, чтобы долгий экспорт
+    # не занимал поток чтений (в WAL читатели друг другу не мешают)
+    def _iter_query(self, sql: str, params: tuple):
+        conn = _connect(self.filename)
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def iter_user_sessions(self, user_id: int):
+        """Завершенные сессии пользователя: (finished_at, task, duration)"""
+        return self._iter_query(SELECT_USER_SESSIONS, (str(user_id),))
+
+    def iter_user_days(self, user_id: int):
+        """Итоги пользователя по дням: (day, sessions, time)"""
+        return self._iter_query(SELECT_USER_DAYS, (str(user_id),))
+
+    async def check_consistency(self) -> bool:
+        """Сверить global_stats с пересчетом по users, как в REBUILD_TOTALS"""
+        await self._writer.flush()
+        totals, expected = await self._read(self._check_totals)
+        if totals != expected:
+            logger.warning(f"⚠️ Счетчики разошлись с данными: {totals} != {expected}")
+            return False
+        return True
+
+    @staticmethod
+    def _check_totals(conn):
+        return conn.execute(SELECT_TOTALS).fetchone(), conn.execute(COUNT_TOTALS).fetchone()
+
+    async def checkpoint(self):
+        """Пересохранить активные сессии (с живыми сообщениями и паузами) и перенести WAL в базу"""
+        for user_id, session in self.active_sessions.items():
+            self._save_active_session(user_id, session)
+        await self._writer.flush()
+        await asyncio.to_thread(self._write_conn.execute, "PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def close(self):
+        """Дождаться записи всех изменений и закрыть соединения"""
+        await self._writer.close()
+        self._executor.shutdown(wait=True)
+        self._read_conn.close()
+        self._write_conn.close()
+
+
+def migrate_json(json_filename: str, db_filename: str):
+    """Перенести данные из data.json (и его журнала) в SQLite.
+
+    Переносятся агрегаты (пользователи, задачи и дневная статистика)
+    и история отдельных сессий - та ее часть, что есть в частях data.history.
+    """
+    source = SimpleDatabase(json_filename)
+    target = SQLiteDatabase(db_filename)
+    conn = target._write_conn
+
+    with conn:
+        for user_key, user_data in source.data.get("users", {}).items():
+            conn.execute(
+                "INSERT OR REPLACE INTO users (user_id, total_sessions, total_time, last_active) VALUES (?, ?, ?, ?)",
+                (user_key, user_data["total_sessions"], user_data["total_time"], user_data["last_active"])
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_tasks (user_id, task, sessions, time) VALUES (?, ?, ?, ?)",
+                [(user_key, task, task_data["sessions"], task_data["time"])
+                 for task, task_data in user_data.get("tasks", {}).items()]
+            )
+
+        for day, daily in source.data.get("daily_stats", {}).items():
+            conn.execute(
+                "INSERT OR REPLACE INTO daily_stats (day, sessions, time) VALUES (?, ?, ?)",
+                (day, daily["sessions"], daily["time"])
+            )
+            # По дням известен только состав пользователей, без их времени
+            conn.executemany(
+                "INSERT OR IGNORE INTO daily_users (day, user_id) VALUES (?, ?)",
+                [(day, user_key) for user_key in daily["users"]]
+            )
+        # Время по дням известно из индекса дней пользователя
+        for user_key, user_data in source.data.get("users", {}).items():
+            conn.executemany(
+                "INSERT OR REPLACE INTO daily_users (day, user_id, sessions, time) VALUES (?, ?, ?, ?)",
+                [(day, user_key, sessions, time) for day, (sessions, time) in user_data.get("days", {}).items()]
+            )
+        # Дни, уже свернутые в недели и месяцы (rollup.py), восстанавливаем по дням пользователей
+        conn.execute(
+            "INSERT OR IGNORE INTO daily_stats (day, sessions, time) "
+            "SELECT day, SUM(sessions), SUM(time) FROM daily_users GROUP BY day"
+        )
+        # Историю переносим один раз, иначе повторный запуск задвоит сессии
+        if conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None:
+            conn.executemany(
+                INSERT_SESSION,
+                ((record["u"], record["t"], record["d"], record["ts"][:10], record["ts"])
+                 for record in source._iter_history())
+            )
+        conn.execute(REBUILD_TOTALS)
+
+    source._close_journal()
+    target._executor.shutdown()
+    target._read_conn.close()
+    conn.close()
+    return len(source.data.get("users", {}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Хранилище NoProk на SQLite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Импортировать data.json в SQLite")
+    migrate.add_argument("source", nargs="?", default="data.json")
+    migrate.add_argument("target", nargs="?", default="data.db")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        base = os.path.splitext(args.source)[0]
+        if not any(os.path.exists(filename) for filename in (args.source, base + ".snap", base + ".journal")):
+            parser.error(f"Файл {args.source} не найден")
+        count = migrate_json(args.source, args.target)
+        print(f"✅ Перенесено пользователей: {count} ({args.source} → {args.target})")
@@ -0,0 +1,47 @@
+"""Кэш готовых экранов статистики.
+
+Данные статистики меняются только при сохранении сессии, поэтому в ключ
+экрана входит номер версии из базы (db.version для общих экранов,
+db.user_version(user_id) для личных) и текущий день. Сохранение сессии
+увеличивает версию, и старые записи перестают совпадать с ключами -
+их вытесняет LRU.
+"""
+from collections import OrderedDict
+
+from config import STATS_CACHE_SIZE
+
+
+class RenderCache:
+    """LRU готовых текстов: ключ -> значение"""
+
+    def __init__(self, max_size: int = STATS_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_or_render(self, key, render):
+        """Значение из кэша или результат await render(), который кэшируется"""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = await render()
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Глобальный экземпляр
+stats_cache = RenderCache()
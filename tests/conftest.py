@@ -0,0 +1,15 @@
+"""Общая настройка тестов.
+
+Модули бота лежат в корне репозитория, а глобальные база и FSM-хранилище
+создаются при импорте - направляем их во временный каталог, чтобы тесты
+не трогали рабочие файлы.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_data_dir = tempfile.mkdtemp(prefix="noprok-tests-")
+os.environ.setdefault("DB_PATH", os.path.join(_data_dir, "data.json"))
+os.environ.setdefault("FSM_PATH", os.path.join(_data_dir, "fsm.db"))
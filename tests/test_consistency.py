@@ -0,0 +1,93 @@
+"""Счетчики общей статистики сходятся с полным пересчетом после нагрузки и перезапусков"""
+import asyncio
+import logging
+import random
+
+import pytest
+
+from database import SimpleDatabase
+from sqlite_db import SQLiteDatabase
+
+BACKENDS = ("binary", "json", "sqlite")
+
+
+def open_db(backend: str, directory) -> object:
+    if backend == "sqlite":
+        return SQLiteDatabase(str(directory / "data.db"))
+    # Снимок раз в 17 записей: при перезапуске есть и снимок, и хвост журнала
+    return SimpleDatabase(str(directory / "data.json"), compact_every=17, snapshot_format=backend)
+
+
+async def workload(db, rnd: random.Random, expected: dict, ops: int, users: int = 20):
+    """Старты, паузы, продолжения и завершения сессий вперемешку"""
+    for _ in range(ops):
+        user_id = rnd.randrange(users)
+        session = db.get_session(user_id)
+        if session is None:
+            db.start_session(user_id, rnd.choice(("Работа", "Учеба")), 1500, chat_id=user_id)
+            # Сессия шла какое-то время: иначе все длительности нулевые
+            shift = rnd.randrange(60, 1500)
+            session = db.get_session(user_id)
+            session.started_at -= shift
+            session.started_mono -= shift
+        elif rnd.random() < 0.3:
+            if session.paused:
+                db.resume_session(user_id)
+            else:
+                db.pause_session(user_id)
+        else:
+            expected["sessions"] += 1
+            expected["time"] += await db.end_session(user_id)
+
+
+async def assert_consistent(db, expected: dict):
+    assert await db.check_consistency()
+    stats = await db.get_global_stats()
+    assert stats["total_sessions"] == expected["sessions"]
+    assert round(stats["total_time_hours"] * 3600) == expected["time"]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_counters_survive_restarts(backend, tmp_path):
+    async def scenario():
+        rnd = random.Random(1)
+        expected = {"sessions": 0, "time": 0}
+
+        db = open_db(backend, tmp_path)
+        await workload(db, rnd, expected, 300)
+        await assert_consistent(db, expected)
+        active = len(db.active_sessions)
+        await db.close()
+
+        db = open_db(backend, tmp_path)  # Проигрывание журнала (SQLite - чтение таблиц)
+        assert len(db.active_sessions) == active
+        await assert_consistent(db, expected)
+        await workload(db, rnd, expected, 300)
+        await assert_consistent(db, expected)
+        await db.checkpoint()
+        await db.close()
+
+        db = open_db(backend, tmp_path)  # Только снимок, журнал пуст
+        await assert_consistent(db, expected)
+        await db.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_drift_is_reported(backend, tmp_path, caplog):
+    async def scenario():
+        db = open_db(backend, tmp_path)
+        await workload(db, random.Random(2), {"sessions": 0, "time": 0}, 100)
+        if backend == "sqlite":
+            await db._writer.flush()
+            with db._write_conn:
+                db._write_conn.execute("UPDATE global_stats SET sessions = sessions + 1 WHERE id = 1")
+        else:
+            db.totals["sessions"] += 1
+        with caplog.at_level(logging.WARNING):
+            assert not await db.check_consistency()
+        await db.close()
+
+    asyncio.run(scenario())
+    assert "разошлись" in caplog.text
@@ -0,0 +1,102 @@
+"""SQLite FSM-хранилище: общее для нескольких процессов и переживает перезапуск"""
+import asyncio
+import multiprocessing
+import random
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+
+USERS = 20
+OPS = 300
+STATE = "PomodoroStates:waiting_for_custom_task"
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def _worker(filename: str, worker: int, results):
+    """Процесс бота: чтения и записи в данные тех же пользователей, что и у соседа"""
+    async def load():
+        storage = SQLiteStorage(filename)
+        written = {}
+        rnd = random.Random(worker)
+        for i in range(OPS):
+            user_id = rnd.randrange(USERS)
+            if rnd.random() < 0.5:
+                await storage.get_data(key(user_id))
+            else:
+                await storage.update_data(key(user_id), {f"w{worker}": i})
+                written[user_id] = i
+        await storage.close()
+        return written
+
+    results.put((worker, asyncio.run(load())))
+
+
+def test_two_processes_lose_no_updates(tmp_path):
+    filename = str(tmp_path / "fsm.db")
+    SQLiteStorage(filename)._conn.close()  # Схема до старта процессов
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=_worker, args=(filename, worker, results)) for worker in range(2)]
+    for process in processes:
+        process.start()
+    reports = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    async def check():
+        storage = SQLiteStorage(filename)
+        for worker, written in reports:
+            assert written
+            for user_id, value in written.items():
+                data = await storage.get_data(key(user_id))
+                assert data[f"w{worker}"] == value
+        await storage.close()
+
+    asyncio.run(check())
+
+
+def test_cache_sees_writes_from_another_process(tmp_path):
+    filename = str(tmp_path / "fsm.db")
+
+    async def check():
+        reader = SQLiteStorage(filename)
+        writer = SQLiteStorage(filename)  # Отдельное соединение, как у второго процесса
+        await reader.set_data(key(1), {"task": "old"})
+        assert await reader.get_data(key(1)) == {"task": "old"}  # Теперь в кэше
+
+        await writer.set_data(key(1), {"task": "new"})
+        await writer.set_state(key(1), STATE)
+        assert await reader.get_data(key(1)) == {"task": "new"}
+        assert await reader.get_state(key(1)) == STATE
+        await reader.close()
+        await writer.close()
+
+    asyncio.run(check())
+
+
+def test_state_survives_reopen(tmp_path):
+    filename = str(tmp_path / "fsm.db")
+
+    async def check():
+        storage = SQLiteStorage(filename)
+        await storage.set_state(key(7), STATE)
+        await storage.update_data(key(7), {"task_name": "Экзамен"})
+        await storage.close()
+
+        storage = SQLiteStorage(filename)
+        assert await storage.get_state(key(7)) == STATE
+        assert await storage.get_data(key(7)) == {"task_name": "Экзамен"}
+        await storage.set_state(key(7), None)
+        await storage.close()
+
+        storage = SQLiteStorage(filename)
+        assert await storage.get_state(key(7)) is None
+        await storage.close()
+
+    asyncio.run(check())
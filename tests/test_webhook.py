@@ -0,0 +1,94 @@
+"""Webhook-сервер: секретный токен, обработка апдейтов и /health"""
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.filters import CommandStart
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import create_app
+
+SECRET = "test-secret"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class StubSession(BaseSession):
+    """Сессия бота без сети: запросов к Telegram быть не должно"""
+
+    async def make_request(self, bot, method, timeout=None):
+        raise AssertionError(f"Неожиданный запрос к Telegram: {method}")
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def start_update(update_id: int, user_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": "Test"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+               "from": user, "text": "/start"}
+    return {"update_id": update_id, "message": message}
+
+
+def run_with_client(scenario):
+    """Поднять приложение create_app с отдельным роутером и выполнить scenario(client, handled)"""
+    async def main():
+        handled = []
+        router = Router()
+
+        @router.message(CommandStart())
+        async def start(message):
+            handled.append(message.from_user.id)
+
+        dispatcher = Dispatcher()
+        dispatcher.include_router(router)
+        bot = Bot(token="123456:TEST", session=StubSession())
+        async with TestClient(TestServer(create_app(dispatcher, bot, SECRET))) as client:
+            await scenario(client, handled)
+
+    asyncio.run(main())
+
+
+async def wait_for(predicate, timeout: float = 2.0):
+    """Обработчики работают в фоне: ждем, пока условие выполнится"""
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+def test_rejects_wrong_or_missing_secret():
+    async def scenario(client, handled):
+        for headers in ({SECRET_HEADER: "wrong"}, {}):
+            response = await client.post("/webhook", json=start_update(1, 1), headers=headers)
+            assert response.status == 401
+        await asyncio.sleep(0.1)
+        assert handled == []
+
+    run_with_client(scenario)
+
+
+def test_handles_updates_with_secret():
+    async def scenario(client, handled):
+        for user_id in range(1, 21):
+            response = await client.post("/webhook", json=start_update(user_id, user_id),
+                                         headers={SECRET_HEADER: SECRET})
+            assert response.status == 200
+        await wait_for(lambda: len(handled) == 20)
+        assert sorted(handled) == list(range(1, 21))
+
+    run_with_client(scenario)
+
+
+def test_health():
+    async def scenario(client, handled):
+        response = await client.get("/health")
+        assert response.status == 200
+        health = await response.json()
+        assert health["status"] == "ok"
+        assert health["mode"] == "webhook"
+        assert isinstance(health["active_sessions"], int)
+
+    run_with_client(scenario)
@@ -0,0 +1,212 @@
+"""Анти-флуд: ограничение частоты нажатий на пользователя.
+
+У каждого пользователя на каждый класс обработчиков свое ведро токенов:
+нажатие тратит токен, токены копятся со скоростью rate до запаса burst.
+Класс задается флагом обработчика throttle (у кнопок - в реестре кнопок),
+без флага - "default". Сверх лимита апдейт отбрасывается; о первом
+отброшенном в серии пользователь получает одно предупреждение, а на
+остальные колбэки бот отвечает молча, чтобы у кнопки не крутился индикатор.
+
+Повтор того же нажатия (тот же текст или данные колбэка), пока первое еще
+обрабатывается, сливается с ним: повтор отбрасывается, не тратя токен.
+
+Работает в две ступени. Класс обработчика известен только после
+маршрутизации, то есть уже после того, как aiogram прочитал состояние FSM
+из хранилища. Поэтому outer middleware апдейтов guard стоит перед FSM и
+отбрасывает повторы и нажатия, для которых ведро уже пусто: класс берется
+тот, что внутренняя ступень узнала для того же текста или данных колбэка.
+Внутренняя ступень тратит токены и ловит первое нажатие сверх лимита -
+флуд дальше до хранилища не доходит.
+
+Ведра лежат в OrderedDict по времени последнего нажатия. Ведро, которое
+не трогали дольше времени полного пополнения, ничем не отличается от
+нового и удаляется; всего ведер не больше max_entries.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+
+from config import THROTTLE_MAX_ENTRIES, THROTTLE_RULES
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_TEXT = "⏳ Слишком часто! Подожди пару секунд."
+
+
+class Bucket:
+    """Ведро токенов одного пользователя в одном классе"""
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.warned = False  # Предупреждение в этой серии уже отправлено
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Middleware обработчиков сообщений и колбэков: ведра токенов на пользователя"""
+
+    def __init__(self, rules: dict = THROTTLE_RULES, max_entries: int = THROTTLE_MAX_ENTRIES):
+        self.rules = rules  # класс -> (токенов в секунду, запас)
+        self.max_entries = max_entries
+        # Через столько секунд простоя любое ведро снова полное
+        self.idle = max(burst / rate for rate, burst in rules.values())
+        self._buckets = OrderedDict()  # (user_id, класс) -> Bucket
+        self._running = set()  # (user_id, текст или данные колбэка) в обработке
+        self._classes = OrderedDict()  # текст или данные колбэка -> класс их обработчика
+
+        # Метрики
+        self.passed = 0
+        self.throttled = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def install(self, dispatcher):
+        """Подключить к диспетчеру: ступень guard - перед FSM, основную - к сообщениям и колбэкам"""
+        observer = dispatcher.update.outer_middleware
+        registered = list(observer)
+        index = registered.index(dispatcher.fsm) if dispatcher.fsm in registered else len(registered)
+        for middleware in registered[index:]:
+            observer.unregister(middleware)
+        observer.register(self.guard)
+        for middleware in registered[index:]:
+            observer.register(middleware)
+        dispatcher.message.middleware(self)
+        dispatcher.callback_query.middleware(self)
+
+    async def guard(self, handler, update, data):
+        """Outer middleware апдейтов: отбросить повтор или флуд до чтения состояния FSM"""
+        event = update.message or update.callback_query
+        user = data.get("event_from_user")
+        if event is None or user is None:
+            return await handler(update, data)
+
+        payload = self._payload(event)
+        request = (user.id, payload)
+        if request in self._running:
+            self.coalesced += 1
+            await self._answer(event)
+            return None
+
+        throttle_class = self._classes.get(payload)
+        if throttle_class is not None:
+            bucket = self._peek((user.id, throttle_class), time.monotonic())
+            if bucket is not None:
+                await self._reject(event, bucket)
+                return None
+
+        self._running.add(request)
+        try:
+            return await handler(update, data)
+        finally:
+            self._running.discard(request)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        button = data.get("button")
+        throttle_class = button.throttle if button is not None else get_flag(data, "throttle", default="default")
+        self._learn(self._payload(event), throttle_class)
+        bucket = self._take((user.id, throttle_class), time.monotonic())
+        if bucket is not None:
+            await self._reject(event, bucket)
+            return None
+
+        self.passed += 1
+        return await handler(event, data)
+
+    @staticmethod
+    def _payload(event):
+        return event.data if isinstance(event, CallbackQuery) else event.text
+
+    def _learn(self, payload, throttle_class: str):
+        """Запомнить класс обработчика для guard; записей не больше max_entries"""
+        if self._classes.get(payload) == throttle_class:
+            self._classes.move_to_end(payload)
+            return
+        self._classes[payload] = throttle_class
+        self._classes.move_to_end(payload)
+        if len(self._classes) > self.max_entries:
+            self._classes.popitem(last=False)
+
+    async def _reject(self, event, bucket: Bucket):
+        """Отбросить нажатие сверх лимита: предупредить один раз за серию"""
+        self.throttled += 1
+        if not bucket.warned:
+            bucket.warned = True
+            await self._answer(event, THROTTLED_TEXT)
+        else:
+            await self._answer(event)
+
+    @staticmethod
+    async def _answer(event, text: str = None):
+        """Ответить на отброшенный апдейт: колбэку - всплывающим уведомлением
+        или молча (иначе у кнопки крутится индикатор), сообщению - только с текстом"""
+        if text is None and not isinstance(event, CallbackQuery):
+            return
+        try:
+            await event.answer(text)
+        except Exception as e:
+            # Колбэк мог устареть: Telegram принимает ответ только в первые секунды
+            logger.debug(f"Ответ анти-флуда не отправлен: {e}")
+
+    def _take(self, key: tuple, now: float):
+        """Потратить токен. Возвращает ведро, если токенов нет, иначе None"""
+        self._expire(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = Bucket(self.rules[key[1]][1], now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._refill(key, bucket, now)
+
+        if bucket.tokens < 1:
+            return bucket
+        bucket.tokens -= 1
+        bucket.warned = False
+        return None
+
+    def _peek(self, key: tuple, now: float):
+        """Ведро, если токенов нет, иначе None. Токен не тратится, новое ведро не заводится"""
+        self._expire(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return None
+        self._refill(key, bucket, now)
+        return bucket if bucket.tokens < 1 else None
+
+    def _refill(self, key: tuple, bucket: Bucket, now: float):
+        rate, burst = self.rules[key[1]]
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        self._buckets.move_to_end(key)
+
+    def _expire(self, now: float):
+        """Убрать ведра, которые успели пополниться целиком"""
+        deadline = now - self.idle
+        while self._buckets:
+            bucket = next(iter(self._buckets.values()))
+            if bucket.updated > deadline:
+                break
+            self._buckets.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._buckets),
+            "passed": self.passed,
+            "throttled": self.throttled,
+            "coalesced": self.coalesced,
+        }
+
+
+# Глобальный экземпляр
+throttle = ThrottlingMiddleware()
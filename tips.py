@@ -0,0 +1,68 @@
+import json
+import os
+from collections import OrderedDict
+from math import gcd
+
+TIPS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tips.json")
+DEFAULT_TIP = "💡 Хороший совет — начать прямо сейчас!"
+RANDOM_CATEGORY = "random"
+
+
+class TipCatalog:
+    """Неизменяемый каталог советов с индексами по категориям.
+
+    Советы загружаются из tips.json один раз. Для каждой категории
+    (и для общего списка "random") хранится кортеж, так что выбор
+    совета - это вычисление индекса без построения списков.
+
+    Чтобы советы не повторялись, пользователь проходит категорию по
+    собственной перестановке: i-й совет - (offset + step * i) mod n,
+    где step взаимно прост с n. За n показов пользователь увидит все
+    советы ровно по разу. Хранится только счетчик i на пару
+    (пользователь, категория) в LRU ограниченного размера.
+    """
+
+    def __init__(self, tips_by_category: dict, max_cursors: int = 50_000):
+        categories = {name: tuple(tips) for name, tips in tips_by_category.items() if tips}
+        categories[RANDOM_CATEGORY] = tuple(tip for tips in categories.values() for tip in tips)
+
+        self._tips = categories
+        self._category_ids = {name: index for index, name in enumerate(categories)}
+        # Шаги перестановки для каждой категории - все числа, взаимно простые с n
+        self._steps = {name: tuple(step for step in range(1, len(tips) + 1) if gcd(step, len(tips)) == 1)
+                       for name, tips in categories.items()}
+        self._cursors = OrderedDict()  # (user_id * число категорий + id категории) -> счетчик
+        self.max_cursors = max_cursors
+
+    @classmethod
+    def load(cls, filename: str = TIPS_FILE):
+        with open(filename, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @property
+    def categories(self):
+        return tuple(self._tips)
+
+    def __len__(self):
+        return len(self._tips[RANDOM_CATEGORY])
+
+    def next_tip(self, user_id: int, category: str) -> str:
+        """Следующий совет для пользователя без повторов в пределах категории"""
+        tips = self._tips.get(category)
+        if not tips:
+            return DEFAULT_TIP
+
+        key = user_id * len(self._tips) + self._category_ids[category]
+        counter = self._cursors.pop(key, 0)
+        self._cursors[key] = counter + 1
+        if len(self._cursors) > self.max_cursors:
+            self._cursors.popitem(last=False)
+
+        steps = self._steps[category]
+        n = len(tips)
+        step = steps[user_id % len(steps)]
+        return tips[(user_id + step * counter) % n]
+
+
+# Глобальный экземпляр
+catalog = TipCatalog.load()
@@ -0,0 +1,37 @@
+"""Webhook-сервер: обработчик обновлений Telegram и /health.
+
+Вынесен из main, чтобы приложение можно было собрать вокруг любого
+диспетчера и бота - например, в бенчмарке с заглушкой вместо Telegram.
+"""
+from aiogram import Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from database import db
+
+
+async def health(request: web.Request):
+    """Проверка живости для Railway и мониторинга"""
+    return web.json_response({
+        "status": "ok",
+        "mode": "webhook",
+        "active_sessions": len(db.active_sessions)
+    })
+
+
+def create_app(dispatcher: Dispatcher, bot, secret_token: str, path: str = "/webhook") -> web.Application:
+    """aiohttp-приложение: обработчик обновлений Telegram и /health.
+
+    Каждое обновление обрабатывается в отдельной задаче, а Telegram сразу
+    получает ответ 200, так что медленный обработчик не держит остальные.
+    Запросы без правильного секретного токена отклоняются с 401.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=True
+    ).register(app, path=path)
+    app.router.add_get("/health", health)
+    return app
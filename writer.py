@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """Единственный писатель базы с групповой фиксацией.
+
+    Все изменения попадают в одну очередь. Задача-писатель забирает
+    первое изменение, ждет batch_window секунд, пока подтянутся соседние,
+    и фиксирует всю пачку одним вызовом commit(ops) в отдельном потоке.
+    Каждый submit возвращает future, который завершается после фиксации.
+    """
+
+    def __init__(self, commit, batch_window: float = 0.005, max_batch: int = 1000):
+        self._commit = commit
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+        self.commits = 0  # Сколько пачек зафиксировано
+        self.committed_ops = 0  # Сколько изменений в них вошло
+
+    def submit(self, op) -> asyncio.Future:
+        """Поставить изменение в очередь на фиксацию"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, future))
+        return future
+
+    @property
+    def pending(self) -> int:
+        """Сколько изменений ждут фиксации"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def flush(self):
+        """Дождаться фиксации всего, что уже поставлено в очередь"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Зафиксировать очередь и остановить писателя"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = self._queue = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_window:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await asyncio.to_thread(self._commit, [op for op, _ in batch])
+            except Exception as e:
+                logger.error(f"Ошибка записи в базу: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                self.commits += 1
+                self.committed_ops += len(batch)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()